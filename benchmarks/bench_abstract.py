@@ -0,0 +1,86 @@
+"""
+Benchmark the declaration and setup of many entities sharing a common abstract
+base class, comparing the cloning of the base properties templates with the
+previous behavior of deep-copying them (and looking them up with dir()) for
+each subclass.
+
+Each measurement runs in its own process so that the reported peak memory
+usage (maximum resident set size, in kB on Linux) is meaningful.
+
+Usage: python benchmarks/bench_abstract.py [num_entities ...]
+"""
+
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from copy import deepcopy
+
+from elixir import *
+from elixir.entity import EntityDescriptor, getmembers
+from elixir.properties import Property
+
+
+def declare_model(num_entities):
+    class Audited(Entity):
+        using_options(abstract=True)
+
+        created_by = Field(Unicode(64), nullable=False, default=u'system',
+                           info={'audit': True})
+        created_at = Field(DateTime, index=True)
+        modified_by = Field(Unicode(64), info={'audit': True})
+        modified_at = Field(DateTime, index=True)
+        revision = Field(Integer, nullable=False, default=0)
+        comment = Field(UnicodeText, deferred=True)
+
+    for i in range(num_entities):
+        type('Entity%d' % i, (Audited,), {
+            '__module__': __name__,
+            'name': Field(String(30))
+        })
+
+
+def use_deepcopy():
+    Property.clone = lambda self: deepcopy(self)
+    EntityDescriptor.property_templates = property(
+        lambda self: getmembers(self.entity,
+                                lambda a: isinstance(a, Property)))
+
+
+def run(num_entities, mode):
+    if mode == 'deepcopy':
+        use_deepcopy()
+    start = time.time()
+    declare_model(num_entities)
+    declared = time.time()
+    setup_all()
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return declared - start, time.time() - start, maxrss
+
+
+def measure(num_entities, mode):
+    output = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                               '--run', str(num_entities), mode],
+                              stdout=subprocess.PIPE).communicate()[0]
+    declare, total, maxrss = output.split()
+    return float(declare), float(total), int(maxrss)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        print "%f %f %d" % run(int(sys.argv[2]), sys.argv[3])
+        sys.exit(0)
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 300, 1000]
+    print "%8s %22s %22s %22s" % ('', 'declaration (s)',
+                                  'declaration+setup (s)', 'peak memory (kB)')
+    print "%8s %11s %10s %11s %10s %11s %10s" % (
+        'entities', 'template', 'deepcopy', 'template', 'deepcopy',
+        'template', 'deepcopy')
+    for size in sizes:
+        t_decl, t_total, t_mem = measure(size, 'template')
+        d_decl, d_total, d_mem = measure(size, 'deepcopy')
+        print "%8d %11.3f %10.3f %11.3f %10.3f %11d %10d" % (
+            size, t_decl, d_decl, t_total, d_total, t_mem, d_mem)
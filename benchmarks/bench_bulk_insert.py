@@ -0,0 +1,49 @@
+"""
+Benchmark inserting many rows, comparing Entity.bulk_insert with creating
+instances and flushing them through the session.
+
+Usage: python benchmarks/bench_bulk_insert.py [num_rows ...]
+"""
+
+import sys
+import time
+
+from elixir import *
+
+
+class Movie(Entity):
+    title = Field(String(60))
+    year = Field(Integer)
+    rating = Field(Integer, default=0)
+    using_options(version_id_col=True)
+
+
+def rows(num_rows):
+    return [dict(title='Movie %d' % i, year=1900 + i % 100)
+            for i in xrange(num_rows)]
+
+
+def run(num_rows, bulk):
+    data = rows(num_rows)
+    start = time.time()
+    if bulk:
+        Movie.bulk_insert(data)
+    else:
+        for row in data:
+            Movie(**row)
+    session.commit()
+    duration = time.time() - start
+    session.expunge_all()
+    assert Movie.query.count() == num_rows
+    Movie.table.delete().execute()
+    return duration
+
+
+if __name__ == '__main__':
+    metadata.bind = 'sqlite://'
+    setup_all(True)
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    print "%10s %12s %16s" % ('rows', 'ORM (s)', 'bulk_insert (s)')
+    for size in sizes:
+        print "%10d %12.4f %16.4f" % (size, run(size, False), run(size, True))
@@ -0,0 +1,48 @@
+"""
+Benchmark loading many instances by primary key, comparing Entity.get_many
+with calling Entity.get in a loop. The session is emptied before each run, so
+that all instances need to be loaded from the database.
+
+Usage: python benchmarks/bench_get_many.py [num_ids ...]
+"""
+
+import random
+import sys
+import time
+
+from elixir import *
+
+
+class Movie(Entity):
+    title = Field(String(60))
+    year = Field(Integer)
+
+
+def populate(num_rows):
+    for i in range(num_rows):
+        Movie(title='Movie %d' % i, year=1900 + i % 100)
+    session.commit()
+
+
+def run(ids, many):
+    session.expunge_all()
+    start = time.time()
+    if many:
+        movies = Movie.get_many(ids)
+    else:
+        movies = [Movie.get(ident) for ident in ids]
+    duration = time.time() - start
+    assert len([m for m in movies if m is not None]) == len(ids)
+    return duration
+
+
+if __name__ == '__main__':
+    metadata.bind = 'sqlite://'
+    setup_all(True)
+    populate(20000)
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 500, 5000]
+    print "%10s %12s %12s" % ('ids', 'get (s)', 'get_many (s)')
+    for size in sizes:
+        ids = random.sample(xrange(1, 20001), size)
+        print "%10d %12.4f %12.4f" % (size, run(ids, False), run(ids, True))
@@ -0,0 +1,57 @@
+"""
+Benchmark the setup of models where some entities have many relationships,
+comparing the indexed inverse relationship matching with a full scan of the
+relationships of the target entity.
+
+Usage: python benchmarks/bench_inverse.py [num_entities ...]
+"""
+
+import sys
+import time
+
+from elixir import *
+from elixir.entity import EntityDescriptor
+
+
+def declare_model(num_entities):
+    # one "hub" entity, related to all others, each of them also related to
+    # the hub. Inverses are not specified so that Elixir needs to match them.
+    hub_attrs = {'__module__': __name__, 'name': Field(String(30))}
+    for i in range(num_entities):
+        hub_attrs['leaves%d' % i] = OneToMany('Leaf%d' % i)
+        hub_attrs['tags%d' % i] = ManyToMany('Leaf%d' % i)
+    type('Hub', (Entity,), hub_attrs)
+
+    for i in range(num_entities):
+        type('Leaf%d' % i, (Entity,), {
+            '__module__': __name__,
+            'name': Field(String(30)),
+            'hub': ManyToOne('Hub'),
+            'hubs': ManyToMany('Hub')
+        })
+
+
+def scan_candidates(self, rel):
+    return self.relationships
+
+
+def run(num_entities, scan):
+    indexed_candidates = EntityDescriptor._inverse_candidates
+    if scan:
+        EntityDescriptor._inverse_candidates = scan_candidates
+    try:
+        declare_model(num_entities)
+        start = time.time()
+        setup_all()
+        duration = time.time() - start
+    finally:
+        EntityDescriptor._inverse_candidates = indexed_candidates
+        cleanup_all()
+    return duration
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [250, 500, 1000]
+    print "%10s %12s %12s" % ('entities', 'indexed (s)', 'scan (s)')
+    for size in sizes:
+        print "%10d %12.3f %12.3f" % (size, run(size, False), run(size, True))
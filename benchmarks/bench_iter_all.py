@@ -0,0 +1,52 @@
+"""
+Benchmark iterating over all the rows of a large table with Entity.iter_all,
+reporting the time taken and the growth of the peak memory usage of the
+process during the iteration (which should not depend on the number of rows).
+
+Usage: python benchmarks/bench_iter_all.py [num_rows [batch_size]]
+"""
+
+import resource
+import sys
+import time
+
+from elixir import *
+
+
+class Movie(Entity):
+    title = Field(String(60))
+    year = Field(Integer)
+
+
+def peak_memory():
+    # in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def populate(num_rows):
+    batch = 10000
+    for start in xrange(0, num_rows, batch):
+        end = min(num_rows, start + batch)
+        Movie.bulk_insert([dict(title='Movie %d' % i, year=1900 + i % 100)
+                           for i in xrange(start, end)])
+    session.commit()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    num_rows = args and int(args[0]) or 2000000
+    batch_size = len(args) > 1 and int(args[1]) or 1000
+
+    metadata.bind = 'sqlite://'
+    setup_all(True)
+    populate(num_rows)
+
+    before = peak_memory()
+    start = time.time()
+    count = 0
+    for movie in Movie.iter_all(batch_size=batch_size):
+        count += 1
+    duration = time.time() - start
+    assert count == num_rows
+    print "%d rows in %.2fs, peak memory growth: %d kB" \
+          % (count, duration, peak_memory() - before)
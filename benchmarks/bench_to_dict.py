@@ -0,0 +1,83 @@
+"""
+Benchmark Entity.to_dict on instances already loaded in the session, for a
+flat and a nested serialization. The "interpreted" column is the time taken
+by the implementation computing the column and relationship information on
+each call, the "compiled" one uses the serializers cached on the entities.
+
+Usage: python benchmarks/bench_to_dict.py [num_calls]
+"""
+
+import sys
+import time
+
+from elixir import *
+from sqlalchemy.orm.properties import ColumnProperty
+
+
+class Director(Entity):
+    name = Field(String(60))
+    birth_year = Field(Integer)
+    movies = OneToMany('Movie')
+
+
+class Movie(Entity):
+    title = Field(String(60))
+    year = Field(Integer)
+    rating = Field(Integer)
+    summary = Field(String(200))
+    director = ManyToOne('Director')
+
+
+def interpreted_to_dict(self, deep={}, exclude=[]):
+    col_prop_names = [p.key for p in self.mapper.iterate_properties \
+                                  if isinstance(p, ColumnProperty)]
+    data = dict([(name, getattr(self, name))
+                 for name in col_prop_names if name not in exclude])
+    for rname, rdeep in deep.iteritems():
+        dbdata = getattr(self, rname)
+        fks = self.mapper.get_property(rname).remote_side
+        exclude = [c.name for c in fks]
+        if dbdata is None:
+            data[rname] = None
+        elif isinstance(dbdata, list):
+            data[rname] = [interpreted_to_dict(o, rdeep, exclude)
+                           for o in dbdata]
+        else:
+            data[rname] = interpreted_to_dict(dbdata, rdeep, exclude)
+    return data
+
+
+def populate():
+    director = Director(name='Some director', birth_year=1950)
+    for i in range(5):
+        Movie(title='Movie %d' % i, year=1990 + i, rating=i,
+              summary='A summary', director=director)
+    session.commit()
+
+
+def run(func, obj, deep, num_calls):
+    start = time.time()
+    for i in xrange(num_calls):
+        func(obj, deep)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    metadata.bind = 'sqlite://'
+    setup_all(True)
+    populate()
+
+    num_calls = sys.argv[1:] and int(sys.argv[1]) or 20000
+    movie = Movie.query.first()
+    director = movie.director
+    director.movies
+
+    cases = [('movie', movie, {}),
+             ('movie+director', movie, {'director': {}}),
+             ('director+movies', director, {'movies': {}})]
+    print "%20s %16s %16s" % ('shape', 'interpreted (s)', 'compiled (s)')
+    for name, obj, deep in cases:
+        assert interpreted_to_dict(obj, deep) == obj.to_dict(deep)
+        print "%20s %16.4f %16.4f" % (name,
+            run(interpreted_to_dict, obj, deep, num_calls),
+            run(Movie.to_dict.im_func, obj, deep, num_calls))
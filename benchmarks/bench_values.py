@@ -0,0 +1,45 @@
+"""
+Benchmark listing a few columns of many rows, comparing loading instances
+through Entity.query with selecting named tuples through Entity.values.
+
+Usage: python benchmarks/bench_values.py [num_rows]
+"""
+
+import sys
+import time
+
+from elixir import *
+
+
+class Movie(Entity):
+    title = Field(String(60))
+    year = Field(Integer)
+    description = Field(String(200))
+    rating = Field(Integer)
+
+
+def populate(num_rows):
+    Movie.bulk_insert([dict(title='Movie %d' % i, year=1900 + i % 100,
+                            description='A movie', rating=i % 5)
+                       for i in range(num_rows)])
+    session.commit()
+
+
+def run(func):
+    session.expunge_all()
+    start = time.time()
+    rows = [(row.id, row.title) for row in func()]
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    num_rows = sys.argv[1:] and int(sys.argv[1]) or 50000
+
+    metadata.bind = 'sqlite://'
+    setup_all(True)
+    populate(num_rows)
+
+    query = lambda: Movie.query.order_by(Movie.title).all()
+    values = lambda: Movie.values('id', 'title').order_by(Movie.title).all()
+    print "%10s %12s %12s" % ('rows', 'query (s)', 'values (s)')
+    print "%10d %12.4f %12.4f" % (num_rows, run(query), run(values))
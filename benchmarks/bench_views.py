@@ -0,0 +1,81 @@
+"""
+Benchmark loading all the rows of a table as instances of the entity (through
+Entity.query), as named tuples (through Entity.values) and as instances of
+the View class of the entity (through Entity.views), reporting the number of
+rows built per second and the memory taken by each row.
+
+Each mode is run in a forked process, so that the growth of its peak memory
+usage can be measured independently.
+
+Usage: python benchmarks/bench_views.py [num_rows]
+"""
+
+import os
+import resource
+import sys
+import time
+
+from elixir import *
+
+
+class Movie(Entity):
+    title = Field(String(60))
+    year = Field(Integer)
+    description = Field(String(200))
+    rating = Field(Integer)
+
+
+def populate(num_rows):
+    Movie.bulk_insert([dict(title='Movie %d' % i, year=1900 + i % 100,
+                            description='A movie', rating=i % 5)
+                       for i in range(num_rows)])
+    session.commit()
+
+
+def peak_memory():
+    # in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+modes = [
+    ('query', lambda: Movie.query.all()),
+    ('values', lambda: Movie.values().all()),
+    ('views', lambda: list(Movie.views())),
+]
+
+
+def run(load, num_rows):
+    '''
+    Returns the rows per second and bytes per row for the `load` function,
+    measured in a child process.
+    '''
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        before = peak_memory()
+        start = time.time()
+        rows = load()
+        duration = time.time() - start
+        assert len(rows) == num_rows
+        growth = (peak_memory() - before) * 1024
+        os.write(write, '%f %f' % (num_rows / duration,
+                                   float(growth) / num_rows))
+        os._exit(0)
+    os.close(write)
+    result = os.read(read, 100)
+    os.waitpid(pid, 0)
+    return [float(value) for value in result.split()]
+
+
+if __name__ == '__main__':
+    num_rows = sys.argv[1:] and int(sys.argv[1]) or 100000
+
+    metadata.bind = 'sqlite://'
+    setup_all(True)
+    populate(num_rows)
+
+    print "%10s %12s %12s" % ('mode', 'rows/s', 'bytes/row')
+    for name, load in modes:
+        rate, size = run(load, num_rows)
+        print "%10s %12d %12d" % (name, rate, size)
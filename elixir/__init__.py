@@ -27,7 +27,8 @@ from elixir.options import using_options, using_table_options, \
                            using_mapper_options, options_defaults, \
                            using_options_defaults
 from elixir.entity import Entity, EntityBase, EntityMeta, EntityDescriptor, \
-                          setup_entities, cleanup_entities
+                          setup_entities, setup_entities_lazily, \
+                          cleanup_entities, is_setup
 from elixir.fields import has_field, Field
 from elixir.relationships import belongs_to, has_one, has_many, \
                                  has_and_belongs_to_many, \
@@ -36,6 +37,11 @@ from elixir.properties import has_property, GenericProperty, ColumnProperty, \
                               Synonym
 from elixir.statements import Statement
 from elixir.collection import EntityCollection, GlobalEntityCollection
+from elixir.schemacache import SchemaCache
+from elixir.profiler import SetupProfile
+from elixir.snapshot import Snapshot
+from elixir.graph import EntityGraph
+from elixir.loading import prefetch
 
 
 __version__ = '0.8.0dev'
@@ -50,12 +56,12 @@ __all__ = ['Entity', 'EntityBase', 'EntityMeta', 'EntityCollection',
            'options_defaults', 'using_options_defaults',
            'metadata', 'session',
            'create_all', 'drop_all',
-           'setup_all', 'cleanup_all',
-           'setup_entities', 'cleanup_entities'] + \
+           'setup_all', 'cleanup_all', 'snapshot_all',
+           'setup_entities', 'cleanup_entities', 'prefetch'] + \
            sqlalchemy.types.__all__
 
 __doc_all__ = ['create_all', 'drop_all',
-               'setup_all', 'cleanup_all',
+               'setup_all', 'cleanup_all', 'snapshot_all',
                'metadata', 'session']
 
 # default session
@@ -71,26 +77,94 @@ entities = GlobalEntityCollection()
 
 
 def create_all(*args, **kwargs):
-    '''Create the necessary tables for all declared entities'''
-    for md in metadatas:
-        md.create_all(*args, **kwargs)
+    '''Create the necessary tables for all declared entities, the tables of
+    independent entities in separate batches (see `EntityGraph`)'''
+    _create_tables(EntityGraph(entities), {}, *args, **kwargs)
 
 
 def drop_all(*args, **kwargs):
-    '''Drop tables for all declared entities'''
+    '''Drop tables for all declared entities, in the reverse order of
+    create_all'''
+    graph = EntityGraph(entities)
+    for md in metadatas:
+        for tables in reversed(graph.table_batches(md)):
+            md.drop_all(tables=tables, *args, **kwargs)
+
+
+def _create_tables(graph, known, *args, **kwargs):
+    # `known` maps metadatas to the keys of the tables which must be skipped
     for md in metadatas:
-        md.drop_all(*args, **kwargs)
+        skip = known.get(md, ())
+        for tables in graph.table_batches(md):
+            tables = [table for table in tables if table.key not in skip]
+            if tables:
+                md.create_all(tables=tables, *args, **kwargs)
 
 
 def setup_all(create_tables=False, *args, **kwargs):
     '''Setup the table and mapper of all entities in the default entity
     collection.
+
+    If a filename is given as the `schema_cache` keyword argument, the
+    resolved relationships of the entities are stored in that file, and
+    reused (if still valid) by later calls, to speed up the setup of large
+    models. See the `schemacache` module for details.
+
+    If the `lazy` keyword argument is True, the entities are not setup
+    immediately. Instead, each entity is setup (along with the entities it is
+    related to) the first time it is instantiated or its `query`, `table` or
+    `mapper` attribute is accessed. Querying through `session.query(entity)`
+    does not trigger it. This cannot be combined with `create_tables`, since
+    the tables do not exist yet at this point.
+
+    Entities which are already setup are left untouched, so setup_all can be
+    called again after new entities have been declared (eg. by plugins
+    imported after the initial setup). Only the new entities are then setup,
+    and, if `create_tables` is True, only their tables are created.
+
+    A warning is issued if the foreign keys of the new entities form a cycle
+    (which prevents their tables from being created), listing the
+    relationships or fields which could use the "use_alter" argument to break
+    it.
+
+    If the `profile` keyword argument is True, the time spent in each setup
+    phase, entity and builder is recorded, and returned as a `SetupProfile`
+    object (see the `profiler` module). The creation of the tables is not
+    included in the profile.
     '''
-    setup_entities(entities)
+    schema_cache = kwargs.pop('schema_cache', None)
+    profile = kwargs.pop('profile', False) and SetupProfile() or None
+    if kwargs.pop('lazy', False):
+        if create_tables:
+            raise Exception("Cannot create the tables of entities which are "
+                            "setup lazily.")
+        if profile is not None:
+            raise Exception("Cannot profile the setup of entities which are "
+                            "setup lazily.")
+        setup_entities_lazily(entities)
+        return
+
+    pending = [e for e in entities if not is_setup(e)]
+    incremental = len(pending) < len(entities)
+    if create_tables and incremental:
+        # remember the existing tables so that we only create the new ones
+        old_tables = dict((md, set(md.tables)) for md in metadatas)
+
+    if schema_cache is not None:
+        cache = SchemaCache(schema_cache)
+        cache.apply(pending)
+    graph = EntityGraph(entities)
+    setup_entities(pending, profile, graph)
+    if schema_cache is not None:
+        cache.update(pending)
+    graph.check_cycles(pending)
 
     # issue the "CREATE" SQL statements
     if create_tables:
-        create_all(*args, **kwargs)
+        _create_tables(graph, incremental and old_tables or {},
+                       *args, **kwargs)
+
+    return profile
 
 
 def cleanup_all(drop_tables=False, *args, **kwargs):
@@ -112,3 +186,12 @@ def cleanup_all(drop_tables=False, *args, **kwargs):
     metadatas.clear()
 
 
+def snapshot_all():
+    '''Take a snapshot of the state of all entities, metadatas and mappers,
+    which must all be setup. Returns a `Snapshot` object: calling its
+    `restore` method removes all the entities, mappers and tables added since
+    the snapshot was taken, which is much faster than using cleanup_all and
+    setting up all entities again (eg. between the tests of a test suite).
+    See the `snapshot` module for details.
+    '''
+    return Snapshot(entities)
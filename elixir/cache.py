@@ -0,0 +1,519 @@
+'''
+Process-wide cache of the rows of entities, in front of the session.
+
+Each session starts with an empty identity map, so rows which are read by
+every request (users, configuration, lookup tables, ...) are selected again
+and again. The "cache" option of an entity puts a cache shared by all
+sessions (and threads) in front of `Entity.get` and of the lazy loads of the
+ManyToOne relationships targeting that entity:
+
+.. sourcecode:: python
+
+    class Country(Entity):
+        code = Field(String(2), primary_key=True)
+        name = Field(Unicode(60))
+        using_options(cache=dict(max_size=500, ttl=3600))
+
+The option accepts True (a cache using the default settings), a dictionary
+of arguments for `LRUCache`, or any object with the same interface (which can
+be shared by several entities). The cache stores the values of the column
+attributes of each row (not the instances themselves, which are bound to a
+session), indexed on its identity key, and builds an instance attached to the
+current session from them on hit. Instances already present in the session
+are always used first.
+
+Entries are invalidated whenever an instance of the entity (or of one of its
+children) is inserted, updated or deleted through a flush, and invalidated
+again if the transaction of the session which flushed it is rolled back
+(since the row might have been cached with its uncommitted values in the
+meantime). Since bulk updates and deletes (eg query.update) and changes made
+by other processes bypass the flush, you should either set a `ttl` or clear
+the cache yourself in these cases:
+
+.. sourcecode:: python
+
+    Country._descriptor.cache.clear()
+
+The cache is not transactional: until it is committed or rolled back, an
+entry loaded by a session which has flushed changes to that row is visible by
+other sessions.
+
+The lazy loads of ManyToOne relationships go through the cache by replacing
+the lazy loader strategy of SQLAlchemy, which has no public hook for this.
+The strategy supports the hooks of SQLAlchemy 0.6 and 0.7 and raises an
+exception when the relationship is setup with other versions.
+
+The cache keeps count of its hits and misses, which is useful to check how
+effective it is:
+
+.. sourcecode:: python
+
+    cache = Country._descriptor.cache
+    print cache.hits, cache.misses, len(cache)
+
+Similarly, the "get_by_cache" option caches the results of `Entity.get_by`
+for read-mostly lookups, indexed on the entity and its criteria:
+
+.. sourcecode:: python
+
+    class User(Entity):
+        user_name = Field(Unicode(16), unique=True)
+        using_options(get_by_cache=dict(max_size=5000))
+
+    User.get_by(user_name=u'bob')
+
+The identity key and the column values of the result are stored, and the
+instance is taken from the session, from the cache of the entity if it also
+uses the "cache" option, or built from these values, without any query. All
+the results cached for an entity are invalidated whenever an instance of that
+entity or of one of its children is inserted, updated or deleted through a
+flush, and again when the transaction of the session which flushed it is
+rolled back. As for the cache of rows, changes made by other processes are
+not seen until the results are invalidated, so use a `ttl` or clear the cache
+in that case. Cached results are checked against the criteria before being
+returned (in case they were changed in the session), and looked up again if
+they don't match them anymore. Lookups without result are not cached, nor are
+criteria which contain pending instances or unhashable values.
+'''
+
+import threading
+import time
+import weakref
+
+from sqlalchemy.orm import MapperExtension, SessionExtension, EXT_CONTINUE, \
+                           object_mapper, object_session, ColumnProperty
+from sqlalchemy.orm.attributes import instance_state, instance_dict, \
+                                      set_committed_value
+try:
+    from sqlalchemy import event
+except ImportError:
+    # SQLAlchemy 0.6
+    event = None
+
+from elixir.loading import CustomLazyLoader, NOT_LOADED
+
+__doc_all__ = ['LRUCache']
+
+DEFAULT_MAX_SIZE = 1000
+
+
+class LRUCache(object):
+    '''
+    A thread-safe mapping holding at most `max_size` entries, which discards
+    the least recently used entries first. If `ttl` is given, entries older
+    than `ttl` seconds are discarded too.
+    '''
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=None):
+        if max_size < 1:
+            raise ValueError("The size of a cache must be at least 1.")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> [previous, next, key, value, expiration time]
+        self._entries = {}
+        # sentinel of the circular list of entries, from the most recently
+        # used one (its next entry) to the least recently used one (its
+        # previous entry)
+        self._root = root = []
+        root[:] = [root, root, None, None, None]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and not self._expired(entry)
+
+    def _expired(self, entry):
+        return entry[4] is not None and entry[4] <= time.time()
+
+    def _unlink(self, entry):
+        previous, next = entry[0], entry[1]
+        previous[1] = next
+        next[0] = previous
+
+    def _link(self, entry):
+        root = self._root
+        first = root[1]
+        entry[0] = root
+        entry[1] = first
+        first[0] = root[1] = entry
+
+    def get(self, key, default=None):
+        '''
+        Returns the value stored for `key` (and marks it as the most recently
+        used), or `default` if it is missing or has expired.
+        '''
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._unlink(entry)
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._unlink(entry)
+            self._link(entry)
+            return entry[3]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        '''
+        Stores `value` for `key`, discarding the least recently used entry if
+        the cache is full.
+        '''
+        if self.ttl is None:
+            expiration = None
+        else:
+            expiration = time.time() + self.ttl
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._unlink(entry)
+            elif len(self._entries) >= self.max_size:
+                oldest = self._root[0]
+                self._unlink(oldest)
+                del self._entries[oldest[2]]
+            entry = [None, None, key, value, expiration]
+            self._entries[key] = entry
+            self._link(entry)
+        finally:
+            self._lock.release()
+
+    def invalidate(self, key):
+        '''
+        Discards the entry stored for `key`, if any.
+        '''
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._unlink(entry)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        '''
+        Discards all entries. The hit and miss counters are kept.
+        '''
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            root = self._root
+            root[0] = root[1] = root
+        finally:
+            self._lock.release()
+
+
+def make_cache(value):
+    '''
+    Returns the cache corresponding to the value of the "cache" option.
+    '''
+    if value is None or value is False:
+        return None
+    elif value is True:
+        return LRUCache()
+    elif isinstance(value, dict):
+        return LRUCache(**value)
+    return value
+
+
+def column_state(instance):
+    '''
+    Returns the class of `instance` and the values of its loaded column
+    attributes.
+    '''
+    mapper = object_mapper(instance)
+    dict_ = instance_dict(instance)
+    values = dict((prop.key, dict_[prop.key])
+                  for prop in mapper.iterate_properties
+                  if isinstance(prop, ColumnProperty) and prop.key in dict_)
+    return instance.__class__, values
+
+
+def cached_get(cls, session, ident):
+    '''
+    Returns the instance of `cls` with the given identifier (a tuple of the
+    values of its primary key) in `session`, taking it from the identity map
+    of the session, then from the cache of `cls`, and loading it (and storing
+    it into the cache) as a last resort.
+    '''
+    mapper = cls.mapper
+    cache = cls._descriptor.cache
+    key = mapper.identity_key_from_primary_key(list(ident))
+
+    query = session.query(cls)
+    if key in session.identity_map:
+        return query.get(ident)
+
+    cached = cache.get(key)
+    if cached is not None:
+        instance_cls, values = cached
+        # as for query.get, rows of other classes of the hierarchy (which
+        # share the identity key) are ignored
+        if issubclass(instance_cls, cls):
+            return from_column_state(session, key, instance_cls, values)
+        return None
+
+    instance = query.get(ident)
+    if instance is not None and not instance_state(instance).modified:
+        cache.set(key, column_state(instance))
+    return instance
+
+
+def from_column_state(session, key, cls, values):
+    '''
+    Builds an instance of `cls` from the values of its column attributes and
+    attaches it to `session`, without any query.
+    '''
+    mapper = cls.mapper
+    detached = mapper.class_manager.new_instance()
+    for name, value in values.iteritems():
+        set_committed_value(detached, name, value)
+    instance_state(detached).key = key
+    return session.merge(detached, load=False)
+
+
+def criteria_key(kwargs):
+    '''
+    Returns a hashable version of the criteria given to get_by, in which
+    instances are replaced by their identity key, or None if the criteria
+    cannot be used as a cache key (eg. they contain a pending instance).
+    '''
+    items = []
+    for name, value in sorted(kwargs.iteritems()):
+        try:
+            state = instance_state(value)
+        except AttributeError:
+            state = None
+        if state is not None:
+            if state.key is None:
+                return None
+            value = state.key
+        try:
+            hash(value)
+        except TypeError:
+            return None
+        items.append((name, value))
+    return tuple(items)
+
+
+def matches(instance, kwargs):
+    '''
+    Tests whether `instance` still matches the criteria given to get_by.
+    '''
+    for name, value in kwargs.iteritems():
+        current = getattr(instance, name)
+        try:
+            state = instance_state(value)
+        except AttributeError:
+            state = None
+        if state is not None:
+            if current is None or instance_state(current).key != state.key:
+                return False
+        elif current != value:
+            return False
+    return True
+
+
+def cached_get_by(cls, kwargs):
+    '''
+    Returns the first instance of `cls` matching the given criteria, using
+    the get_by cache of `cls`, which stores the identity key and the column
+    state of the result. A cached result which does not match the criteria
+    anymore is looked up again.
+    '''
+    desc = cls._descriptor
+    query = cls.query
+    session = query.session
+    # pending changes must be flushed as the query would do (which
+    # invalidates the cache if needed) before looking into the cache
+    if session.autoflush:
+        session.flush()
+
+    criteria = criteria_key(kwargs)
+    if criteria is None:
+        return query.filter_by(**kwargs).first()
+    key = (cls, desc.results_generation, criteria)
+
+    cached = desc.get_by_cache.get(key)
+    if cached is not None:
+        identity_key, (instance_cls, values) = cached
+        if desc.cache is not None:
+            instance = cached_get(cls, session, identity_key[1])
+        elif identity_key in session.identity_map:
+            instance = query.get(identity_key[1])
+        else:
+            instance = from_column_state(session, identity_key, instance_cls,
+                                         values)
+        if instance is not None and matches(instance, kwargs):
+            return instance
+        desc.get_by_cache.invalidate(key)
+
+    instance = query.filter_by(**kwargs).first()
+    # misses are not cached, since nothing would invalidate them when the
+    # row is inserted by another process
+    if instance is not None and not instance_state(instance).modified:
+        desc.get_by_cache.set(key, (instance_state(instance).key,
+                                    column_state(instance)))
+    return instance
+
+
+# the invalidations to repeat if the current transaction of each session is
+# rolled back
+_rollback_invalidations = weakref.WeakKeyDictionary()
+
+
+class RollbackExtension(SessionExtension):
+    '''
+    Repeats the invalidations recorded for a session when its transaction is
+    rolled back, and forgets them when it is committed.
+    '''
+
+    def after_commit(self, session):
+        # a released savepoint can still be rolled back with its transaction
+        transaction = session.transaction
+        if transaction is None or not transaction.nested:
+            _rollback_invalidations[session].clear()
+
+    def after_rollback(self, session):
+        invalidations = _rollback_invalidations[session]
+        for func, args in invalidations:
+            func(*args)
+        invalidations.clear()
+
+
+def invalidate_on_rollback(session, func, *args):
+    '''
+    Calls `func` with the given arguments again if the current transaction
+    of `session` is rolled back: the changes it flushed might have been
+    cached in the meantime.
+    '''
+    invalidations = _rollback_invalidations.get(session)
+    if invalidations is None:
+        invalidations = _rollback_invalidations[session] = set()
+        extension = RollbackExtension()
+        if event is not None:
+            event.listen(session, 'after_commit', extension.after_commit)
+            event.listen(session, 'after_rollback', extension.after_rollback)
+        else:
+            session.extensions.append(extension)
+    invalidations.add((func, args))
+
+
+class CacheExtension(MapperExtension):
+    '''
+    Discards the cache entries of the instances which are flushed.
+    '''
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def invalidate(self, mapper, instance):
+        state = instance_state(instance)
+        keys = [mapper.identity_key_from_instance(instance)]
+        # the primary key might have changed
+        if state.key is not None and state.key != keys[0]:
+            keys.append(state.key)
+        session = object_session(instance)
+        for key in keys:
+            self.cache.invalidate(key)
+            if session is not None:
+                invalidate_on_rollback(session, self.cache.invalidate, key)
+        return EXT_CONTINUE
+
+    def after_insert(self, mapper, connection, instance):
+        return self.invalidate(mapper, instance)
+
+    def after_update(self, mapper, connection, instance):
+        return self.invalidate(mapper, instance)
+
+    def after_delete(self, mapper, connection, instance):
+        return self.invalidate(mapper, instance)
+
+
+def invalidate_results(entity):
+    '''
+    Invalidates the cached get_by results of `entity` and of its parent
+    entities (whose results include the instances of their children).
+    '''
+    while entity is not None:
+        # the cache keys contain the generation of their entity, so that
+        # changing it makes all the entries of the entity unreachable (they
+        # are then evicted from the cache as they become the least recently
+        # used ones).
+        entity._descriptor.results_generation += 1
+        entity = entity._descriptor.parent
+
+
+def invalidate_hierarchy(entity):
+    '''
+    Clears the caches of all the entities of the inheritance hierarchy of
+    `entity`, for changes whose rows are unknown (eg. bulk updates).
+    '''
+    while entity._descriptor.parent is not None:
+        entity = entity._descriptor.parent
+    stack = [entity]
+    while stack:
+        entity = stack.pop()
+        desc = entity._descriptor
+        if desc.cache is not None:
+            desc.cache.clear()
+        desc.results_generation += 1
+        stack.extend(desc.children)
+
+
+class ResultCacheExtension(MapperExtension):
+    '''
+    Invalidates the cached get_by results of the entity of the instances
+    which are flushed.
+    '''
+
+    def invalidate(self, instance):
+        invalidate_results(instance.__class__)
+        session = object_session(instance)
+        if session is not None:
+            invalidate_on_rollback(session, invalidate_results,
+                                   instance.__class__)
+        return EXT_CONTINUE
+
+    def after_insert(self, mapper, connection, instance):
+        return self.invalidate(instance)
+
+    def after_update(self, mapper, connection, instance):
+        return self.invalidate(instance)
+
+    def after_delete(self, mapper, connection, instance):
+        return self.invalidate(instance)
+
+
+class CachedLazyLoader(CustomLazyLoader):
+    '''
+    Loader strategy for ManyToOne relationships targeting an entity with a
+    cache.
+    '''
+
+    def load(self, state, passive):
+        '''
+        Returns the target of the relationship for `state`, taken from the
+        cache of the target entity.
+        '''
+        session = self.load_session(state, passive)
+        if session is None or not self.use_get:
+            return NOT_LOADED
+
+        instance_mapper = object_mapper(state.obj())
+        ident = [instance_mapper._get_state_attr_by_column(
+                     state, state.dict, self._equated_columns[col])
+                 for col in self.mapper.primary_key]
+        if None in ident:
+            return NOT_LOADED
+        return cached_get(self.mapper.class_, session, tuple(ident))
@@ -18,7 +18,7 @@ class BaseCollection(list):
         del self[:]
 
     def resolve_absolute(self, key, full_path, entity=None, root=None):
-        if root is None:
+        if root is None and entity is not None:
             root = entity._descriptor.resolve_root
         if root:
             full_path = '%s.%s' % (root, full_path)
@@ -42,6 +42,13 @@ class GlobalEntityCollection(BaseCollection):
     def __init__(self, entities=None):
         # _entities is a dict of entities keyed on their name.
         self._entities = {}
+        # _paths is a dict of entities keyed on their full path (including
+        # the module name).
+        self._paths = {}
+        # _tablenames and _identities are dicts of lists of entities keyed on
+        # the name of their table and their polymorphic identity.
+        self._tablenames = {}
+        self._identities = {}
         super(GlobalEntityCollection, self).__init__(entities)
 
     def append(self, entity):
@@ -53,6 +60,31 @@ class GlobalEntityCollection(BaseCollection):
         existing_entities = self._entities.setdefault(entity.__name__, [])
         existing_entities.append(entity)
 
+        self._paths['%s.%s' % (entity.__module__, entity.__name__)] = entity
+
+        desc = entity._descriptor
+        # children using single table inheritance share the table of their
+        # parent, which is what their tablename maps to.
+        if not (desc.parent and desc.inheritance == 'single'):
+            self._tablenames.setdefault(desc.tablename, []).append(entity)
+            if desc.table_fullname != desc.tablename:
+                self._tablenames.setdefault(desc.table_fullname,
+                                            []).append(entity)
+        self._identities.setdefault(desc.identity, []).append(entity)
+
+    def resolve_absolute(self, key, full_path, entity=None, root=None):
+        if root is None and entity is not None:
+            root = entity._descriptor.resolve_root
+        if root:
+            path = '%s.%s' % (root, full_path)
+        else:
+            path = full_path
+        res = self._paths.get(path)
+        if res is not None:
+            return res
+        return super(GlobalEntityCollection, self).resolve_absolute(
+                   key, full_path, entity, root)
+
     def resolve(self, key, entity=None):
         '''
         Resolve a key to an Entity. The optional `entity` argument is the
@@ -79,8 +111,37 @@ class GlobalEntityCollection(BaseCollection):
             else:
                 return res[0]
 
+    def _get_unique(self, index, key, what):
+        res = index.get(key)
+        if res is None:
+            return None
+        elif len(res) > 1:
+            raise Exception("Several entities of this collection have '%s' "
+                            "as %s: %s" % (key, what,
+                            ', '.join([e.__name__ for e in res])))
+        return res[0]
+
+    def get_by_tablename(self, tablename):
+        '''
+        Returns the entity mapped to the table named `tablename` (optionally
+        including its schema), or None if there is no such entity in this
+        collection.
+        '''
+        return self._get_unique(self._tablenames, tablename, 'table name')
+
+    def get_by_identity(self, identity):
+        '''
+        Returns the entity with the given polymorphic identity, or None if
+        there is no such entity in this collection.
+        '''
+        return self._get_unique(self._identities, identity,
+                                'polymorphic identity')
+
     def clear(self):
         self._entities = {}
+        self._paths = {}
+        self._tablenames = {}
+        self._identities = {}
         super(GlobalEntityCollection, self).clear()
 
 # backward compatible name
@@ -89,12 +150,26 @@ EntityCollection = GlobalEntityCollection
 _leading_dots = re.compile('^([.]*).*$')
 
 class RelativeEntityCollection(BaseCollection):
+    def __init__(self, entities=None):
+        # memoized full paths of relative keys, keyed on (key, module name)
+        self._full_paths = {}
+        super(RelativeEntityCollection, self).__init__(entities)
+
     # the entity=None does not make any sense with a relative entity collection
     def resolve(self, key, entity):
         '''
         Resolve a key to an Entity. The optional `entity` argument is the
         "source" entity when resolving relationship targets.
         '''
+        cache_key = (key, entity.__module__)
+        cached = self._full_paths.get(cache_key)
+        if cached is None:
+            cached = self._full_path(key, entity)
+            self._full_paths[cache_key] = cached
+        full_path, root = cached
+        return self.resolve_absolute(key, full_path, entity, root=root)
+
+    def _full_path(self, key, entity):
         full_path = key
 
         if '.' not in key or key.startswith('.'):
@@ -118,8 +193,11 @@ class RelativeEntityCollection(BaseCollection):
             root = ''
         else:
             root = None
-        return self.resolve_absolute(key, full_path, entity, root=root)
+        return full_path, root
+
+    def clear(self):
+        self._full_paths = {}
+        super(RelativeEntityCollection, self).clear()
 
     def __getattr__(self, key):
         raise NotImplementedError
-
@@ -6,21 +6,33 @@ This module provides the ``Entity`` base class, as well as its metaclass
 import sys
 import types
 import warnings
+import threading
 
-from copy import deepcopy
+from timeit import default_timer
 
 import sqlalchemy
 from sqlalchemy import Table, Column, Integer, desc, ForeignKey, and_, \
-                       ForeignKeyConstraint
+                       or_, ForeignKeyConstraint
 from sqlalchemy.orm import MapperExtension, mapper, object_session, \
                            EXT_CONTINUE, polymorphic_union, ScopedSession, \
-                           ColumnProperty
+                           ColumnProperty, Query, defer, undefer
+from sqlalchemy.orm.attributes import instance_state
+from sqlalchemy.orm.properties import SynonymProperty
 from sqlalchemy.sql import ColumnCollection
 
 import elixir
 from elixir.statements import process_mutators, MUTATORS
 from elixir import options
 from elixir.properties import Property
+from elixir.cache import CacheExtension, ResultCacheExtension, make_cache, \
+                         cached_get, cached_get_by, invalidate_results, \
+                         invalidate_hierarchy, LRUCache
+from elixir.loading import load_relationship, in_criterion, chunks
+from elixir.serializer import shape_key, compile_serializer, \
+                              MAX_SERIALIZERS
+from elixir.views import ViewAttribute
+from elixir.keyset import keyset_order, order_clauses, after_criterion, \
+                          key_values, encode_cursor, decode_cursor
 
 DEBUG = False
 
@@ -93,6 +105,29 @@ class EntityDescriptor(object):
         #
         self.relationships = []
 
+        # index of the relationships of this entity, used when looking for
+        # the inverse of a relationship. It is built on first use and reset
+        # whenever a relationship is attached to this entity.
+        self._inverse_index = None
+
+        # SetupProfile recording the setup of this entity, if any
+        self.profile = None
+
+        # incremented whenever an instance of this entity (or of one of its
+        # children) is flushed, to invalidate the cached get_by results
+        self.results_generation = 0
+
+        # values (or callables returning them) used by bulk_insert for the
+        # columns which are filled by mapper extensions when using the ORM
+        self.insert_defaults = {}
+
+        # serializers used by to_dict, indexed on the shape of the
+        # serialization (see get_serializer)
+        self._serializers = LRUCache(MAX_SERIALIZERS)
+
+        # view class of the entity (see elixir.views), generated on first use
+        self._view = None
+
         # set default value for options
         self.table_args = []
 
@@ -132,8 +167,6 @@ class EntityDescriptor(object):
         mutator. For example, the tablename or the metadata.
         '''
         elixir.metadatas.add(self.metadata)
-        if self.collection is not None:
-            self.collection.append(self.entity)
 
         entity = self.entity
         if self.parent:
@@ -168,6 +201,37 @@ class EntityDescriptor(object):
             if not isinstance(self.polymorphic, basestring):
                 self.polymorphic = options.DEFAULT_POLYMORPHIC_COL_NAME
 
+        self.cache = make_cache(self.cache)
+        self.get_by_cache = make_cache(self.get_by_cache)
+
+        # the collection might index the entity on its tablename or identity,
+        # so it must be added once those are known.
+        if self.collection is not None:
+            self.collection.append(self.entity)
+
+    def check_parent_setup(self):
+        '''
+        Check that this entity can be setup even if its parent is already
+        setup (ie the entity was declared after the setup of its parent).
+        '''
+        parent = self.parent
+        if parent is None or not is_setup(parent):
+            return
+
+        if self.inheritance == 'concrete' and self.polymorphic:
+            reason = "polymorphic concrete inheritance needs the parent " \
+                     "mapper to know about all its children"
+        elif self.inheritance in ('single', 'multi') and \
+             parent._descriptor.polymorphic and \
+             parent.mapper.polymorphic_on is None:
+            reason = "its parent had no children when it was setup, so it " \
+                     "has no polymorphic column"
+        else:
+            return
+        raise Exception("Cannot setup entity '%s' after its parent entity "
+                        "'%s': %s." % (self.entity.__name__, parent.__name__,
+                                       reason))
+
     #---------------------
     # setup phase methods
 
@@ -256,6 +320,15 @@ class EntityDescriptor(object):
         else:
             if self.parent:
                 if self.inheritance == 'single':
+                    if is_setup(self.parent) and \
+                       (self._columns or self.constraints):
+                        raise Exception(
+                            "Cannot add columns to the table of entity '%s' "
+                            "which is already setup: entity '%s' (using "
+                            "single table inheritance) must be declared "
+                            "before setup_all is called."
+                            % (self.parent.__name__, self.entity.__name__))
+
                     # we know the parent is setup before the child
                     self.entity.table = self.parent.table
 
@@ -311,6 +384,11 @@ class EntityDescriptor(object):
         self.call_builders('after_table')
 
     def setup_events(self):
+        if self.cache is not None:
+            self.add_mapper_extension(CacheExtension(self.cache))
+        if self.get_by_cache is not None:
+            self.add_mapper_extension(ResultCacheExtension())
+
         def make_proxy_method(methods):
             def proxy_method(self, mapper, connection, instance):
                 for func in methods:
@@ -330,11 +408,10 @@ class EntityDescriptor(object):
         # create a list of callbacks for each event
         methods = {}
 
-        all_methods = getmembers(self.entity,
-                                 lambda a: isinstance(a, types.MethodType))
+        all_methods = getcallbacks(self.entity, '_elixir_events')
 
         for name, method in all_methods:
-            for event in getattr(method, '_elixir_events', []):
+            for event in method._elixir_events:
                 event_methods = methods.setdefault(event, [])
                 event_methods.append(method)
 
@@ -477,9 +554,15 @@ class EntityDescriptor(object):
     # helper methods
 
     def call_builders(self, what):
+        profile = self.profile
         for builder in self.builders:
             if hasattr(builder, what):
-                getattr(builder, what)()
+                if profile is None:
+                    getattr(builder, what)()
+                else:
+                    profile.call('builders', '%s.%s'
+                                 % (builder.__class__.__name__, what),
+                                 getattr(builder, what))
 
     def add_column(self, col, check_duplicate=None):
         '''when check_duplicate is None, the value of the allowcoloverride
@@ -554,13 +637,38 @@ class EntityDescriptor(object):
                                 "the '%s' entity!"
                                 % (key, self.entity.__name__))
 
+    def _build_inverse_index(self):
+        '''
+        Index the relationships of this entity on (target entity, kind,
+        intermediary tablename), which are necessary conditions for a
+        relationship to be the inverse of another. Relationships of unknown
+        kind (ie custom relationship classes) are stored under the None key.
+        '''
+        index = {}
+        for rel in self.relationships:
+            if rel.kind is None:
+                key = None
+            else:
+                key = (rel.target, rel.kind, rel.inverse_index_tablename)
+            index.setdefault(key, []).append(rel)
+        return index
+
+    def _inverse_candidates(self, rel):
+        if rel.inverse_kind is None:
+            return self.relationships
+        if self._inverse_index is None:
+            self._inverse_index = self._build_inverse_index()
+        index = self._inverse_index
+        key = (rel.entity, rel.inverse_kind, rel.inverse_index_tablename)
+        return index.get(key, []) + index.get(None, [])
+
     def get_inverse_relation(self, rel, check_reverse=True):
         '''
         Return the inverse relation of rel, if any, None otherwise.
         '''
 
         matching_rel = None
-        for other_rel in self.relationships:
+        for other_rel in self._inverse_candidates(rel):
             if rel.is_inverse(other_rel):
                 if matching_rel is None:
                     matching_rel = other_rel
@@ -589,6 +697,20 @@ class EntityDescriptor(object):
         else:
             return None
 
+    def get_serializer(self, deep={}, exclude=[]):
+        '''
+        Returns the function generating the dictionary of an instance of this
+        entity for the given `deep` and `exclude` arguments of to_dict. It is
+        compiled on first use and cached (see MAX_SERIALIZERS) until the
+        entity is cleaned up.
+        '''
+        key = shape_key(deep, exclude)
+        serializer = self._serializers.get(key)
+        if serializer is None:
+            serializer = compile_serializer(self.entity, deep, exclude)
+            self._serializers.set(key, serializer)
+        return serializer
+
     #------------------------
     # some useful properties
 
@@ -659,6 +781,23 @@ class EntityDescriptor(object):
             self._pk_props = [col_to_prop[c] for c in pk_cols]
         return self._pk_props
 
+    @property
+    def property_templates(self):
+        """
+        Returns the list of (name, property) pairs of the properties defined
+        on this (abstract or base) entity and its parents. Those are never
+        attached to this entity but cloned into each of its concrete
+        subclasses.
+
+        We use getmembers (instead of __dict__) so that we also get the
+        properties from the parents of the class if any. The result is
+        cached, as the same base can be shared by many entities.
+        """
+        if not hasattr(self, '_property_templates'):
+            self._property_templates = getmembers(self.entity,
+                                        lambda a: isinstance(a, Property))
+        return self._property_templates
+
 class FakePK(object):
     def __init__(self, descriptor):
         self.descriptor = descriptor
@@ -689,6 +828,15 @@ class FakeTable(object):
             return self.descriptor.tablename
 
 
+def is_setup(entity):
+    """
+    Returns whether `entity` has been setup. We can't simply use hasattr since
+    entities declared after the setup of their parent would inherit its
+    attribute.
+    """
+    return '_setup_done' in entity.__dict__
+
+
 def is_entity(cls):
     """
     Scan the bases classes of `cls` to see if any is an instance of
@@ -715,6 +863,61 @@ def getmembers(object, predicate=None):
             base_props.append((key, value))
     return base_props
 
+# Attributes marking methods as callbacks (for example the event decorators
+# set _elixir_events). Methods carrying any of these are recorded when their
+# class is created, so that they can be retrieved at setup time without
+# scanning all the attributes of the entity. Extensions defining their own
+# decorators should add the attribute they use to this list.
+CALLBACK_MARKERS = ['_elixir_events', '_elixir_bulk_events']
+
+def _is_callback(value):
+    for marker in CALLBACK_MARKERS:
+        if hasattr(value, marker):
+            return True
+    return False
+
+def collect_callbacks(cls):
+    '''
+    Returns the set of names of the callbacks defined on `cls` or any of its
+    bases. Entity bases store theirs, so only non-entity bases (ie mixin
+    classes) are scanned, and only through their __dict__. Callbacks added to
+    a mixin class after the entity is created are thus not seen.
+    '''
+    names = set()
+    for base in cls.__bases__:
+        if isinstance(base, EntityMeta):
+            names.update(base._elixir_callbacks)
+        else:
+            for klass in base.__mro__:
+                names.update([name for name, value in klass.__dict__.items()
+                              if _is_callback(value)])
+    names.update([name for name, value in cls.__dict__.items()
+                  if _is_callback(value)])
+    return names
+
+def _add_callback(cls, name):
+    # the subclasses created before the callback was added to their base
+    # have their own copy of the names
+    cls._elixir_callbacks.add(name)
+    for subclass in type.__subclasses__(cls):
+        _add_callback(subclass, name)
+
+def getcallbacks(entity, marker):
+    '''
+    Returns the list of (name, method) pairs of the methods of the entity
+    which carry the `marker` attribute, sorted by name.
+    '''
+    callbacks = []
+    for name in sorted(entity._elixir_callbacks):
+        try:
+            value = getattr(entity, name)
+        except AttributeError:
+            continue
+        # the recorded method might have been overridden by a subclass
+        if isinstance(value, types.MethodType) and hasattr(value, marker):
+            callbacks.append((name, value))
+    return callbacks
+
 def is_abstract_entity(dict_or_cls):
     if not isinstance(dict_or_cls, dict):
         dict_or_cls = dict_or_cls.__dict__
@@ -732,6 +935,9 @@ def instrument_class(cls):
     # Create the entity descriptor
     desc = cls._descriptor = EntityDescriptor(cls)
 
+    # Record the callbacks (event methods, ...) of the class
+    cls._elixir_callbacks = collect_callbacks(cls)
+
     # Process mutators
     # We *do* want mutators to be processed for base/abstract classes
     # (so that statements like using_options_defaults work).
@@ -746,14 +952,14 @@ def instrument_class(cls):
     cls.mapper = None
 
     # Copy the properties ('Property' instances) of the entity base class(es).
-    # We use getmembers (instead of __dict__) so that we also get the
-    # properties from the parents of the base class if any.
+    # Those properties are never attached to their (abstract) class, so they
+    # are used as templates which are cloned for each concrete subclass.
     base_props = []
     for base in cls.__bases__:
         if isinstance(base, EntityMeta) and \
            (not is_entity(base) or is_abstract_entity(base)):
-            base_props += [(name, deepcopy(attr)) for name, attr in
-                           getmembers(base, lambda a: isinstance(a, Property))]
+            base_props += [(name, attr.clone()) for name, attr in
+                           base._descriptor.property_templates]
 
     # Process attributes (using the assignment syntax), looking for
     # 'Property' instances and attaching them to this entity.
@@ -778,21 +984,62 @@ class EntityMeta(type):
     def __init__(cls, name, bases, dict_):
         instrument_class(cls)
 
+    def __call__(cls, *args, **kwargs):
+        if '_lazy_setup' in cls.__dict__:
+            setup_lazy_entity(cls)
+        return type.__call__(cls, *args, **kwargs)
+
     def __setattr__(cls, key, value):
+        if key in LAZY_SETUP_ATTRIBUTES and cls in _lazy_setup_in_progress:
+            # only published once the whole component is setup (see
+            # setup_lazy_entity)
+            _lazy_setup_values.setdefault(cls, {})[key] = value
+            return
         if isinstance(value, Property):
-            if hasattr(cls, '_setup_done'):
+            if is_setup(cls):
                 raise Exception('Cannot set attribute on a class after '
                                 'setup_all')
             else:
                 value.attach(cls, key)
         else:
+            if _is_callback(value) and '_elixir_callbacks' in cls.__dict__:
+                _add_callback(cls, key)
             type.__setattr__(cls, key, value)
 
 
-def setup_entities(entities):
-    '''Setup all entities in the list passed as argument'''
+# setup phases which are run in the order of the dependencies of the entities
+TABLE_PHASES = ('setup_autoload_table', 'create_pk_cols', 'setup_relkeys',
+                'before_table', 'setup_table', 'setup_reltables',
+                'after_table')
+
+def setup_entities(entities, profile=None, graph=None):
+    '''Setup all entities in the list passed as argument.
+
+    Entities which are already setup are skipped, so this can be used to setup
+    entities declared after the others were setup (eg. in modules imported
+    later): only the new entities are setup, and their relationships are
+    connected to the existing mappers.
+
+    If a `SetupProfile` instance is given as the `profile` argument, the time
+    spent in each setup phase, entity and builder is recorded into it. An
+    `EntityGraph` of (at least) these entities can be given as the `graph`
+    argument, if one was already built.
+    '''
+    # imported here to avoid a circular import (through relationships)
+    from elixir.graph import EntityGraph
+
+    entities = [e for e in entities if not is_setup(e)]
+    # the tables are setup after the tables they depend on. The mappers and
+    # properties are setup in the declaration order since the properties of
+    # an entity can refer to the properties of entities declared before it.
+    if graph is None:
+        graph = EntityGraph(entities)
+    pending = set(entities)
+    table_order = [e for e in graph.order() if e in pending]
 
     for entity in entities:
+        entity._descriptor.check_parent_setup()
+
         # delete all Elixir properties so that it doesn't interfere with
         # SQLAlchemy. At this point they should have be converted to
         # builders.
@@ -800,25 +1047,179 @@ def setup_entities(entities):
             if isinstance(attr, Property):
                 delattr(entity, name)
 
-    for method_name in (
-            'setup_autoload_table', 'create_pk_cols', 'setup_relkeys',
-            'before_table', 'setup_table', 'setup_reltables', 'after_table',
-            'setup_events',
-            'before_mapper', 'setup_mapper', 'after_mapper',
-            'setup_properties',
-            'finalize'):
-#        if DEBUG:
-#            print "=" * 40
-#            print method_name
-#            print "=" * 40
+    if profile is not None:
         for entity in entities:
-#            print entity.__name__, "...",
-            if hasattr(entity, '_setup_done'):
-#                print "already done"
+            entity._descriptor.profile = profile
+        start = default_timer()
+
+    try:
+        for method_name in TABLE_PHASES + (
+                'setup_events',
+                'before_mapper', 'setup_mapper', 'after_mapper',
+                'setup_properties',
+                'finalize'):
+            if profile is not None:
+                phase_start = default_timer()
+            if method_name in TABLE_PHASES:
+                phase_entities = table_order
+            else:
+                phase_entities = entities
+            for entity in phase_entities:
+                if is_setup(entity):
+                    continue
+                method = getattr(entity._descriptor, method_name)
+                if profile is None:
+                    method()
+                else:
+                    profile.call('entities', '%s.%s' % (entity.__module__,
+                                                        entity.__name__),
+                                 method)
+            if profile is not None:
+                profile.record('phases', method_name,
+                               default_timer() - phase_start)
+    finally:
+        if profile is not None:
+            profile.total += default_timer() - start
+            for entity in entities:
+                entity._descriptor.profile = None
+
+
+class LazySetupAttribute(object):
+    '''
+    Placeholder for the "table", "mapper" and "query" attributes of entities
+    waiting for their lazy setup. Accessing it triggers the setup of the
+    entity, and the placeholder is then replaced by the real attribute.
+    '''
+
+    def __init__(self, key):
+        self.key = key
+
+    def __get__(self, instance, owner):
+        if setup_lazy_entity(owner):
+            return getattr(owner, self.key)
+        # the entity is being setup by the current thread: use the value set
+        # so far, which is not published yet
+        values = _lazy_setup_values.get(owner, {})
+        if self.key in values:
+            value = values[self.key]
+            if hasattr(value, '__get__'):
+                value = value.__get__(None, owner)
+            return value
+        elif self.key != 'query':
+            return None
+        raise AttributeError("type object '%s' has no attribute '%s'"
+                             % (owner.__name__, self.key))
+
+# attributes which trigger the setup of an entity which is setup lazily
+LAZY_SETUP_ATTRIBUTES = ('table', 'mapper', 'query')
+
+# protects the lazy setup of entities
+_lazy_setup_lock = threading.RLock()
+# entities currently being setup lazily (by the thread holding the lock)
+_lazy_setup_in_progress = set()
+# the lazy setup attributes set during the setup of those entities
+_lazy_setup_values = {}
+# the error raised by the lazy setup of entities, if it failed
+_lazy_setup_errors = {}
+
+def setup_entities_lazily(entities):
+    '''
+    Mark all entities in the list passed as argument (which are not setup
+    yet) so that they get setup only when they are first used, that is on
+    their first instantiation or when their "query", "table" or "mapper"
+    attribute is first accessed.
+
+    When that happens, the entity is setup along with all the entities it is
+    connected to (through relationships or inheritance), but not the others.
+    Their "table", "mapper" and "query" attributes are only published once
+    they are all setup. Note that session.query(entity) does not trigger the
+    setup, since it doesn't go through any of these attributes.
+    '''
+    _lazy_setup_lock.acquire()
+    try:
+        for entity in entities:
+            if is_setup(entity) or '_lazy_setup' in entity.__dict__:
                 continue
-            method = getattr(entity._descriptor, method_name)
-            method()
-#            print "ok"
+            for key in LAZY_SETUP_ATTRIBUTES:
+                setattr(entity, key, LazySetupAttribute(key))
+            entity._lazy_setup = entities
+    finally:
+        _lazy_setup_lock.release()
+
+def _lazy_setup_component(entity):
+    '''
+    Returns the list of all the entities (still waiting for their lazy
+    setup) which need to be setup together with `entity`, in the order of
+    the collection they come from.
+    '''
+    component = set()
+    stack = [entity]
+    while stack:
+        current = stack.pop()
+        if current in component or '_lazy_setup' not in current.__dict__:
+            continue
+        component.add(current)
+        desc = current._descriptor
+        if desc.parent:
+            stack.append(desc.parent)
+        stack.extend(desc.children)
+        for rel in desc.relationships:
+            if isinstance(rel.target, EntityMeta):
+                stack.append(rel.target)
+    return [e for e in entity._lazy_setup if e in component]
+
+def _remove_lazy_setup(entity):
+    del entity._lazy_setup
+    for key in LAZY_SETUP_ATTRIBUTES:
+        if isinstance(entity.__dict__.get(key), LazySetupAttribute):
+            if key == 'query':
+                delattr(entity, key)
+            else:
+                setattr(entity, key, None)
+
+def setup_lazy_entity(entity):
+    '''
+    Setup an entity which was marked for lazy setup, along with all the
+    entities it is connected to. Concurrent calls are serialized: other
+    threads wait until the setup is complete, and calling this more than once
+    is harmless. Returns False if the entity is being setup by the current
+    thread (ie we are called from within its setup), True otherwise. If the
+    setup fails, the entities stay marked for lazy setup and any later access
+    raises the same error (a partial setup cannot be retried).
+    '''
+    _lazy_setup_lock.acquire()
+    try:
+        # the entity might have been setup by another thread while we were
+        # waiting for the lock.
+        if '_lazy_setup' not in entity.__dict__:
+            return True
+        if entity in _lazy_setup_in_progress:
+            return False
+        if entity in _lazy_setup_errors:
+            raise _lazy_setup_errors[entity]
+        component = _lazy_setup_component(entity)
+        _lazy_setup_in_progress.update(component)
+        try:
+            setup_entities(component)
+        except Exception, error:
+            for e in component:
+                _lazy_setup_errors[e] = error
+            raise
+        finally:
+            values = {}
+            for e in component:
+                _lazy_setup_in_progress.discard(e)
+                values[e] = _lazy_setup_values.pop(e, {})
+        # the other threads can read the attributes without taking the lock,
+        # so they are published only now that all the entities are setup,
+        # and before the placeholders are removed.
+        for e in component:
+            for key, value in values[e].iteritems():
+                setattr(e, key, value)
+            _remove_lazy_setup(e)
+        return True
+    finally:
+        _lazy_setup_lock.release()
 
 
 def cleanup_entities(entities):
@@ -837,8 +1238,11 @@ def cleanup_entities(entities):
     for entity in entities:
         desc = entity._descriptor
 
-        if hasattr(entity, '_setup_done'):
+        if is_setup(entity):
             del entity._setup_done
+        if '_lazy_setup' in entity.__dict__:
+            _remove_lazy_setup(entity)
+        _lazy_setup_errors.pop(entity, None)
 
         entity.table = None
         entity.mapper = None
@@ -848,6 +1252,8 @@ def cleanup_entities(entities):
         desc._columns = ColumnCollection()
         desc.constraints = []
         desc.properties = {}
+        desc._serializers.clear()
+        desc._view = None
 
 class EntityBase(object):
     """
@@ -874,84 +1280,64 @@ class EntityBase(object):
             setattr(self, key, value)
 
     @classmethod
-    def update_or_create(cls, data, surrogate=True):
-        pk_props = cls._descriptor.primary_key_properties
-
-        # if all pk are present and not None
-        if not [1 for p in pk_props if data.get(p.key) is None]:
-            pk_tuple = tuple([data[prop.key] for prop in pk_props])
-            record = cls.query.get(pk_tuple)
-            if record is None:
-                if surrogate:
-                    raise Exception("Cannot create surrogate with pk")
-                else:
-                    record = cls()
-        else:
-            if surrogate:
-                record = cls()
-            else:
-                raise Exception("Cannot create non surrogate without pk")
-        record.from_dict(data)
-        return record
-
-    def from_dict(self, data):
+    def update_or_create(cls, data, surrogate=True, prefetch=False):
+        """
+        Return the record whose primary key is given in `data` (or a new
+        record), updated with `data` (see from_dict). If `prefetch` is True,
+        all the records referenced by primary key in `data` (including in
+        nested dicts) are first loaded with one query per entity instead of
+        one query each.
+        """
+        records = None
+        if prefetch:
+            pks = {}
+            pk_tuple = _pk_tuple(data, cls._descriptor.primary_key_properties)
+            if pk_tuple is not None:
+                pks[cls] = set([pk_tuple])
+            _collect_pks(cls, data, pks)
+            records = _prefetch(pks)
+        return _update_or_create(cls, data, surrogate, records)
+
+    def from_dict(self, data, prefetch=False):
         """
         Update a mapped class with data from a JSON-style nested dict/list
-        structure.
+        structure. If `prefetch` is True, the related records referenced by
+        primary key in `data` are first loaded with one query per entity (see
+        update_or_create).
         """
-        # surrogate can be guessed from autoincrement/sequence but I guess
-        # that's not 100% reliable, so we'll need an override
-
-        mapper = sqlalchemy.orm.object_mapper(self)
-
-        for key, value in data.iteritems():
-            if isinstance(value, dict):
-                dbvalue = getattr(self, key)
-                rel_class = mapper.get_property(key).mapper.class_
-                pk_props = rel_class._descriptor.primary_key_properties
-
-                # If the data doesn't contain any pk, and the relationship
-                # already has a value, update that record.
-                if not [1 for p in pk_props if p.key in data] and \
-                   dbvalue is not None:
-                    dbvalue.from_dict(value)
-                else:
-                    record = rel_class.update_or_create(value)
-                    setattr(self, key, record)
-            elif isinstance(value, list) and \
-                 value and isinstance(value[0], dict):
-
-                rel_class = mapper.get_property(key).mapper.class_
-                new_attr_value = []
-                for row in value:
-                    if not isinstance(row, dict):
-                        raise Exception(
-                                'Cannot send mixed (dict/non dict) data '
-                                'to list relationships in from_dict data.')
-                    record = rel_class.update_or_create(row)
-                    new_attr_value.append(record)
-                setattr(self, key, new_attr_value)
-            else:
-                setattr(self, key, value)
+        records = None
+        if prefetch:
+            pks = {}
+            _collect_pks(sqlalchemy.orm.object_mapper(self).class_, data, pks)
+            records = _prefetch(pks)
+        _from_dict(self, data, records)
 
     def to_dict(self, deep={}, exclude=[]):
         """Generate a JSON-style nested dict/list structure from an object."""
-        col_prop_names = [p.key for p in self.mapper.iterate_properties \
-                                      if isinstance(p, ColumnProperty)]
-        data = dict([(name, getattr(self, name))
-                     for name in col_prop_names if name not in exclude])
-        for rname, rdeep in deep.iteritems():
-            dbdata = getattr(self, rname)
-            #FIXME: use attribute names (ie coltoprop) instead of column names
-            fks = self.mapper.get_property(rname).remote_side
-            exclude = [c.name for c in fks]
-            if dbdata is None:
-                data[rname] = None
-            elif isinstance(dbdata, list):
-                data[rname] = [o.to_dict(rdeep, exclude) for o in dbdata]
-            else:
-                data[rname] = dbdata.to_dict(rdeep, exclude)
-        return data
+        return self._descriptor.get_serializer(deep, exclude)(self)
+
+    @classmethod
+    def to_dicts(cls, query_or_instances, deep={}, exclude=[]):
+        """
+        Generate the list of the dicts of the instances returned by the given
+        query (or list of instances), as to_dict would, loading each
+        relationship of `deep` once per level instead of once per instance.
+        """
+        if isinstance(query_or_instances, Query):
+            query = query_or_instances
+            needed = set(cls.mapper.primary_key)
+            for rname in deep:
+                prop = cls.mapper.get_property(rname)
+                needed.update([local for local, remote
+                               in prop.local_remote_pairs])
+            deferred = [defer(p.key) for p in cls.mapper.iterate_properties
+                        if isinstance(p, ColumnProperty) and
+                           p.key in exclude and
+                           not [c for c in p.columns if c in needed]]
+            instances = query.options(*deferred).all()
+        else:
+            instances = list(query_or_instances)
+        return _to_dicts(instances, deep, exclude)
 
     # session methods
     def flush(self, *args, **kwargs):
@@ -999,8 +1385,13 @@ class EntityBase(object):
         Returns the first instance of this class matching the given criteria.
         This is equivalent to:
         session.query(MyClass).filter_by(...).first()
+
+        If the entity uses the "get_by_cache" option, the result is taken
+        from that cache when possible.
         """
-        return cls.query.filter_by(*args, **kwargs).first()
+        if cls._descriptor.get_by_cache is None or args:
+            return cls.query.filter_by(*args, **kwargs).first()
+        return cached_get_by(cls, kwargs)
 
     @classmethod
     def get(cls, *args, **kwargs):
@@ -1008,8 +1399,608 @@ class EntityBase(object):
         Return the instance of this class based on the given identifier,
         or None if not found. This is equivalent to:
         session.query(MyClass).get(...)
+
+        If the entity uses the "cache" option, the instance is taken from the
+        cache when it is not present in the session.
+        """
+        cache = cls._descriptor.cache
+        if cache is None or kwargs or len(args) != 1:
+            return cls.query.get(*args, **kwargs)
+
+        ident = args[0]
+        if not isinstance(ident, (tuple, list)):
+            ident = (ident,)
+        return cached_get(cls, cls.query.session, tuple(ident))
+
+    @classmethod
+    def get_many(cls, ids, chunk_size=None):
+        """
+        Return the instances of this class corresponding to the given list of
+        identifiers (as for `get`), in the same order, with None for those
+        not found, loading them with as few "IN" queries as possible.
+        """
+        query = cls.query
+        mapper = cls.mapper
+        pk_cols = list(mapper.primary_key)
+        integer_cols = [isinstance(col.type, sqlalchemy.types.Integer)
+                        for col in pk_cols]
+
+        def coerce(value, integer):
+            if integer and isinstance(value, basestring):
+                try:
+                    return int(value)
+                except ValueError:
+                    pass
+            return value
+
+        def to_tuple(ident):
+            if ident is None:
+                return None
+            if not isinstance(ident, (tuple, list)):
+                ident = (ident,)
+            if len(ident) != len(pk_cols):
+                raise Exception("Incorrect number of values in identifier "
+                                "%r for entity '%s' (expected %d)."
+                                % (ident, cls.__name__, len(pk_cols)))
+            return tuple([coerce(value, integer)
+                          for value, integer in zip(ident, integer_cols)])
+
+        idents = [to_tuple(ident) for ident in ids]
+
+        found = {}
+        missing = []
+        identity_map = query.session.identity_map
+        for ident in idents:
+            if ident is None or ident in found:
+                continue
+            key = mapper.identity_key_from_primary_key(list(ident))
+            instance = identity_map.get(key)
+            if instance is not None and \
+               not instance_state(instance).expired:
+                found[ident] = instance
+            else:
+                # mark it so that it is only loaded once
+                found[ident] = None
+                missing.append(ident)
+
+        for chunk in chunks(missing, len(pk_cols), chunk_size):
+            criterion = in_criterion(pk_cols, chunk)
+            for instance in query.filter(criterion):
+                ident = tuple(mapper.primary_key_from_instance(instance))
+                found[ident] = instance
+
+        result = []
+        for ident in idents:
+            instance = found.get(ident)
+            # as for get, instances of other classes of the same hierarchy
+            # (which share the identity map) are ignored
+            if instance is not None and not isinstance(instance, cls):
+                instance = None
+            result.append(instance)
+        return result
+
+    @classmethod
+    def values(cls, *fields):
+        """
+        Return a query selecting only the given fields of this class (all its
+        fields by default), whose results are named tuples instead of
+        instances.
+        """
+        mapper = cls.mapper
+        if not fields:
+            fields = [p.key for p in mapper.iterate_properties
+                      if isinstance(p, ColumnProperty)]
+        columns = []
+        for name in fields:
+            prop = mapper.get_property(name)
+            if isinstance(prop, SynonymProperty):
+                prop = mapper.get_property(prop.name)
+            if not isinstance(prop, ColumnProperty):
+                raise Exception("'%s' is not a field of entity '%s'."
+                                % (name, cls.__name__))
+            columns.append(getattr(cls, prop.key).label(name))
+        return cls.query.session.query(*columns)
+
+    View = ViewAttribute()
+
+    @classmethod
+    def views(cls, query=None):
+        """
+        Return an iterator over the View instances (see elixir.views) built
+        straight from the rows returned by `query` (defaults to all rows).
+        """
+        if query is None:
+            query = cls.query
+        view = cls.View
+        if view._deferred:
+            query = query.options(*[undefer(key) for key in view._deferred])
+        session = query.session
+        # executing the statement directly does not autoflush
+        if session.autoflush:
+            session.flush()
+        result = session.execute(query.statement, mapper=cls.mapper)
+        from_row = view._from_row
+        return (from_row(row) for row in result)
+
+    @classmethod
+    def iter_all(cls, batch_size=None, order_by=None, query=None,
+                 expunge=True, stream_results=False):
+        """
+        Iterate over all the instances of this class (or of `query`), loading
+        them in batches of `batch_size` rows with keyset pagination, and
+        expunging each batch from the session once done unless `expunge` is
+        False.
+        """
+        if batch_size is None:
+            batch_size = options.DEFAULT_BATCH_SIZE
+        if query is None:
+            query = cls.query
+        order = keyset_order(cls, order_by)
+        dialect = query.session.get_bind(cls.mapper).dialect
+        query = query.order_by(None).order_by(*order_clauses(order, dialect))
+        if stream_results:
+            query = query.execution_options(stream_results=True)
+        session = query.session
+
+        def expunge_all(instances):
+            for instance in instances:
+                if instance in session:
+                    session.expunge(instance)
+
+        previous = []
+        values = None
+        while True:
+            batch_query = query
+            if values is not None:
+                batch_query = query.filter(after_criterion(order, values))
+            batch = batch_query.limit(batch_size).all()
+            if expunge:
+                expunge_all(previous)
+            if not batch:
+                return
+            values = key_values(batch[-1], order)
+            for instance in batch:
+                yield instance
+            if len(batch) < batch_size:
+                if expunge:
+                    # no query autoflushes the changes made to the last batch
+                    if session.autoflush:
+                        session.flush()
+                    expunge_all(batch)
+                return
+            previous = batch
+
+    @classmethod
+    def paginate(cls, after=None, limit=20, order_by=None, query=None):
+        """
+        Return a page of at most `limit` instances of this class (or of
+        `query`) after the `after` cursor, as an (instances, cursor) tuple,
+        where cursor is None on the last page.
+        """
+        if limit < 1:
+            raise ValueError("The limit of a page must be at least 1.")
+        if query is None:
+            query = cls.query
+        order = keyset_order(cls, order_by)
+        dialect = query.session.get_bind(cls.mapper).dialect
+        query = query.order_by(None).order_by(*order_clauses(order, dialect))
+        if after is not None:
+            values = decode_cursor(after, len(order))
+            query = query.filter(after_criterion(order, values))
+
+        # fetch one more row to know whether there is a next page
+        instances = query.limit(limit + 1).all()
+        if len(instances) > limit:
+            del instances[limit:]
+            cursor = encode_cursor(key_values(instances[-1], order))
+        else:
+            cursor = None
+        return instances, cursor
+
+    @classmethod
+    def bulk_insert(cls, rows, fields=None, batch_size=None,
+                    return_primary_keys=False):
+        """
+        Insert the given rows (dicts, or tuples of values for `fields`) with
+        "executemany" statements, without creating instances nor running the
+        mapper extensions. Returns their primary keys if
+        `return_primary_keys` is True.
+        """
+        desc = cls._descriptor
+        mapper = cls.mapper
+        table = cls.table
+        if desc.parent and desc.inheritance == 'multi':
+            raise Exception("bulk_insert doesn't support entities using "
+                            "multi-table inheritance (entity '%s')."
+                            % cls.__name__)
+        if batch_size is None:
+            batch_size = options.DEFAULT_BATCH_SIZE
+
+        colkeys = dict((col.key, col.key) for col in table.columns)
+        synonyms = []
+        for prop in mapper.iterate_properties:
+            if isinstance(prop, ColumnProperty):
+                col = prop.columns[0]
+                if table.c.contains_column(col):
+                    colkeys[prop.key] = col.key
+            elif isinstance(prop, SynonymProperty):
+                synonyms.append(prop)
+        for prop in synonyms:
+            if prop.name in colkeys:
+                colkeys[prop.key] = colkeys[prop.name]
+
+        defaults = {}
+        polymorphic_on = mapper.polymorphic_on
+        if polymorphic_on is not None and \
+           mapper.polymorphic_identity is not None and \
+           table.c.contains_column(polymorphic_on):
+            defaults[polymorphic_on.key] = mapper.polymorphic_identity
+        if mapper.version_id_col is not None:
+            defaults[mapper.version_id_col.key] = 1
+        defaults.update(desc.insert_defaults)
+
+        pk_keys = [col.key for col in mapper.primary_key]
+        session = cls.query.session
+        connection = session.connection(mapper=mapper)
+        insert = table.insert()
+        primary_keys = []
+
+        def to_params(row):
+            if isinstance(row, dict):
+                items = row.iteritems()
+            else:
+                if fields is None:
+                    raise Exception("The 'fields' argument is required to "
+                                    "insert rows given as tuples.")
+                if len(row) != len(fields):
+                    raise Exception("Incorrect number of values in row %r "
+                                    "(expected %d)." % (row, len(fields)))
+                items = zip(fields, row)
+            params = {}
+            for name, value in items:
+                try:
+                    params[colkeys[name]] = value
+                except KeyError:
+                    raise Exception("'%s' is not a field of entity '%s'."
+                                    % (name, cls.__name__))
+            for key, value in defaults.iteritems():
+                if key not in params:
+                    if hasattr(value, '__call__'):
+                        value = value()
+                    params[key] = value
+            # let the database generate missing primary keys
+            for key in pk_keys:
+                if key in params and params[key] is None:
+                    del params[key]
+            return params
+
+        def insert_batch(batch):
+            # an executemany statement needs all its rows to have the same
+            # columns, so that the column defaults are used for the others.
+            groups = []
+            for params in batch:
+                keys = set(params)
+                if groups and groups[-1][0] == keys:
+                    groups[-1][1].append(params)
+                else:
+                    groups.append((keys, [params]))
+
+            for keys, group in groups:
+                if return_primary_keys and \
+                   [key for key in pk_keys if key not in keys]:
+                    for params in group:
+                        result = connection.execute(insert, params)
+                        primary_keys.append(
+                            tuple(result.inserted_primary_key))
+                else:
+                    connection.execute(insert, group)
+                    if return_primary_keys:
+                        primary_keys.extend([tuple([params[key]
+                                                    for key in pk_keys])
+                                             for params in group])
+
+        batch = []
+        for row in rows:
+            batch.append(to_params(row))
+            if len(batch) >= batch_size:
+                insert_batch(batch)
+                batch = []
+        if batch:
+            insert_batch(batch)
+
+        invalidate_results(cls)
+
+        if return_primary_keys:
+            if len(pk_keys) == 1:
+                return [pk[0] for pk in primary_keys]
+            return primary_keys
+
+    @classmethod
+    def update_where(cls, criterion, values, synchronize_session='evaluate',
+                     events=True):
+        """
+        Update the rows of this class matching `criterion` (an SQL expression,
+        a dict as for get_by, or None) with `values` in a single UPDATE
+        statement, and return the number of rows matched. The methods decorated
+        with before_bulk_update and after_bulk_update are called unless
+        `events` is False.
+        """
+        mapper = cls.mapper
+        attrs = {}
+        for name, value in values.iteritems():
+            prop = mapper.get_property(name)
+            if isinstance(prop, SynonymProperty):
+                prop = mapper.get_property(prop.name)
+            attrs[getattr(cls, prop.key)] = value
+
+        query = _bulk_query(cls, criterion, 'update_where')
+        if synchronize_session == 'expire':
+            synchronize_session = 'fetch'
+        if events:
+            _call_bulk_events(cls, 'before_bulk_update', query, values)
+        count = query.update(attrs, synchronize_session=synchronize_session)
+        invalidate_hierarchy(cls)
+        if events:
+            _call_bulk_events(cls, 'after_bulk_update', query, values)
+        return count
+
+    @classmethod
+    def delete_where(cls, criterion, synchronize_session='evaluate',
+                     events=True):
+        """
+        Delete the rows of this class matching `criterion` (as for
+        update_where) in a single DELETE statement, and return the number of
+        rows deleted. Relationship cascades are not applied.
         """
-        return cls.query.get(*args, **kwargs)
+        query = _bulk_query(cls, criterion, 'delete_where')
+        if synchronize_session == 'expire':
+            synchronize_session = 'fetch'
+        if events:
+            _call_bulk_events(cls, 'before_bulk_delete', query)
+        count = query.delete(synchronize_session=synchronize_session)
+        invalidate_hierarchy(cls)
+        if events:
+            _call_bulk_events(cls, 'after_bulk_delete', query)
+        return count
+
+    @classmethod
+    def recount(cls, *names):
+        """
+        Recompute the counter cache columns of the OneToMany relationships
+        of this class named in `names` (all those having a counter cache by
+        default), eg. after children were inserted or deleted with bulk
+        operations, which do not update them.
+        """
+        relationships = []
+        entity = cls
+        while entity is not None:
+            relationships.extend(entity._descriptor.relationships)
+            entity = entity._descriptor.parent
+        for rel in relationships:
+            if getattr(rel, 'counter_cache', False) and \
+               (not names or rel.name in names):
+                rel.recount()
+
+
+def _update_or_create(cls, data, surrogate, records):
+    '''
+    Implementation of update_or_create, looking up the records in (and
+    adding them to) `records`, the dictionary of the prefetched records
+    indexed on their class and primary key, unless it is None.
+    '''
+    pk_props = cls._descriptor.primary_key_properties
+    # if all pk are present and not None
+    if not [1 for p in pk_props if data.get(p.key) is None]:
+        pk_tuple = tuple([data[prop.key] for prop in pk_props])
+        record = None
+        if records is not None:
+            record = records.get((cls, pk_tuple))
+        # prefetched records are matched by value, so a key which is not
+        # of the type of the primary key can miss its record
+        if record is None:
+            record = cls.query.get(pk_tuple)
+        if record is None:
+            if surrogate:
+                raise Exception("Cannot create surrogate with pk")
+            else:
+                record = cls()
+        if records is not None:
+            records[(cls, pk_tuple)] = record
+    else:
+        if surrogate:
+            record = cls()
+        else:
+            raise Exception("Cannot create non surrogate without pk")
+    if records is not None:
+        _from_dict(record, data, records)
+    else:
+        record.from_dict(data)
+    return record
+
+def _from_dict(instance, data, records):
+    '''
+    Implementation of from_dict, using the prefetched `records` (see
+    _update_or_create).
+    '''
+    # surrogate can be guessed from autoincrement/sequence but I guess
+    # that's not 100% reliable, so we'll need an override
+
+    mapper = sqlalchemy.orm.object_mapper(instance)
+    for key, value in data.iteritems():
+        if isinstance(value, dict):
+            dbvalue = getattr(instance, key)
+            rel_class = mapper.get_property(key).mapper.class_
+            pk_props = rel_class._descriptor.primary_key_properties
+
+            # If the data doesn't contain any pk, and the relationship
+            # already has a value, update that record.
+            if not [1 for p in pk_props if p.key in data] and \
+               dbvalue is not None:
+                if records is not None:
+                    _from_dict(dbvalue, value, records)
+                else:
+                    dbvalue.from_dict(value)
+            else:
+                record = _nested_record(rel_class, value, records)
+                setattr(instance, key, record)
+        elif isinstance(value, list) and \
+             value and isinstance(value[0], dict):
+
+            rel_class = mapper.get_property(key).mapper.class_
+            new_attr_value = []
+            for row in value:
+                if not isinstance(row, dict):
+                    raise Exception(
+                            'Cannot send mixed (dict/non dict) data '
+                            'to list relationships in from_dict data.')
+                new_attr_value.append(_nested_record(rel_class, row, records))
+            setattr(instance, key, new_attr_value)
+        else:
+            setattr(instance, key, value)
+
+def _nested_record(cls, data, records):
+    if records is not None:
+        return _update_or_create(cls, data, True, records)
+    return cls.update_or_create(data)
+
+def _pk_tuple(data, pk_props):
+    '''
+    Returns the tuple of the primary key values given in `data`, or None if
+    any of them is missing.
+    '''
+    if [1 for p in pk_props if data.get(p.key) is None]:
+        return None
+    return tuple([data[prop.key] for prop in pk_props])
+
+
+def _collect_pks(cls, data, pks):
+    '''
+    Collects in `pks` (a dict of sets, indexed on the related classes) the
+    primary keys of the related records referenced in the `data` given to
+    from_dict for an instance of `cls`, at all nesting levels.
+    '''
+    mapper = cls.mapper
+    for key, value in data.iteritems():
+        if isinstance(value, dict):
+            rows = [value]
+        elif isinstance(value, list) and value and isinstance(value[0], dict):
+            rows = value
+        else:
+            continue
+        rel_class = mapper.get_property(key).mapper.class_
+        pk_props = rel_class._descriptor.primary_key_properties
+        for row in rows:
+            # from_dict complains about those
+            if not isinstance(row, dict):
+                continue
+            pk_tuple = _pk_tuple(row, pk_props)
+            if pk_tuple is not None:
+                pks.setdefault(rel_class, set()).add(pk_tuple)
+            _collect_pks(rel_class, row, pks)
+
+
+def _prefetch(pks):
+    '''
+    Loads the records whose primary keys were collected by _collect_pks, and
+    returns them in a dict indexed on (class, primary key tuple), with None
+    for the records which do not exist.
+    '''
+    records = {}
+    for cls, idents in pks.iteritems():
+        idents = list(idents)
+        for ident, record in zip(idents, cls.get_many(idents)):
+            records[(cls, ident)] = record
+    return records
+
+
+def _to_dicts(instances, deep, exclude):
+    '''
+    Returns the list of the dictionaries of `instances`, loading each
+    relationship of `deep` for all of them at once.
+    '''
+    for rname in deep:
+        load_relationship(instances, rname)
+
+    related = {}
+    for rname, rdeep in deep.iteritems():
+        objs = []
+        rexclude = None
+        for instance in instances:
+            dbdata = getattr(instance, rname)
+            if rexclude is None:
+                #FIXME: use attribute names (ie coltoprop) instead of column
+                # names (as to_dict does)
+                fks = instance.mapper.get_property(rname).remote_side
+                rexclude = [c.name for c in fks]
+            if isinstance(dbdata, list):
+                objs.extend(dbdata)
+            elif dbdata is not None:
+                objs.append(dbdata)
+        related[rname] = iter(_to_dicts(objs, rdeep, rexclude or []))
+
+    # the columns are serialized by the (compiled) serializer of each class
+    serializers = {}
+    result = []
+    for instance in instances:
+        cls = instance.__class__
+        serializer = serializers.get(cls)
+        if serializer is None:
+            serializer = serializers[cls] = \
+                cls._descriptor.get_serializer({}, exclude)
+        data = serializer(instance)
+        for rname in deep:
+            dbdata = getattr(instance, rname)
+            if dbdata is None:
+                data[rname] = None
+            elif isinstance(dbdata, list):
+                data[rname] = [related[rname].next() for o in dbdata]
+            else:
+                data[rname] = related[rname].next()
+        result.append(data)
+    return result
+
+
+def _bulk_query(cls, criterion, method):
+    '''
+    Returns the query selecting the rows of `cls` matching `criterion`, for
+    bulk updates and deletes (done by `method`).
+    '''
+    # a single statement can only affect one table
+    desc = cls._descriptor
+    if (desc.parent and desc.inheritance == 'multi') or \
+       [child for child in desc._get_children()
+        if child._descriptor.inheritance == 'multi']:
+        raise Exception("%s doesn't support entities using multi-table "
+                        "inheritance (entity '%s')." % (method, cls.__name__))
+
+    # SQLAlchemy only synchronizes the instances of the class of the query,
+    # which, for single table inheritance, should be the root class, as the
+    # identity map only knows about it. The rows of the other classes are
+    # excluded by filtering on the polymorphic column.
+    root = cls
+    while root._descriptor.parent is not None and \
+          root._descriptor.inheritance == 'single':
+        root = root._descriptor.parent
+
+    query = root.query
+    if root is not cls and cls.mapper.polymorphic_on is not None:
+        polymorphic_on = cls.mapper.polymorphic_on
+        query = query.filter(or_(*[polymorphic_on == m.polymorphic_identity
+                                   for m in cls.mapper.polymorphic_iterator()
+                                   if m.polymorphic_identity is not None]))
+    if isinstance(criterion, dict):
+        # the attributes of cls are not necessarily known by the root class
+        query = query.filter(and_(*[getattr(cls, key) == value
+                                    for key, value in criterion.iteritems()]))
+    elif criterion is not None:
+        query = query.filter(criterion)
+    return query
+
+
+def _call_bulk_events(cls, event, *args):
+    for name, method in getcallbacks(cls, '_elixir_bulk_events'):
+        if event in method._elixir_bulk_events:
+            method(*args)
 
 
 class Entity(EntityBase):
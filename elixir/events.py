@@ -7,6 +7,10 @@ __all__ = [
     'after_update',
     'before_delete',
     'after_delete',
+    'before_bulk_update',
+    'after_bulk_update',
+    'before_bulk_delete',
+    'after_bulk_delete',
     'reconstructor'
 ]
 
@@ -25,3 +29,28 @@ after_update = create_decorator('after_update')
 before_delete = create_decorator('before_delete')
 after_delete = create_decorator('after_delete')
 
+class BulkEventMethod(classmethod):
+    '''
+    A class method called by the bulk operations of entities (update_where
+    and delete_where).
+    '''
+
+def create_bulk_decorator(event_name):
+    def decorator(func):
+        if isinstance(func, BulkEventMethod):
+            func = func.func
+        if not hasattr(func, '_elixir_bulk_events'):
+            func._elixir_bulk_events = []
+        func._elixir_bulk_events.append(event_name)
+        method = BulkEventMethod(func)
+        method.func = func
+        # the marker is needed on the class attribute so that the method is
+        # recorded as a callback when the entity is created
+        method._elixir_bulk_events = func._elixir_bulk_events
+        return method
+    return decorator
+
+before_bulk_update = create_bulk_decorator('before_bulk_update')
+after_bulk_update = create_bulk_decorator('after_bulk_update')
+before_bulk_delete = create_bulk_decorator('before_bulk_delete')
+after_bulk_delete = create_bulk_decorator('after_bulk_delete')
@@ -46,7 +46,6 @@ values within the entity's main table will be versioned into the history table.
 '''
 
 from datetime              import datetime
-import inspect
 
 from sqlalchemy            import Table, Column, and_, desc
 from sqlalchemy.orm        import mapper, MapperExtension, EXT_CONTINUE, \
@@ -55,7 +54,7 @@ from sqlalchemy.orm        import mapper, MapperExtension, EXT_CONTINUE, \
 from elixir                import Integer, DateTime
 from elixir.statements     import Statement
 from elixir.properties     import EntityBuilder
-from elixir.entity         import getmembers
+from elixir.entity         import getcallbacks, CALLBACK_MARKERS
 
 __all__ = ['acts_as_versioned', 'after_revert']
 __doc_all__ = []
@@ -164,6 +163,11 @@ class VersionedEntityBuilder(EntityBuilder):
         self.add_table_column(Column(version_colname, Integer))
         #if timestamp_colname not in col_names:
         self.add_table_column(Column(timestamp_colname, DateTime))
+        # used by bulk_insert, which bypasses the mapper extension
+        self.entity._descriptor.insert_defaults.update({
+            version_colname: 1,
+            timestamp_colname: datetime.now
+        })
 
         # add a concurrent_version column to the entity, if required
         if self.check_concurrent:
@@ -177,8 +181,8 @@ class VersionedEntityBuilder(EntityBuilder):
 
         # look for events
         after_revert_events = []
-        for name, func in getmembers(entity, inspect.ismethod):
-            if getattr(func, '_elixir_after_revert', False):
+        for name, func in getcallbacks(entity, '_elixir_after_revert'):
+            if func._elixir_after_revert:
                 after_revert_events.append(func)
 
         # create a history table for the entity
@@ -285,4 +289,6 @@ def after_revert(func):
     func._elixir_after_revert = True
     return func
 
+CALLBACK_MARKERS.append('_elixir_after_revert')
+
 
@@ -0,0 +1,329 @@
+'''
+Dependency graph of entities.
+
+The ``EntityGraph`` class computes, once, the dependencies between a list of
+entities from their declarations (fields with foreign keys, ManyToOne
+relationships and inheritance), before or after their setup. It is used by
+setup_entities to setup entities after the entities they depend on, by
+setup_all to warn about cycles of foreign keys which would prevent the tables
+from being created, and by create_all and drop_all to process the tables of
+independent entities in separate batches. It can also be used by tools, for
+example to find which entities a given entity pulls in:
+
+.. sourcecode:: python
+
+    graph = EntityGraph(elixir.entities)
+    print graph.related(Movie)
+    print graph.batches()
+'''
+
+import warnings
+
+from sqlalchemy import ForeignKey, Table
+
+from elixir.entity import EntityMeta
+from elixir.fields import Field
+from elixir.relationships import ManyToOne
+
+__doc_all__ = ['EntityGraph']
+
+
+class Dependency(object):
+    '''
+    An edge of the graph: `entity` depends on `target` because of `label`
+    (the name of a field or relationship, or "inheritance").
+    '''
+
+    def __init__(self, entity, target, label, foreign_key, use_alter=False):
+        self.entity = entity
+        self.target = target
+        self.label = label
+        # whether the dependency is a foreign key between the tables
+        self.foreign_key = foreign_key
+        # whether the foreign key constraint is created separately
+        self.use_alter = use_alter
+
+    def __repr__(self):
+        return '<Dependency %s.%s -> %s>' % (self.entity.__name__, self.label,
+                                             self.target.__name__)
+
+
+class EntityGraph(object):
+    '''
+    Dependency graph of the given list of entities. Entities outside of that
+    list are ignored.
+    '''
+
+    def __init__(self, entities):
+        self.entities = list(entities)
+        index = dict((entity, i) for i, entity in enumerate(self.entities))
+        self._index = index
+
+        tables = {}
+        for entity in self.entities:
+            desc = entity._descriptor
+            if not (desc.parent and desc.inheritance == 'single'):
+                tables.setdefault(desc.tablename, entity)
+                tables.setdefault(desc.table_fullname, entity)
+
+        self._dependencies = {}
+        self._related = {}
+        for entity in self.entities:
+            deps = []
+            related = set()
+            desc = entity._descriptor
+
+            if desc.parent in index:
+                deps.append(Dependency(entity, desc.parent, 'inheritance',
+                                       desc.inheritance == 'multi'))
+            for child in desc.children:
+                if child in index:
+                    related.add(child)
+
+            for builder in desc.builders:
+                if isinstance(builder, ManyToOne):
+                    target = builder.target
+                    if target in index:
+                        deps.append(Dependency(entity, target, builder.name,
+                            True, builder.constraint_kwargs.get('use_alter')))
+                elif isinstance(builder, Field):
+                    for arg in builder.args:
+                        if not isinstance(arg, ForeignKey):
+                            continue
+                        target = tables.get(_fk_tablename(arg))
+                        if target is not None:
+                            deps.append(Dependency(entity, target,
+                                builder.name, True, arg.use_alter))
+            for rel in desc.relationships:
+                if isinstance(rel.target, EntityMeta) and rel.target in index:
+                    related.add(rel.target)
+
+            for dep in deps:
+                related.add(dep.target)
+            related.discard(entity)
+            self._dependencies[entity] = deps
+            self._related[entity] = related
+
+        # relationships are not always declared on both sides
+        for entity in self.entities:
+            for other in self._related[entity]:
+                self._related[other].add(entity)
+
+    def dependencies(self, entity):
+        '''
+        Returns the list of `Dependency` objects of `entity`.
+        '''
+        return self._dependencies[entity]
+
+    def dependents(self, entity):
+        '''
+        Returns the list of entities depending directly on `entity`.
+        '''
+        return [e for e in self.entities
+                if [d for d in self._dependencies[e] if d.target is entity]]
+
+    def related(self, entity):
+        '''
+        Returns the list of all the entities `entity` pulls in, that is all
+        entities it is connected to, directly or not, through relationships
+        or inheritance (in the order of the graph's entities).
+        '''
+        seen = set([entity])
+        stack = [entity]
+        while stack:
+            for other in self._related[stack.pop()]:
+                if other not in seen:
+                    seen.add(other)
+                    stack.append(other)
+        seen.discard(entity)
+        return self._sorted(seen)
+
+    def components(self):
+        '''
+        Returns the list of groups of entities which are independent from
+        each other.
+        '''
+        components = []
+        seen = set()
+        for entity in self.entities:
+            if entity not in seen:
+                component = [entity] + self.related(entity)
+                seen.update(component)
+                components.append(self._sorted(component))
+        return components
+
+    def order(self):
+        '''
+        Returns the entities sorted so that each entity comes after the
+        entities it depends on. Entities which are part of a cycle are kept
+        in their original order.
+        '''
+        result = []
+        for component in self._strongly_connected(lambda dep: True):
+            result.extend(component)
+        return result
+
+    def batches(self):
+        '''
+        Returns the entities as a list of batches. The entities of each batch
+        only depend on entities of the previous batches (or on entities of
+        the same cycle).
+        '''
+        levels = {}
+        batches = []
+        for component in self._strongly_connected(lambda dep: True):
+            level = 0
+            for entity in component:
+                for dep in self._dependencies[entity]:
+                    if dep.target not in component:
+                        level = max(level, levels[dep.target] + 1)
+            for entity in component:
+                levels[entity] = level
+            if level == len(batches):
+                batches.append([])
+            batches[level].extend(component)
+        return [self._sorted(batch) for batch in batches]
+
+    def table_batches(self, metadata):
+        '''
+        Returns the tables of `metadata` as a list of batches, one for each
+        group of independent entities (see `components`), which can be
+        created in that order (and dropped in the reverse order). The other
+        tables (eg. many-to-many tables) go in the batch of the last table
+        they reference, or in the first batch.
+        '''
+        component_of = {}
+        for i, component in enumerate(self.components()):
+            for entity in component:
+                # entities waiting for their lazy setup have no table yet
+                table = entity.__dict__.get('table')
+                if isinstance(table, Table):
+                    component_of[table] = i
+
+        keys = {}
+        for table in metadata.sorted_tables:
+            key = component_of.get(table, -1)
+            for fk in table.foreign_keys:
+                key = max(key, keys.get(fk.column.table, -1))
+            keys[table] = key
+
+        batches = {}
+        for table in metadata.sorted_tables:
+            batches.setdefault(keys[table], []).append(table)
+        return [batches[key] for key in sorted(batches)]
+
+    def cycles(self):
+        '''
+        Returns the list of cycles of foreign keys (not using "use_alter")
+        between the tables of different entities. Each cycle is returned as
+        the list of the dependencies it is made of.
+        '''
+        def is_fk(dep):
+            return dep.foreign_key and not dep.use_alter
+
+        cycles = []
+        for component in self._strongly_connected(is_fk):
+            if len(component) > 1:
+                # self-referencing foreign keys are not a problem
+                cycles.append([dep for entity in component
+                               for dep in self._dependencies[entity]
+                               if is_fk(dep) and dep.target in component
+                                  and dep.target is not entity])
+        return cycles
+
+    def check_cycles(self, entities=None):
+        '''
+        Issue a warning if the foreign keys between the entities form a
+        cycle, in which case their tables cannot be created (nor dropped)
+        without the "use_alter" argument. The warning lists the relationships
+        and fields which could use it to break the cycle. If `entities` is
+        given, only the cycles involving one of them are reported.
+        '''
+        cycles = self.cycles()
+        if entities is not None:
+            entities = set(entities)
+            cycles = [cycle for cycle in cycles
+                      if [dep for dep in cycle if dep.entity in entities]]
+        if not cycles:
+            return
+        messages = []
+        for cycle in cycles:
+            candidates = ['%s.%s' % (dep.entity.__name__, dep.label)
+                          for dep in cycle if dep.label != 'inheritance']
+            messages.append("between entities %s. Use the 'use_alter' "
+                            "argument on one of: %s"
+                            % (', '.join(self._names(cycle)),
+                               ', '.join(candidates)))
+        warnings.warn("Circular foreign key dependency %s."
+                      % '; '.join(messages))
+
+    def _names(self, cycle):
+        entities = set([dep.entity for dep in cycle])
+        return [e.__name__ for e in self._sorted(entities)]
+
+    def _sorted(self, entities):
+        return sorted(entities, key=self._index.__getitem__)
+
+    def _strongly_connected(self, follow):
+        '''
+        Returns the strongly connected components of the graph, following
+        only the dependencies for which `follow` returns True, each sorted in
+        the original order. Components come after the components they depend
+        on (this is Tarjan's algorithm, without recursion so that long chains
+        of dependencies don't hit the recursion limit).
+        '''
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+        counter = 0
+
+        for root in self.entities:
+            if root in index:
+                continue
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self._dependencies[root]))]
+            while work:
+                entity, deps = work[-1]
+                for dep in deps:
+                    if not follow(dep):
+                        continue
+                    target = dep.target
+                    if target not in index:
+                        index[target] = lowlink[target] = counter
+                        counter += 1
+                        stack.append(target)
+                        on_stack.add(target)
+                        work.append((target, iter(self._dependencies[target])))
+                        break
+                    elif target in on_stack:
+                        lowlink[entity] = min(lowlink[entity], index[target])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent],
+                                              lowlink[entity])
+                    if lowlink[entity] == index[entity]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member is entity:
+                                break
+                        components.append(self._sorted(component))
+        return components
+
+
+def _fk_tablename(fk):
+    colspec = fk._colspec
+    if isinstance(colspec, basestring):
+        return colspec.rsplit('.', 1)[0]
+    elif colspec.table is not None:
+        return colspec.table.fullname
+    return None
@@ -0,0 +1,193 @@
+'''
+Keyset ("seek") pagination helpers.
+
+Instead of skipping rows with an OFFSET, which gets slower with every page,
+the rows following a given row are selected with a criterion on the values of
+the columns the query is ordered by, which can use an index and costs the same
+for every page. For this to be deterministic, the order must be total, so the
+primary key columns are always appended to the order.
+
+The values of the row to start after are given to the client as an opaque
+"cursor" string (see encode_cursor).
+
+NULL values cannot be compared, so the rows are ordered as if they were
+greater than any other value (they come last in ascending order, and first in
+descending order, whatever the database does by default), and the criterion
+selects them with separate "IS NULL" terms, which an index can serve. On the
+databases which sort NULL values that way natively (see NULLS_LAST_DIALECTS),
+the columns are ordered as is. On the others, nullable columns are ordered by
+an extra CASE expression, which prevents the database from using an index to
+sort the rows (unless it is an index on that expression): make the columns
+used for pagination non nullable there if possible.
+'''
+
+import base64
+import datetime
+import urllib
+from decimal import Decimal
+
+from sqlalchemy import and_, or_, desc, case
+
+__doc_all__ = []
+
+# the databases on which NULL values come after any other value in ascending
+# order, and before them in descending order
+NULLS_LAST_DIALECTS = ('postgresql', 'oracle')
+
+
+def keyset_order(entity, order_by=None):
+    '''
+    Returns the list of the (column, descending) pairs the rows of `entity`
+    are ordered by: `order_by` (given as for the order_by option, and which
+    defaults to that option), followed by the primary key columns which are
+    not part of it.
+    '''
+    descriptor = entity._descriptor
+    if order_by is None:
+        order_by = descriptor.order_by or []
+    if isinstance(order_by, basestring):
+        order_by = [order_by]
+
+    order = []
+    for colname in order_by:
+        # see translate_order_by
+        col = descriptor.get_column(colname.strip('-'))
+        order.append((col, colname.startswith('-')))
+    for col in entity.mapper.primary_key:
+        if not [c for c, descending in order if c is col]:
+            order.append((col, False))
+    return order
+
+
+def order_clauses(order, dialect=None):
+    '''
+    Returns the ORDER BY clauses corresponding to `order`, on the given
+    database dialect. NULL values of nullable columns come after the other
+    values.
+    '''
+    nulls_last = dialect is not None and dialect.name in NULLS_LAST_DIALECTS
+    clauses = []
+    for col, descending in order:
+        keys = [col]
+        if col.nullable and not nulls_last:
+            keys.insert(0, case([(col == None, 1)], else_=0))
+        if descending:
+            keys = [desc(key) for key in keys]
+        clauses.extend(keys)
+    return clauses
+
+
+def _after(col, descending, value):
+    # returns the list of the criteria on col selecting the values which
+    # come after `value`, NULL values coming after all the other values
+    if value is None:
+        if descending:
+            return [col != None]
+        return []
+    if descending:
+        return [col < value]
+    if col.nullable:
+        return [col > value, col == None]
+    return [col > value]
+
+
+def after_criterion(order, values):
+    '''
+    Returns the criterion selecting the rows which come after the row having
+    the given `values` for the columns of `order`.
+    '''
+    clauses = []
+    for i, (col, descending) in enumerate(order):
+        # == None is rendered as IS NULL
+        conditions = [c == value
+                      for (c, d), value in zip(order[:i], values[:i])]
+        for after in _after(col, descending, values[i]):
+            clauses.append(and_(*(conditions + [after])))
+    return or_(*clauses)
+
+
+def key_values(instance, order):
+    '''
+    Returns the tuple of the values of the columns of `order` for the given
+    instance.
+    '''
+    mapper = instance.mapper
+    return tuple([getattr(instance, mapper.get_property_by_column(col).key)
+                  for col, descending in order])
+
+
+# type tags used in cursors
+_encoders = [
+    (type(None), 'n', lambda value: ''),
+    # bool must come before int, as it is a subclass of it
+    (bool, 'b', lambda value: str(int(value))),
+    (int, 'i', str),
+    (long, 'i', str),
+    (float, 'f', repr),
+    (unicode, 'u', lambda value: value.encode('utf-8')),
+    (str, 's', str),
+    (datetime.datetime, 'dt', lambda value: '%d-%d-%d-%d-%d-%d-%d' % (
+                                  value.year, value.month, value.day,
+                                  value.hour, value.minute, value.second,
+                                  value.microsecond)),
+    (datetime.date, 'd', lambda value: '%d-%d-%d' % (
+                             value.year, value.month, value.day)),
+    (datetime.time, 't', lambda value: '%d-%d-%d-%d' % (
+                             value.hour, value.minute, value.second,
+                             value.microsecond)),
+    (Decimal, 'D', str),
+]
+
+
+def _ints(text):
+    return [int(part) for part in text.split('-')]
+
+
+_decoders = {
+    'n': lambda text: None,
+    'b': lambda text: bool(int(text)),
+    'i': int,
+    'f': float,
+    'u': lambda text: text.decode('utf-8'),
+    's': str,
+    'dt': lambda text: datetime.datetime(*_ints(text)),
+    'd': lambda text: datetime.date(*_ints(text)),
+    't': lambda text: datetime.time(*_ints(text)),
+    'D': Decimal,
+}
+
+
+def encode_cursor(values):
+    '''
+    Encodes the tuple of the values of a row into an opaque string, which
+    can safely be given to clients (as opposed to a pickle).
+    '''
+    parts = []
+    for value in values:
+        for type_, tag, encode in _encoders:
+            if isinstance(value, type_):
+                parts.append('%s:%s' % (tag, urllib.quote(encode(value))))
+                break
+        else:
+            raise Exception("Cannot use a value of type '%s' in a cursor."
+                            % type(value).__name__)
+    return base64.urlsafe_b64encode(','.join(parts))
+
+
+def decode_cursor(cursor, num_values):
+    '''
+    Decodes a cursor returned by encode_cursor into the tuple of values it
+    was made of, checking that there are `num_values` values.
+    '''
+    try:
+        parts = base64.urlsafe_b64decode(str(cursor)).split(',')
+        values = []
+        for part in parts:
+            tag, text = part.split(':', 1)
+            values.append(_decoders[tag](urllib.unquote(text)))
+    except Exception:
+        raise Exception("Invalid cursor: %r" % cursor)
+    if len(values) != num_values:
+        raise Exception("Invalid cursor: %r (expected %d values, got %d)"
+                        % (cursor, num_values, len(values)))
+    return tuple(values)
@@ -0,0 +1,410 @@
+'''
+Batch loading of relationships.
+
+Accessing a lazy relationship on each instance of a list issues one query per
+instance. The functions of this module load a relationship for a whole list
+of instances at once, with one query per relationship (split in chunks when
+there are many instances), and store the results into the instances as if
+they had been lazily loaded.
+
+It also provides the loader strategy of the relationships using
+``lazy='batch'``, which, when the relationship of an instance is first
+accessed, loads it for all the instances which were loaded (by queries) in the
+same session and have not loaded it yet. SQLAlchemy has no public hook to
+replace the lazy loading of an attribute: the strategy supports the hooks of
+SQLAlchemy 0.6 and 0.7, and raises an exception when the relationship is setup
+with other versions.
+'''
+
+import weakref
+
+import sqlalchemy
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import object_mapper, object_session
+from sqlalchemy.orm.attributes import instance_state, instance_dict, \
+                                      set_committed_value, ATTR_WAS_SET, \
+                                      PASSIVE_OFF
+from sqlalchemy.orm.session import _state_session
+from sqlalchemy.orm.strategies import LazyLoader, LoadLazyAttribute
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.expression import ClauseList
+
+from elixir import options
+
+__doc_all__ = ['prefetch']
+
+
+def in_criterion(cols, idents):
+    '''
+    Returns the criterion matching the rows whose values for the `cols`
+    columns are one of the `idents` tuples.
+    '''
+    if len(cols) == 1:
+        return cols[0].in_([ident[0] for ident in idents])
+    return or_(*[and_(*[col == value for col, value in zip(cols, ident)])
+                 for ident in idents])
+
+
+def chunks(idents, num_cols, chunk_size=None):
+    '''
+    Splits the list of `idents` tuples in chunks which can be used in a
+    single "IN" criterion on `num_cols` columns.
+    '''
+    if chunk_size is None:
+        chunk_size = max(1, options.MAX_IN_PARAMETERS // num_cols)
+    for start in range(0, len(idents), chunk_size):
+        yield idents[start:start + chunk_size]
+
+
+def _clauses(clause):
+    if isinstance(clause, ClauseList) and clause.operator is operators.and_:
+        result = []
+        for sub in clause.clauses:
+            result.extend(_clauses(sub))
+        return result
+    return [clause]
+
+
+def _is_simple_join(join, pairs):
+    '''
+    Tests whether the `join` condition is made only of the equality of the
+    given pairs of columns (in any order).
+    '''
+    clauses = _clauses(join)
+    if len(clauses) != len(pairs):
+        return False
+    for left, right in pairs:
+        expected = left == right
+        if not [c for c in clauses if expected.compare(c)]:
+            return False
+    return True
+
+
+def batch_loadable(prop):
+    '''
+    Tests whether the relationship `prop` can be loaded for several
+    instances at once.
+    '''
+    if prop.secondary is None:
+        pairs = prop.local_remote_pairs
+    else:
+        pairs = prop.synchronize_pairs
+    return _is_simple_join(prop.primaryjoin, pairs)
+
+
+def load_relationship(instances, key):
+    '''
+    Loads the `key` relationship of all the given (persistent) instances
+    where it is not loaded yet, with as few queries as possible.
+    Relationships with a join condition which is not a simple equality of
+    columns are loaded one instance at a time.
+    '''
+    groups = {}
+    order = []
+    seen = set()
+    for instance in instances:
+        if instance is None or id(instance) in seen:
+            continue
+        seen.add(id(instance))
+        state = instance_state(instance)
+        if state.key is None or key in instance_dict(instance):
+            continue
+        group_key = (object_mapper(instance), object_session(instance))
+        if group_key not in groups:
+            groups[group_key] = []
+            order.append(group_key)
+        groups[group_key].append(instance)
+
+    for group_key in order:
+        mapper, session = group_key
+        group = groups[group_key]
+        prop = mapper.get_property(key)
+        if session is None or not _load(session, mapper, prop, group):
+            for instance in group:
+                getattr(instance, key)
+
+
+def prefetch(instances, *paths):
+    '''
+    Loads the relationships given by `paths` for all the given instances,
+    with one query per relationship (split in chunks when there are many
+    instances) instead of one per instance, so that accessing them later
+    doesn't issue any query. Each path is the name of a relationship, or a
+    dotted path of relationships, in which case the relationships are loaded
+    for all the instances reached through the previous ones:
+
+    .. sourcecode:: python
+
+        directors = Director.query.all()
+        prefetch(directors, 'movies.actors', 'movies.genre')
+        for director in directors:
+            for movie in director.movies:
+                print movie.title, movie.genre.name, len(movie.actors)
+    '''
+    for path in paths:
+        level = instances
+        for key in path.split('.'):
+            load_relationship(level, key)
+            related = []
+            # instances reached through several others (eg. through
+            # many-to-many relationships) are only kept once, so that the
+            # levels don't grow with the number of edges
+            seen = set()
+            for instance in level:
+                if instance is None:
+                    continue
+                value = getattr(instance, key)
+                if object_mapper(instance).get_property(key).uselist:
+                    if isinstance(value, dict):
+                        value = value.values()
+                else:
+                    value = [value]
+                for obj in value:
+                    if obj is not None and id(obj) not in seen:
+                        seen.add(id(obj))
+                        related.append(obj)
+            level = related
+
+
+def _load(session, mapper, prop, instances):
+    target = prop.mapper
+    if not batch_loadable(prop):
+        return False
+    if prop.secondary is None:
+        pairs = prop.local_remote_pairs
+    else:
+        # the pairs of columns between the table of the instances and the
+        # secondary table
+        pairs = prop.synchronize_pairs
+
+    local_keys = [mapper.get_property_by_column(local).key
+                  for local, remote in pairs]
+
+    idents = {}
+    expired = []
+    for instance in instances:
+        ident = _state_ident(instance_state(instance), mapper, pairs,
+                             local_keys)
+        if ident is None:
+            expired.append(instance)
+        else:
+            idents[id(instance)] = ident
+    if expired:
+        # refresh them all at once rather than one by one on access
+        _refresh(session, mapper, expired)
+        for instance in expired:
+            ident = tuple([getattr(instance, k) for k in local_keys])
+            idents[id(instance)] = ident
+    values = set([ident for ident in idents.itervalues()
+                  if None not in ident])
+
+    related = {}
+    remote_cols = [remote for local, remote in pairs]
+    if prop.secondary is None and not prop.uselist and \
+       set(remote_cols) == set(target.primary_key):
+        # many-to-one on the primary key of the target: look into the
+        # identity map first, as query.get would
+        identity_map = session.identity_map
+        pk_order = [remote_cols.index(col) for col in target.primary_key]
+        for ident in list(values):
+            key = target.identity_key_from_primary_key(
+                      [ident[i] for i in pk_order])
+            obj = identity_map.get(key)
+            if obj is not None and not instance_state(obj).expired and \
+               isinstance(obj, target.class_):
+                related[ident] = [obj]
+                values.discard(ident)
+    values = list(values)
+    for chunk in chunks(values, len(remote_cols)):
+        criterion = in_criterion(remote_cols, chunk)
+        if prop.secondary is None:
+            remote_keys = [target.get_property_by_column(col).key
+                           for col in remote_cols]
+            query = session.query(target.class_).filter(criterion)
+        else:
+            query = session.query(target.class_, *remote_cols) \
+                           .filter(prop.secondaryjoin).filter(criterion)
+        if prop.order_by:
+            query = query.order_by(*prop.order_by)
+        for row in query:
+            if prop.secondary is None:
+                obj = row
+                ident = tuple([getattr(obj, k) for k in remote_keys])
+            else:
+                obj = row[0]
+                ident = tuple(row[1:])
+            related.setdefault(ident, []).append(obj)
+
+    for instance in instances:
+        objs = related.get(idents[id(instance)], [])
+        if prop.uselist:
+            value = objs
+        elif objs:
+            value = objs[0]
+        else:
+            value = None
+        set_committed_value(instance, prop.key, value)
+    return True
+
+
+def check_lazy_loader():
+    '''
+    Raises an exception if the lazy loader strategy of SQLAlchemy has none of
+    the (private) hooks used to replace the loading of an attribute: the
+    `_load_for_state` method in SQLAlchemy 0.7, or the `_class_level_loader`
+    method in SQLAlchemy 0.6.
+    '''
+    if not hasattr(LazyLoader, '_load_for_state') and \
+       not hasattr(LazyLoader, '_class_level_loader'):
+        raise Exception("Custom lazy loaders are not supported with "
+                        "SQLAlchemy %s." % sqlalchemy.__version__)
+
+
+# the value returned by CustomLazyLoader.load when the load must be done by
+# SQLAlchemy
+NOT_LOADED = object()
+
+
+class CustomLoadLazyAttribute(LoadLazyAttribute):
+    '''
+    Lazy loader of a relationship using a `CustomLazyLoader` strategy (for
+    SQLAlchemy 0.6).
+    '''
+
+    def __call__(self, passive=PASSIVE_OFF):
+        state = self.state
+        prop = object_mapper(state.obj()).get_property(self.key)
+        strategy = prop._get_strategy(prop.strategy_class)
+        value = strategy.load(state, passive)
+        if value is NOT_LOADED:
+            return LoadLazyAttribute.__call__(self, passive)
+        return value
+
+
+class CustomLazyLoader(LazyLoader):
+    '''
+    Base class of the loader strategies replacing the lazy loads of
+    SQLAlchemy, through the hooks of SQLAlchemy 0.6 and 0.7. Subclasses
+    implement the `load` method.
+    '''
+
+    def init(self):
+        check_lazy_loader()
+        LazyLoader.init(self)
+
+    def load_session(self, state, passive):
+        '''
+        Returns the session in which the relationship of `state` can be
+        loaded, or None if the load must be done by SQLAlchemy.
+        '''
+        session = _state_session(state)
+        # passive loads must not fetch anything: let SQLAlchemy handle them
+        if passive is not PASSIVE_OFF or session is None or \
+           state.key is None or session._flushing:
+            return None
+        return session
+
+    def load(self, state, passive):
+        '''
+        Returns the value of the relationship for `state` (or ATTR_WAS_SET if
+        it was set directly), or NOT_LOADED if the load must be done by
+        SQLAlchemy.
+        '''
+        raise NotImplementedError
+
+    def _load_for_state(self, state, passive):
+        # SQLAlchemy 0.7
+        value = self.load(state, passive)
+        if value is NOT_LOADED:
+            return LazyLoader._load_for_state(self, state, passive)
+        return value
+
+    def _class_level_loader(self, state):
+        # SQLAlchemy 0.6
+        if LazyLoader._class_level_loader(self, state) is None:
+            return None
+        return CustomLoadLazyAttribute(state, self.key)
+
+
+class BatchLazyLoader(CustomLazyLoader):
+    '''
+    Loader strategy of the relationships using ``lazy='batch'``.
+    '''
+
+    def init(self):
+        CustomLazyLoader.init(self)
+        # the states loaded by queries in each session, which are the
+        # candidates for the next batch load
+        self.loaded = weakref.WeakKeyDictionary()
+
+    def create_row_processor(self, context, *args):
+        populators = LazyLoader.create_row_processor(self, context, *args)
+        new_execute = populators[0]
+        session = context.session
+        if session is None or new_execute is None:
+            return populators
+
+        loaded = self.loaded.get(session)
+        if loaded is None:
+            loaded = self.loaded[session] = weakref.WeakKeyDictionary()
+
+        def collect(state, dict_, row):
+            new_execute(state, dict_, row)
+            loaded[state] = True
+        return (collect,) + tuple(populators[1:])
+
+    def load(self, state, passive):
+        '''
+        Loads the relationship for `state` and the other instances loaded in
+        the same session which have not loaded it yet.
+        '''
+        session = self.load_session(state, passive)
+        if session is None or not batch_loadable(self.parent_property):
+            return NOT_LOADED
+
+        key = self.key
+        instances = [state.obj()]
+        loaded = self.loaded.get(session, {})
+        for other in loaded.keys():
+            if key in other.dict or _state_session(other) is not session:
+                # already loaded, or not part of the session anymore
+                del loaded[other]
+                continue
+            # expired instances would each need to be refreshed
+            if other is state or other.expired:
+                continue
+            obj = other.obj()
+            if obj is not None:
+                instances.append(obj)
+        load_relationship(instances, key)
+        return ATTR_WAS_SET
+
+
+def _state_ident(state, mapper, pairs, local_keys):
+    '''
+    Returns the values of the local columns of `pairs` for `state`, read
+    from its loaded attributes or its identity key (going through the
+    attributes would refresh an expired instance), or None if some of them
+    are not loaded.
+    '''
+    pk_cols = list(mapper.primary_key)
+    ident = []
+    for (local, remote), key in zip(pairs, local_keys):
+        if key in state.dict:
+            ident.append(state.dict[key])
+        elif local in pk_cols:
+            ident.append(state.key[1][pk_cols.index(local)])
+        else:
+            return None
+    return tuple(ident)
+
+
+def _refresh(session, mapper, instances):
+    '''
+    Reloads the expired attributes of the given persistent instances, with
+    one query per chunk of instances.
+    '''
+    pk_cols = list(mapper.primary_key)
+    idents = [instance_state(instance).key[1] for instance in instances]
+    for chunk in chunks(idents, len(pk_cols)):
+        session.query(mapper.class_).filter(in_criterion(pk_cols, chunk)).all()
@@ -113,6 +113,19 @@ The list of supported arguments are as follows:
 |                     | list of strings, composed of the field name,          |
 |                     | optionally lead by a minus (for descending order).    |
 +---------------------+-------------------------------------------------------+
+| ``cache``           | Put a cache shared by all sessions in front of the    |
+|                     | ``get`` method of the entity and of the lazy loads of |
+|                     | the ManyToOne relationships targeting it. Either      |
+|                     | ``True``, a dictionary of arguments for               |
+|                     | ``elixir.cache.LRUCache`` (``max_size`` and ``ttl``)  |
+|                     | or a cache object. See the ``elixir.cache`` module.   |
+|                     | Defaults to ``None`` (no cache).                      |
++---------------------+-------------------------------------------------------+
+| ``get_by_cache``    | Cache the results of the ``get_by`` method of the     |
+|                     | entity, in a cache shared by all sessions. It accepts |
+|                     | the same values as the ``cache`` option. Defaults to  |
+|                     | ``None`` (no cache).                                  |
++---------------------+-------------------------------------------------------+
 | ``session``         | Specify a custom contextual session for this entity.  |
 |                     | By default, entities uses the global                  |
 |                     | ``elixir.session``.                                   |
@@ -197,6 +210,7 @@ NEW_M2MCOL_NAMEFORMAT = default_m2m_column_formatter
 
 # format constants
 FKCOL_NAMEFORMAT = "%(relname)s_%(key)s"
+COUNTERCACHECOL_NAMEFORMAT = "%(relname)s_count"
 M2MCOL_NAMEFORMAT = NEW_M2MCOL_NAMEFORMAT
 CONSTRAINT_NAMEFORMAT = "%(tablename)s_%(colnames)s_fk"
 MULTIINHERITANCECOL_NAMEFORMAT = "%(entity)s_%(key)s"
@@ -208,6 +222,12 @@ DEFAULT_VERSION_ID_COL_NAME = "row_version"
 DEFAULT_POLYMORPHIC_COL_NAME = "row_type"
 POLYMORPHIC_COL_SIZE = 40
 POLYMORPHIC_COL_TYPE = String(POLYMORPHIC_COL_SIZE)
+# maximum number of bound parameters in a single "IN" query (this is the
+# default SQLITE_MAX_VARIABLE_NUMBER, which is the lowest of all supported
+# databases)
+MAX_IN_PARAMETERS = 999
+# number of rows sent to the database at once by bulk operations
+DEFAULT_BATCH_SIZE = 1000
 
 # debugging/migration help
 MIGRATION_TO_07_AID = False
@@ -226,6 +246,8 @@ options_defaults = dict(
     allowcoloverride=False,
     order_by=None,
     resolve_root=None,
+    cache=None,
+    get_by_cache=None,
     mapper_options={},
     table_options={}
 )
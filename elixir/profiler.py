@@ -0,0 +1,115 @@
+'''
+Profiling of the setup of entities.
+
+When setup_all() is slow, it can be hard to tell which entities or which
+extensions are responsible. Passing ``profile=True`` to setup_all records the
+time spent in (and the number of calls to) each setup phase, each entity and
+each builder method invoked during the setup, and returns a ``SetupProfile``
+object holding those statistics:
+
+.. sourcecode:: python
+
+    profile = setup_all(profile=True)
+    for name, calls, duration in profile.sorted('builders')[:10]:
+        print "%-50s %5d %8.3f" % (name, calls, duration)
+    open('setup_profile.json', 'w').write(profile.to_json())
+
+Builders (fields, relationships, statements of extensions like
+acts_as_versioned, ...) are reported as "BuilderClass.method". Times are wall
+clock times in seconds and include the time spent in nested calls, so the time
+of a phase includes the time of the builders it called.
+'''
+
+from timeit import default_timer
+
+try:
+    import json
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        json = None
+
+__doc_all__ = ['SetupProfile']
+
+CATEGORIES = ('phases', 'entities', 'builders')
+
+
+class SetupProfile(object):
+    '''
+    Statistics about the setup of a list of entities. For each of the
+    "phases", "entities" and "builders" categories, the corresponding
+    attribute is a dictionary mapping names to [calls, time] lists.
+    '''
+
+    def __init__(self):
+        self.phases = {}
+        self.entities = {}
+        self.builders = {}
+        # total time spent in setup_entities
+        self.total = 0.0
+
+    def record(self, category, name, duration):
+        stats = getattr(self, category)
+        entry = stats.get(name)
+        if entry is None:
+            stats[name] = [1, duration]
+        else:
+            entry[0] += 1
+            entry[1] += duration
+
+    def call(self, category, name, func, *args, **kwargs):
+        '''
+        Call `func` with the given arguments and record the time it took under
+        `name` in `category`.
+        '''
+        start = default_timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.record(category, name, default_timer() - start)
+
+    def sorted(self, category, key='time', reverse=True):
+        '''
+        Returns the statistics of the given category as a list of (name,
+        calls, time) tuples, sorted by `key` which can be "time", "calls" or
+        "name". By default, the most expensive items come first.
+        '''
+        if category not in CATEGORIES:
+            raise ValueError("Invalid category '%s'. Valid categories are: "
+                             "%s" % (category, ', '.join(CATEGORIES)))
+        index = {'name': 0, 'calls': 1, 'time': 2}.get(key)
+        if index is None:
+            raise ValueError("Invalid sort key '%s'. Valid keys are: "
+                             "name, calls, time" % key)
+        rows = [(name, calls, duration)
+                for name, (calls, duration) in getattr(self, category).items()]
+        rows.sort(key=lambda row: row[index], reverse=reverse)
+        return rows
+
+    def to_dict(self):
+        data = {'total': self.total}
+        for category in CATEGORIES:
+            data[category] = [{'name': name, 'calls': calls, 'time': duration}
+                              for name, calls, duration
+                              in self.sorted(category)]
+        return data
+
+    def to_json(self, **kwargs):
+        '''
+        Returns the statistics as a JSON string. Keyword arguments are
+        forwarded to json.dumps.
+        '''
+        if json is None:
+            raise Exception("Exporting a setup profile to JSON requires "
+                            "python 2.6+ or the simplejson package.")
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def __str__(self):
+        lines = ['Total setup time: %.3fs' % self.total]
+        for category in CATEGORIES:
+            lines.append('')
+            lines.append('%-60s %7s %10s' % (category, 'calls', 'time (s)'))
+            for name, calls, duration in self.sorted(category)[:20]:
+                lines.append('%-60s %7d %10.4f' % (name, calls, duration))
+        return '\n'.join(lines)
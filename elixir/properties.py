@@ -30,8 +30,13 @@ Here is a quick example of how to use ``has_property``.
                          (c.quantity * c.unit_price).label('price')))
 '''
 
+from copy import copy, deepcopy
+
 from elixir.statements import PropertyStatement
 from sqlalchemy.orm import column_property, synonym
+from sqlalchemy.orm.interfaces import MapperProperty
+from sqlalchemy.schema import SchemaItem
+from sqlalchemy.types import SchemaType
 
 __doc_all__ = ['EntityBuilder', 'Property', 'GenericProperty',
                'ColumnProperty']
@@ -126,10 +131,49 @@ class Property(EntityBuilder):
         # register this property as a builder
         entity._descriptor.builders.append(self)
 
+    def clone(self):
+        '''
+        Return a copy of this property, suitable to be attached to another
+        entity. This is used to give each concrete entity its own instance of
+        the properties defined on its abstract base classes, which act as
+        templates. Only the state which can be modified during the setup
+        (containers, schema items and SQLAlchemy properties) is copied,
+        everything else (column types, callables, ...) is shared with the
+        template.
+        '''
+        prop = copy(self)
+        for key, value in self.__dict__.iteritems():
+            prop.__dict__[key] = _copy_state(value)
+        return prop
+
     def __repr__(self):
         return "Property(%s, %s)" % (self.name, self.entity)
 
 
+def _copy_state(value):
+    if isinstance(value, list):
+        return [_copy_state(v) for v in value]
+    elif isinstance(value, tuple):
+        return tuple([_copy_state(v) for v in value])
+    elif isinstance(value, dict):
+        return dict((k, _copy_state(v)) for k, v in value.iteritems())
+    elif isinstance(value, (SchemaItem, SchemaType)):
+        # schema items (ForeignKey, Sequence, ...) and schema types (Enum,
+        # Boolean, ...) get bound to the table or column they are used in.
+        return deepcopy(value)
+    elif isinstance(value, MapperProperty):
+        # SQLAlchemy properties (eg wrapped by a GenericProperty) get bound to
+        # the mapper they are added to, which can also alter their containers
+        # (eg the columns of a column_property).
+        prop = copy(value)
+        for key, attr in value.__dict__.iteritems():
+            if isinstance(attr, (list, dict)):
+                prop.__dict__[key] = copy(attr)
+        return prop
+    else:
+        return value
+
+
 class GenericProperty(Property):
     '''
     Generic catch-all class to wrap an SQLAlchemy property.
@@ -37,6 +37,22 @@ relationship is the inverse of which, so you have to disambiguate the
 situation by giving the name of the inverse relationship in the ``inverse``
 keyword argument.
 
+All relationship types also accept ``lazy='batch'``, in addition to the
+values of the ``lazy`` argument supported by SQLAlchemy. Such relationships
+are loaded lazily, but when the relationship of an instance is first
+accessed, it is loaded for all the instances loaded by queries in the same
+session which have not loaded it yet, with one query (per chunk of
+options.MAX_IN_PARAMETERS instances), instead of one query per instance:
+
+.. sourcecode:: python
+
+    class Director(Entity):
+        movies = OneToMany('Movie', lazy='batch')
+
+    for director in Director.query.all():
+        # the movies of all directors are loaded on the first iteration
+        print director.movies
+
 Here is a detailed explanation of each relation type:
 
 `ManyToOne`
@@ -190,6 +206,17 @@ relationships accept the following optional (keyword) arguments:
 |                    | boston_addresses =                                     |
 |                    | OneToMany('Address', filter=Address.city == 'Boston')  |
 +--------------------+--------------------------------------------------------+
+| ``counter_cache``  | Add an integer column to the table of this entity,     |
+|                    | holding the number of children of each row, so that   |
+|                    | it can be read without counting them. It is updated    |
+|                    | with atomic statements when children are inserted,     |
+|                    | deleted or moved to another parent through the unit of |
+|                    | work (but not by bulk operations, after which the      |
+|                    | ``recount`` class method of the entity recomputes it). |
+|                    | Either ``True``, in which case the column name is      |
+|                    | generated with options.COUNTERCACHECOL_NAMEFORMAT      |
+|                    | ("%(relname)s_count" by default), or the column name.  |
++--------------------+--------------------------------------------------------+
 
 Additionally, Elixir supports an alternate, DSL-based, syntax to define
 OneToMany_ relationships, with the has_many_ statement.
@@ -402,14 +429,20 @@ ManyToMany_ relationships.
 
 import warnings
 
-from sqlalchemy import ForeignKeyConstraint, Column, Table, and_
-from sqlalchemy.orm import relation, backref, class_mapper
+from sqlalchemy import ForeignKeyConstraint, Column, Table, Integer, and_, \
+                       select, func
+from sqlalchemy.orm import relation, backref, class_mapper, object_session, \
+                           MapperExtension, EXT_CONTINUE
+from sqlalchemy.orm.attributes import instance_state, get_history
 from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.sql.util import ClauseAdapter
 
 import options
 from elixir.statements import ClassMutator
 from elixir.properties import Property
-from elixir.entity import EntityMeta, DEBUG
+from elixir.entity import EntityMeta, DEBUG, is_setup
+from elixir.cache import CachedLazyLoader, invalidate_hierarchy
+from elixir.loading import BatchLazyLoader
 
 __doc_all__ = []
 
@@ -419,6 +452,12 @@ class Relationship(Property):
     Base class for relationships.
     '''
 
+    # Used to index relationships when looking for inverses: a relationship
+    # can only be the inverse of relationships whose kind is its inverse_kind.
+    # Subclasses leaving these to None are compared with every relationship.
+    kind = None
+    inverse_kind = None
+
     def __init__(self, of_kind, inverse=None, *args, **kwargs):
         super(Relationship, self).__init__()
 
@@ -437,6 +476,7 @@ class Relationship(Property):
     def attach(self, entity, name):
         super(Relationship, self).attach(entity, name)
         entity._descriptor.relationships.append(self)
+        entity._descriptor._inverse_index = None
 
     def create_pk_cols(self):
         self.create_keys(True)
@@ -455,6 +495,9 @@ class Relationship(Property):
             return
 
         kwargs = self.get_prop_kwargs()
+        if kwargs.get('lazy') == 'batch':
+            kwargs['lazy'] = True
+            kwargs['strategy_class'] = BatchLazyLoader
         if 'order_by' in kwargs:
             kwargs['order_by'] = \
                 self.target._descriptor.translate_order_by(kwargs['order_by'])
@@ -530,6 +573,10 @@ class Relationship(Property):
     def match_type_of(self, other):
         return False
 
+    @property
+    def inverse_index_tablename(self):
+        return None
+
     def is_inverse(self, other):
         # viewonly relationships are not symmetrical: a viewonly relationship
         # should have exactly one inverse (a ManyToOne relationship), but that
@@ -547,6 +594,8 @@ class ManyToOne(Relationship):
     '''
 
     '''
+    kind = 'manytoone'
+    inverse_kind = 'onetox'
 
     def __init__(self, of_kind,
                  column_kwargs=None,
@@ -760,6 +809,12 @@ class ManyToOne(Relationship):
         if self.primaryjoin_clauses:
             kwargs['primaryjoin'] = and_(*self.primaryjoin_clauses)
 
+        # lazy loads go through the cache of the target entity, if any
+        if isinstance(self.target, EntityMeta) and \
+           self.target._descriptor.cache is not None and \
+           self.kwargs.get('lazy', True) in (True, 'select'):
+            kwargs['strategy_class'] = CachedLazyLoader
+
         kwargs.update(self.kwargs)
 
         return kwargs
@@ -767,6 +822,8 @@ class ManyToOne(Relationship):
 
 class OneToOne(Relationship):
     uselist = False
+    kind = 'onetox'
+    inverse_kind = 'manytoone'
 
     def __init__(self, of_kind, filter=None, *args, **kwargs):
         self.filter = filter
@@ -834,9 +891,171 @@ class OneToOne(Relationship):
 class OneToMany(OneToOne):
     uselist = True
 
+    def __init__(self, of_kind, *args, **kwargs):
+        self.counter_cache = kwargs.pop('counter_cache', False)
+        super(OneToMany, self).__init__(of_kind, *args, **kwargs)
+
+    @property
+    def counter_colname(self):
+        if isinstance(self.counter_cache, basestring):
+            return self.counter_cache
+        return options.COUNTERCACHECOL_NAMEFORMAT % {'relname': self.name}
+
+    def create_non_pk_cols(self):
+        super(OneToMany, self).create_non_pk_cols()
+        if self.counter_cache:
+            self.create_counter_cache()
+
+    def create_counter_cache(self):
+        if self.filter is not None:
+            raise Exception("The '%s' relationship of the '%s' entity cannot "
+                            "have both a filter and a counter cache."
+                            % (self.name, self.entity.__name__))
+        child = self.inverse.entity
+        if is_setup(child):
+            raise Exception("Cannot add the counter cache of the '%s' "
+                            "relationship of the '%s' entity, because the "
+                            "'%s' entity is already setup."
+                            % (self.name, self.entity.__name__,
+                               child.__name__))
+        self.entity._descriptor.add_column(
+            Column(self.counter_colname, Integer, default=0, nullable=False))
+        child._descriptor.add_mapper_extension(CounterCacheExtension(self))
+
+    def update_counter(self, connection, session, values, delta):
+        '''
+        Adds `delta` to the counter cache column of the parent whose key
+        columns have the given `values`, with an atomic UPDATE statement.
+        '''
+        if None in values:
+            return
+        entity = self.entity
+        table = entity.table
+        col = table.c[self.counter_colname]
+        pairs = entity.mapper.get_property(self.name).local_remote_pairs
+        parent_values = {}
+        for (parent_col, child_col), value in zip(pairs, values):
+            parent_values[parent_col] = value
+        criterion = and_(*[parent_col == value
+                           for parent_col, value in parent_values.iteritems()])
+        connection.execute(table.update(criterion,
+                                        values={col: col + delta}))
+
+        # the parent instance in the session, if any, is not up to date
+        mapper = entity.mapper
+        if session is not None and \
+           set(parent_values.keys()) == set(mapper.primary_key):
+            key = mapper.identity_key_from_primary_key(
+                      [parent_values[col] for col in mapper.primary_key])
+            parent = session.identity_map.get(key)
+            if parent is not None:
+                state = instance_state(parent)
+                state.expire_attributes(state.dict,
+                    [mapper.get_property_by_column(col).key])
+        desc = entity._descriptor
+        if desc.cache is not None or desc.get_by_cache is not None:
+            invalidate_hierarchy(entity)
+
+    def recount(self):
+        '''
+        Recomputes the counter cache column of all the rows of the entity
+        with a single UPDATE statement, eg. after children were inserted or
+        deleted without going through the unit of work.
+        '''
+        entity = self.entity
+        prop = entity.mapper.get_property(self.name)
+        # the table of the children is aliased in case it is the same as
+        # the table of the parents
+        children = prop.target.alias()
+        criteria = [children.corresponding_column(child_col) == parent_col
+                    for parent_col, child_col in prop.local_remote_pairs]
+        criterion = prop.mapper._single_table_criterion
+        if criterion is not None:
+            criteria.append(ClauseAdapter(children).traverse(criterion))
+        count = select([func.count()], and_(*criteria),
+                       from_obj=[children]).as_scalar()
+        col = entity.table.c[self.counter_colname]
+
+        session = entity.query.session
+        session.execute(entity.table.update(values={col: count}),
+                        mapper=entity.mapper)
+        key = entity.mapper.get_property_by_column(col).key
+        for state in session.identity_map.all_states():
+            if issubclass(state.class_, entity):
+                state.expire_attributes(state.dict, [key])
+        invalidate_hierarchy(entity)
+
+
+class CounterCacheExtension(MapperExtension):
+    '''
+    Keeps the counter cache column of a OneToMany relationship up to date
+    when the children are inserted, deleted, or moved to another parent.
+    '''
+
+    def __init__(self, relationship):
+        self.relationship = relationship
+
+    def parent_values(self, mapper, connection, instance, committed=False):
+        '''
+        Returns the values of the foreign key columns of the child instance
+        (as they are in the database if `committed` is True).
+        '''
+        rel = self.relationship
+        prop = rel.entity.mapper.get_property(rel.name)
+        child_cols = [child_col for parent_col, child_col
+                                in prop.local_remote_pairs]
+        values = []
+        for child_col in child_cols:
+            key = mapper.get_property_by_column(child_col).key
+            added, unchanged, deleted = get_history(instance, key)
+            if committed and added and not deleted:
+                # the attribute was changed before its previous value was
+                # loaded
+                return self.committed_values(mapper, connection, instance,
+                                             child_cols)
+            elif committed and deleted:
+                values.append(deleted[0])
+            else:
+                values.append(getattr(instance, key))
+        return tuple(values)
+
+    def committed_values(self, mapper, connection, instance, cols):
+        criterion = and_(*[col == value for col, value in
+                           zip(mapper.primary_key,
+                               mapper.primary_key_from_instance(instance))])
+        return tuple(connection.execute(select(cols, criterion)).fetchone())
+
+    def update(self, connection, instance, values, delta):
+        self.relationship.update_counter(connection, object_session(instance),
+                                         values, delta)
+
+    def after_insert(self, mapper, connection, instance):
+        self.update(connection, instance,
+                    self.parent_values(mapper, connection, instance), 1)
+        return EXT_CONTINUE
+
+    def before_update(self, mapper, connection, instance):
+        # the counters are updated before the row of the child, so that its
+        # previous parent can still be read from the database if needed
+        old = self.parent_values(mapper, connection, instance, True)
+        new = self.parent_values(mapper, connection, instance)
+        if old != new:
+            self.update(connection, instance, old, -1)
+            self.update(connection, instance, new, 1)
+        return EXT_CONTINUE
+
+    def before_delete(self, mapper, connection, instance):
+        # the values are read before the row is deleted, in case they need
+        # to be loaded
+        self.update(connection, instance,
+                    self.parent_values(mapper, connection, instance, True), -1)
+        return EXT_CONTINUE
+
 
 class ManyToMany(Relationship):
     uselist = True
+    kind = 'manytomany'
+    inverse_kind = 'manytomany'
 
     def __init__(self, of_kind, tablename=None,
                  local_colname=None, remote_colname=None,
@@ -891,6 +1110,10 @@ class ManyToMany(Relationship):
     def match_type_of(self, other):
         return isinstance(other, ManyToMany)
 
+    @property
+    def inverse_index_tablename(self):
+        return self.user_tablename or None
+
     def create_tables(self):
         if self.table is not None:
             if 'primaryjoin' not in self.kwargs or \
@@ -919,7 +1142,11 @@ class ManyToMany(Relationship):
             assert not inverse.table_kwargs or not self.table_kwargs or \
                    inverse.table_kwargs == self.table_kwargs
 
-            self.user_tablename = inverse.user_tablename or self.user_tablename
+            if inverse.user_tablename and \
+               inverse.user_tablename != self.user_tablename:
+                self.user_tablename = inverse.user_tablename
+                # the inverse index of our entity uses the table name
+                self.entity._descriptor._inverse_index = None
             self.local_colname = inverse.remote_colname or self.local_colname
             self.remote_colname = inverse.local_colname or self.remote_colname
             self.schema = inverse.schema or self.schema
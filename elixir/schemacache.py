@@ -0,0 +1,237 @@
+'''
+On-disk cache of the resolved state of entities.
+
+During setup_all(), Elixir needs to resolve the target of every relationship
+and match each relationship with its inverse. On large models, this can take a
+noticeable amount of time at each process start. The ``SchemaCache`` class
+stores the result of that work in a file so that the next processes using the
+same model can skip it.
+
+To use it, simply pass a filename to setup_all:
+
+.. sourcecode:: python
+
+    setup_all(schema_cache='/var/cache/myapp/elixir.cache')
+
+The cache is keyed on the source code of all the modules defining entities, on
+the Elixir version and on the naming options. Whenever any of those changes,
+the cache is ignored and rewritten after the normal setup. Tables and mappers
+are always rebuilt: only the resolution results are cached.
+'''
+
+import os
+import sys
+import warnings
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+import elixir
+from elixir import options
+from elixir.entity import is_setup
+
+__doc_all__ = ['SchemaCache']
+
+# bump this whenever the format of the cached data changes
+CACHE_FORMAT_VERSION = 1
+
+
+def entity_path(cls):
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+
+class SchemaCache(object):
+    '''
+    Store and restore the resolved relationship targets and inverses of a list
+    of entities in the file named `filename`.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        # whether all the entities could be setup using the cached data
+        self.hit = False
+
+    def compute_key(self, entities):
+        '''
+        Compute the hash of everything the cached state depends on. Returns
+        None if the key cannot be computed (eg. an entity is defined in a
+        module which has no source file), in which case the cache is not used.
+        '''
+        key = md5()
+        key.update(repr((CACHE_FORMAT_VERSION, elixir.__version__,
+                         options.FKCOL_NAMEFORMAT,
+                         options.CONSTRAINT_NAMEFORMAT,
+                         options.MULTIINHERITANCECOL_NAMEFORMAT)))
+
+        modules = set()
+        for entity in entities:
+            desc = entity._descriptor
+            key.update(repr((entity_path(entity), desc.tablename,
+                             desc.inheritance, desc.resolve_root)))
+            modules.add(entity.__module__)
+
+        for modname in sorted(modules):
+            module = sys.modules.get(modname)
+            filename = getattr(module, '__file__', None)
+            if filename is None:
+                return None
+            if filename[-4:] in ('.pyc', '.pyo') and \
+               os.path.exists(filename[:-1]):
+                filename = filename[:-1]
+            try:
+                f = open(filename, 'rb')
+                try:
+                    key.update(f.read())
+                finally:
+                    f.close()
+            except IOError:
+                return None
+        return key.hexdigest()
+
+    def load(self, key):
+        try:
+            f = open(self.filename, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                data = pickle.load(f)
+            except Exception:
+                return None
+        finally:
+            f.close()
+        if not isinstance(data, dict) or data.get('key') != key:
+            return None
+        return data['entities']
+
+    def apply(self, entities):
+        '''
+        Pre-fill the relationship targets and inverses of `entities` (which
+        should not be setup yet) with the cached data, if it is still valid.
+        Returns whether the cache was used.
+        '''
+        self.hit = False
+        entities = [e for e in entities if not is_setup(e)]
+        if not entities:
+            return False
+
+        key = self.compute_key(entities)
+        if key is None:
+            return False
+        state = self.load(key)
+        if state is None:
+            return False
+
+        by_path = {}
+        for entity in entities:
+            path = entity_path(entity)
+            if path in by_path:
+                # several entities with the same path (eg. redefined in a
+                # function), we can't tell them apart.
+                return False
+            by_path[path] = entity
+
+        def lookup(path):
+            if path in by_path:
+                return by_path[path]
+            module_path, classname = path.rsplit('.', 1)
+            return getattr(sys.modules.get(module_path), classname, None)
+
+        # first pass: check everything is still valid, without modifying
+        # anything, so that we never end up with half-applied data.
+        targets = []
+        for entity in entities:
+            entry = state.get(entity_path(entity))
+            if entry is None or \
+               entry['tablename'] != entity._descriptor.tablename:
+                return False
+            for rel in entity._descriptor.relationships:
+                rel_entry = entry['relationships'].get(rel.name)
+                if rel_entry is None:
+                    return False
+                target = lookup(rel_entry['target'])
+                if target is None:
+                    return False
+                targets.append((rel, target, rel_entry['inverse']))
+
+        inverses = []
+        for rel, target, inverse_name in targets:
+            if inverse_name is None:
+                inverses.append((rel, None))
+                continue
+            if not isinstance(target, elixir.EntityMeta):
+                return False
+            inverse = target._descriptor.find_relationship(inverse_name)
+            if inverse is None:
+                return False
+            inverses.append((rel, inverse))
+
+        for rel, target, inverse_name in targets:
+            if rel._target is None:
+                rel._target = target
+        for rel, inverse in inverses:
+            rel._inverse = inverse
+
+        self.hit = True
+        return True
+
+    def save(self, entities):
+        '''
+        Write the resolved state of the (setup) `entities` to the cache file.
+        Failing to write the file only issues a warning.
+        '''
+        entities = [e for e in entities if is_setup(e)]
+        key = self.compute_key(entities)
+        if key is None:
+            return
+
+        state = {}
+        for entity in entities:
+            rels = {}
+            for rel in entity._descriptor.relationships:
+                if not hasattr(rel, '_inverse'):
+                    # this relationship was never fully resolved, so we
+                    # can't safely store this entity.
+                    rels = None
+                    break
+                inverse = rel._inverse
+                rels[rel.name] = {
+                    'target': entity_path(rel.target),
+                    'inverse': inverse and inverse.name or None
+                }
+            if rels is None:
+                continue
+            state[entity_path(entity)] = {
+                'tablename': entity._descriptor.tablename,
+                'relationships': rels
+            }
+
+        tmpname = '%s.%d.tmp' % (self.filename, os.getpid())
+        try:
+            f = open(tmpname, 'wb')
+            try:
+                pickle.dump({'key': key, 'entities': state}, f,
+                            pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            if os.path.exists(self.filename):
+                # os.rename doesn't overwrite existing files on Windows
+                os.remove(self.filename)
+            os.rename(tmpname, self.filename)
+        except (IOError, OSError), e:
+            warnings.warn("Could not write Elixir schema cache to '%s': %s"
+                          % (self.filename, e))
+
+    def update(self, entities):
+        '''
+        Rewrite the cache after a setup which didn't use it.
+        '''
+        if not self.hit:
+            self.save(entities)
@@ -0,0 +1,117 @@
+'''
+Compiled serializers used by ``Entity.to_dict``.
+
+Generating the dictionary of an instance the naive way means computing, on
+each call, the list of the column properties of the mapper, filtering it with
+the `exclude` list and looking up the remote side of each relationship of the
+`deep` specification. As these only depend on the entity and on the "shape"
+of the serialization (`deep` and `exclude`), this module generates, once per
+shape, a function doing only the attribute accesses. The functions are cached
+on the descriptor of each entity (see ``EntityDescriptor.get_serializer``)
+until the entity is cleaned up, at most `MAX_SERIALIZERS` per entity (the
+least recently used ones are discarded first).
+'''
+
+import keyword
+import re
+
+from sqlalchemy.orm import ColumnProperty
+
+__doc_all__ = []
+
+MAX_SERIALIZERS = 100
+
+_identifier = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def is_identifier(name):
+    '''
+    Tests whether `name` can be used as a Python attribute name in
+    generated code.
+    '''
+    return bool(_identifier.match(name)) and not keyword.iskeyword(name)
+
+
+def shape_key(deep, exclude):
+    '''
+    Returns a hashable key identifying the `deep` and `exclude` arguments
+    of to_dict (in which the order of the names doesn't matter).
+    '''
+    return (_freeze(deep), tuple(sorted(set(exclude))))
+
+
+def _freeze(deep):
+    if not deep:
+        return ()
+    items = [(name, _freeze(sub)) for name, sub in deep.iteritems()]
+    items.sort()
+    return tuple(items)
+
+
+def _getter(name):
+    if is_identifier(name):
+        return 'obj.%s' % name
+    return 'getattr(obj, %r)' % name
+
+
+def compile_serializer(entity, deep, exclude):
+    '''
+    Generates the function returning the dictionary of an instance of
+    `entity`, as to_dict would with the given `deep` and `exclude` arguments.
+    '''
+    mapper = entity.mapper
+    names = [p.key for p in mapper.iterate_properties
+             if isinstance(p, ColumnProperty) and p.key not in exclude]
+
+    namespace = {}
+    lines = ['def serialize(obj):',
+             '    data = {%s}' % ', '.join(['%r: %s' % (name, _getter(name))
+                                            for name in names])]
+    for num, (rname, rdeep) in enumerate(deep.iteritems()):
+        #FIXME: use attribute names (ie coltoprop) instead of column names
+        fks = mapper.get_property(rname).remote_side
+        rexclude = [c.name for c in fks]
+        nested = 'nested_%d' % num
+        namespace[nested] = nested_serializer(rdeep, rexclude)
+        lines.extend([
+            '    value = %s' % _getter(rname),
+            '    if value is None:',
+            '        data[%r] = None' % rname,
+            '    elif isinstance(value, list):',
+            '        data[%r] = [%s(o) for o in value]' % (rname, nested),
+            '    else:',
+            '        data[%r] = %s(value)' % (rname, nested)])
+    lines.append('    return data')
+
+    code = compile('\n'.join(lines) + '\n',
+                   '<serializer for %s>' % entity.__name__, 'exec')
+    exec code in namespace
+    return namespace['serialize']
+
+
+def nested_serializer(deep, exclude):
+    '''
+    Returns a function serializing related instances with the given `deep`
+    and `exclude` arguments. Related instances can be of several classes
+    (when the target of the relationship has children), so the serializer to
+    use is looked up once per class. Classes which override to_dict (or which
+    are not entities) are serialized by calling their to_dict method.
+    '''
+    from elixir.entity import EntityBase
+
+    default = EntityBase.to_dict.im_func
+    serializers = {}
+
+    def serialize(obj):
+        cls = obj.__class__
+        func = serializers.get(cls)
+        if func is None:
+            desc = getattr(cls, '_descriptor', None)
+            if desc is not None and \
+               getattr(cls.to_dict, 'im_func', None) is default:
+                func = desc.get_serializer(deep, exclude)
+            else:
+                func = lambda o: o.to_dict(deep, exclude)
+            serializers[cls] = func
+        return func(obj)
+    return serialize
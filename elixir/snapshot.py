@@ -0,0 +1,192 @@
+'''
+Snapshot and restore of the setup state of entities, for use in test suites.
+
+Tearing down all the mappers with cleanup_all() and declaring and setting up
+the whole model again between tests is slow for large models. Instead, a test
+suite can setup its model once, take a snapshot of it, and restore that
+snapshot after each test:
+
+.. sourcecode:: python
+
+    def setup_module():
+        setup_all(True)
+        global snapshot
+        snapshot = snapshot_all()
+
+    class TestSomething(object):
+        def teardown(self):
+            snapshot.restore(drop_tables=True)
+
+Restoring a snapshot removes everything which was added since it was taken:
+the entities (and their mappers and tables) declared during the test, the
+mapper properties (eg. backrefs) they added to the entities of the snapshot,
+and the children they added to polymorphic mappers. The entities which are
+part of the snapshot are not setup again. Note that the rows stored in the
+tables of those entities are not restored: use transactions (or delete them)
+to isolate the data of your tests.
+'''
+
+import sqlalchemy
+from sqlalchemy.orm import mapperlib, compile_mappers
+
+import elixir
+from elixir.entity import cleanup_entities, is_setup
+
+__doc_all__ = ['Snapshot']
+
+# the (private) parts of SQLAlchemy a snapshot saves and restores, which
+# exist in the versions of SQLAlchemy supported by Elixir
+REGISTRY_ATTRIBUTES = ('_COMPILE_MUTEX', '_mapper_registry')
+MAPPER_ATTRIBUTES = ('_props', '_init_properties', '_inheriting_mappers',
+                     'polymorphic_map')
+
+
+def check_supported(mappers):
+    '''
+    Raises an exception if the registry of mappers or one of the given
+    mappers lacks one of the attributes a snapshot needs.
+    '''
+    missing = [name for name in REGISTRY_ATTRIBUTES
+               if not hasattr(mapperlib, name)]
+    for mapper in mappers:
+        missing.extend([name for name in MAPPER_ATTRIBUTES
+                        if not hasattr(mapper, name) and name not in missing])
+    if missing:
+        raise Exception("Snapshots are not supported with SQLAlchemy %s "
+                        "(missing: %s)."
+                        % (sqlalchemy.__version__, ', '.join(missing)))
+
+
+class MapperState(object):
+    '''
+    The parts of the state of an SQLAlchemy mapper which can be modified by
+    mapping other classes after it.
+    '''
+
+    def __init__(self, mapper):
+        self.mapper = mapper
+        self.props = dict(mapper._props)
+        self.init_properties = dict(mapper._init_properties)
+        self.inheriting_mappers = mapper._inheriting_mappers.copy()
+        self.polymorphic_map = dict(mapper.polymorphic_map)
+        self.reverse_properties = {}
+        for prop in mapper._props.itervalues():
+            reverse = getattr(prop, '_reverse_property', None)
+            if reverse is not None:
+                self.reverse_properties[prop] = reverse.copy()
+
+    def restore(self):
+        mapper = self.mapper
+        for key in mapper._props.keys():
+            if key not in self.props:
+                del mapper._props[key]
+                if not mapper.non_primary:
+                    mapper.class_manager.uninstrument_attribute(key)
+        for key in mapper._init_properties.keys():
+            if key not in self.init_properties:
+                del mapper._init_properties[key]
+        mapper._inheriting_mappers = self.inheriting_mappers.copy()
+        # the polymorphic map is shared by all the mappers of a hierarchy
+        mapper.polymorphic_map.clear()
+        mapper.polymorphic_map.update(self.polymorphic_map)
+        for prop, reverse in self.reverse_properties.iteritems():
+            prop._reverse_property = reverse.copy()
+        if hasattr(mapper, '_expire_memoizations'):
+            # SA 0.6+
+            mapper._expire_memoizations()
+
+
+class Snapshot(object):
+    '''
+    The setup state of all the entities, metadatas and mappers at the time
+    the snapshot was taken. All the entities in `collection` must be setup.
+    '''
+
+    def __init__(self, collection=None):
+        if collection is None:
+            collection = elixir.entities
+        pending = [e for e in collection if not is_setup(e)]
+        if pending:
+            raise Exception("Cannot take a snapshot of entities which are not "
+                            "setup yet: %s. Call setup_all before taking a "
+                            "snapshot."
+                            % ', '.join([e.__name__ for e in pending]))
+
+        self.entities = set(collection)
+        # collections are lists, so they can't be used as dictionary keys
+        # (nor be compared with ==)
+        self.collections = [(collection, list(collection))]
+        self.children = {}
+        for entity in collection:
+            desc = entity._descriptor
+            if desc.collection is not None and \
+               not [c for c, saved in self.collections
+                    if c is desc.collection]:
+                self.collections.append((desc.collection,
+                                         list(desc.collection)))
+            self.children[entity] = desc.children[:]
+
+        self.metadatas = dict((md, set(md.tables))
+                              for md in elixir.metadatas)
+
+        # mapper properties (relationships, backrefs, inherited properties,
+        # ...) are only all configured once the mappers are compiled.
+        compile_mappers()
+        check_supported([])
+        mapperlib._COMPILE_MUTEX.acquire()
+        try:
+            mappers = list(mapperlib._mapper_registry)
+            check_supported(mappers)
+            self.mappers = [MapperState(mapper) for mapper in mappers]
+        finally:
+            mapperlib._COMPILE_MUTEX.release()
+
+    def restore(self, drop_tables=False, *args, **kwargs):
+        '''
+        Restore the entities, metadatas and mappers to the state they had
+        when the snapshot was taken. If `drop_tables` is True, the tables
+        created since then are dropped. Extra arguments are forwarded to the
+        drop_all method of the metadatas.
+        '''
+        elixir.session.close()
+
+        new_entities = []
+        for collection, saved in self.collections:
+            new_entities.extend([e for e in collection
+                                 if e not in self.entities])
+        cleanup_entities(new_entities)
+
+        mapperlib._COMPILE_MUTEX.acquire()
+        try:
+            known = set([state.mapper for state in self.mappers])
+            for mapper in list(mapperlib._mapper_registry):
+                if mapper not in known:
+                    del mapperlib._mapper_registry[mapper]
+                    mapper.dispose()
+            for state in self.mappers:
+                state.restore()
+        finally:
+            mapperlib._COMPILE_MUTEX.release()
+
+        for entity, children in self.children.iteritems():
+            entity._descriptor.children[:] = children
+
+        for md in list(elixir.metadatas):
+            known_tables = self.metadatas.get(md)
+            if known_tables is None:
+                if drop_tables:
+                    md.drop_all(*args, **kwargs)
+                md.clear()
+                elixir.metadatas.discard(md)
+                continue
+            tables = [table for key, table in md.tables.items()
+                      if key not in known_tables]
+            if tables:
+                if drop_tables:
+                    md.drop_all(tables=tables, *args, **kwargs)
+                for table in tables:
+                    md.remove(table)
+
+        for collection, saved in self.collections:
+            collection.clear()
+            collection.extend(saved)
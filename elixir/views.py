@@ -0,0 +1,139 @@
+'''
+Read-only view classes of entities.
+
+Each entity has a ``View`` class attribute, which is a class generated from
+the fields of the entity, with the same attribute names (including synonyms).
+Its instances hold the values of one row, but none of the ORM machinery of
+the instances of the entity (no instance state, no instrumented attributes,
+no identity map entry). They are built directly from the rows returned by
+the database with the ``views`` class method of the entity, which is much
+faster than loading instances, and they take less memory, thanks to
+``__slots__``. This is useful to read many rows:
+
+.. sourcecode:: python
+
+    for movie in Movie.views(Movie.query.filter_by(year=1984)):
+        print movie.title
+
+View instances are read-only, and do not give access to the relationships of
+the entity.
+'''
+
+from sqlalchemy.orm import ColumnProperty
+from sqlalchemy.orm.properties import SynonymProperty
+
+from elixir.serializer import is_identifier
+
+__doc_all__ = ['EntityView']
+
+
+class EntityView(object):
+    '''
+    Base class of the view classes of entities. The names of the fields of
+    a view class are listed in its `_fields` attribute, and the entity it was
+    generated from is its `_entity` attribute.
+    '''
+    __slots__ = ()
+
+    _fields = ()
+    _entity = None
+
+    def __init__(self, **kwargs):
+        for name in self._fields:
+            object.__setattr__(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError("'%s' is not a field of %s"
+                            % (kwargs.keys()[0], self.__class__.__name__))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("%s instances are read-only"
+                             % self.__class__.__name__)
+
+    def __delattr__(self, key):
+        raise AttributeError("%s instances are read-only"
+                             % self.__class__.__name__)
+
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ and \
+               self._values() == other._values()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__,
+                            ', '.join(['%s=%r' % (name, getattr(self, name))
+                                       for name in self._fields]))
+
+    def _values(self):
+        return tuple([getattr(self, name) for name in self._fields])
+
+
+def make_view_class(entity):
+    '''
+    Generates the view class of `entity`, which must be setup.
+    '''
+    mapper = entity.mapper
+    props = [p for p in mapper.iterate_properties
+             if isinstance(p, ColumnProperty) and is_identifier(p.key)]
+    fields = tuple([p.key for p in props])
+    namespace = {
+        '__slots__': fields,
+        '__module__': entity.__module__,
+        '_fields': fields,
+        '_entity': entity,
+        # the columns which need to be undeferred to build views
+        '_deferred': [p.key for p in props if p.deferred],
+    }
+    for prop in mapper.iterate_properties:
+        if isinstance(prop, SynonymProperty) and prop.name in fields:
+            namespace[prop.key] = property(_synonym_getter(prop.name))
+    view = type('%sView' % entity.__name__, (EntityView,), namespace)
+    view._from_row = staticmethod(_compile_from_row(view, props))
+    return view
+
+
+def _synonym_getter(name):
+    def getter(self):
+        return getattr(self, name)
+    return getter
+
+
+def _compile_from_row(view, props):
+    '''
+    Generates the function building an instance of the `view` class from a
+    row returned by the database.
+    '''
+    namespace = {'new': object.__new__, 'view': view}
+    lines = ['def from_row(row):',
+             '    obj = new(view)']
+    for num, prop in enumerate(props):
+        # the slot descriptors allow to bypass the read-only __setattr__
+        namespace['set_%d' % num] = view.__dict__[prop.key].__set__
+        namespace['col_%d' % num] = prop.columns[0]
+        lines.append('    set_%d(obj, row[col_%d])' % (num, num))
+    lines.append('    return obj')
+    code = compile('\n'.join(lines) + '\n',
+                   '<view loader for %s>' % view._entity.__name__, 'exec')
+    exec code in namespace
+    return namespace['from_row']
+
+
+class ViewAttribute(object):
+    '''
+    The "View" attribute of entities, generating their view class on first
+    access (after their setup).
+    '''
+
+    def __get__(self, instance, owner):
+        desc = owner._descriptor
+        if desc._view is None:
+            if owner.mapper is None:
+                raise AttributeError("type object '%s' has no attribute "
+                                     "'View' until it is setup"
+                                     % owner.__name__)
+            desc._view = make_view_class(owner)
+        return desc._view
@@ -0,0 +1,19 @@
+from sqlalchemy.orm import Query
+
+
+def count_queries(func, *args, **kwargs):
+    '''
+    Calls `func` with the given arguments, and returns its result along with
+    the number of queries it executed.
+    '''
+    counter = []
+    old_iter = Query.__iter__
+    def __iter__(query):
+        counter.append(query)
+        return old_iter(query)
+    Query.__iter__ = __iter__
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        Query.__iter__ = old_iter
+    return result, len(counter)
@@ -4,6 +4,9 @@ test inheritance with abstract entities
 
 import re
 
+from sqlalchemy import ForeignKey, select, func
+from sqlalchemy.orm import synonym, column_property
+
 from elixir import *
 import elixir
 
@@ -131,6 +134,80 @@ class TestAbstractInheritance(object):
         assert p1.comments[0].page == p1
         session.commit()
 
+    def test_templates_not_shared(self):
+        class Page(Entity):
+            title = Field(String(30))
+
+        class AbstractAttachment(Entity):
+            using_options(abstract=True)
+
+            page = ManyToOne('Page')
+            page_title = Field(String(30), ForeignKey('page.title'),
+                               info={'a': 1})
+
+        class Link(AbstractAttachment):
+            url = Field(String(30))
+
+        class Comment(AbstractAttachment):
+            message = Field(String(100))
+
+        setup_all(True)
+
+        template = dict(AbstractAttachment._descriptor.property_templates)
+        assert template['page_title'].entity is None
+        assert template['page_title'].column is None
+        assert template['page'].entity is None
+        assert template['page'].foreign_key == []
+
+        link_col = Link.table.c.page_title
+        comment_col = Comment.table.c.page_title
+        assert list(link_col.foreign_keys)[0] is not \
+               list(comment_col.foreign_keys)[0]
+        assert link_col.info is not comment_col.info
+        assert Link.mapper.get_property('page').mapper is Page.mapper
+        assert Comment.mapper.get_property('page').mapper is Page.mapper
+
+        p1 = Page(title="My title")
+        Link(url="My url", page=p1, page_title="My title")
+        Comment(message="My comment", page=p1)
+        session.commit()
+        session.expunge_all()
+
+        assert Link.query.one().page.title == "My title"
+        assert Comment.query.one().page.title == "My title"
+
+    def test_generic_property(self):
+        class Page(Entity):
+            title = Field(String(30))
+
+        setup_all()
+
+        class AbstractPerson(Entity):
+            using_options(abstract=True)
+
+            name = Field(String(30))
+            nickname = GenericProperty(synonym('name'))
+            count = GenericProperty(column_property(
+                        select([func.count(Page.table.c.id)]).label('count')))
+
+        class Employee(AbstractPerson):
+            pass
+
+        class Customer(AbstractPerson):
+            pass
+
+        setup_all()
+        create_all()
+
+        Employee(nickname='e1')
+        Customer(nickname='c1')
+        session.commit()
+        session.expunge_all()
+
+        assert Employee.get_by(name='e1').nickname == 'e1'
+        assert Customer.get_by(name='c1').nickname == 'c1'
+        assert Customer.get_by(name='c1').count == 0
+
     def test_multiple_inheritance(self):
         class AbstractDated(Entity):
             using_options(abstract=True)
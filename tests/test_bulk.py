@@ -0,0 +1,204 @@
+"""
+test bulk operations
+"""
+
+from datetime import datetime
+
+from elixir import *
+from elixir.events import before_bulk_update, after_bulk_update, \
+                          before_bulk_delete, after_bulk_delete
+from elixir.ext.versioned import acts_as_versioned
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestBulkInsert(object):
+    def setup(self):
+        global Person, Employee, Document, Tag
+
+        class Person(Entity):
+            name = Field(String(30))
+            _email = Field(String(30), colname='email', synonym='email')
+            status = Field(String(10), default='active')
+            using_options(version_id_col=True)
+
+        class Employee(Person):
+            salary = Field(Integer)
+
+        class Document(Entity):
+            title = Field(String(30))
+            acts_as_versioned()
+
+        class Tag(Entity):
+            name = Field(String(30), primary_key=True)
+            label = Field(String(30), default=lambda: 'no label')
+
+        setup_all(True)
+
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_dicts(self):
+        Person.bulk_insert([dict(name='p1', email='p1@x.org'),
+                            dict(name='p2', status='retired'),
+                            dict(name='p3')], batch_size=2)
+        session.commit()
+
+        people = Person.query.order_by(Person.name).all()
+        assert [(p.name, p.email, p.status, p.row_version)
+                for p in people] == [('p1', 'p1@x.org', 'active', 1),
+                                     ('p2', None, 'retired', 1),
+                                     ('p3', None, 'active', 1)]
+        # the version column works as usual
+        people[0].name = 'p1b'
+        session.commit()
+        assert people[0].row_version == 2
+
+    def test_tuples(self):
+        ids = Employee.bulk_insert([('e1', 10), ('e2', 20)],
+                                   fields=['name', 'salary'],
+                                   return_primary_keys=True)
+        session.commit()
+        session.expunge_all()
+
+        employees = Person.get_many(ids)
+        assert [(e.__class__, e.name, e.salary) for e in employees] == \
+               [(Employee, 'e1', 10), (Employee, 'e2', 20)]
+
+        try:
+            Employee.bulk_insert([('e3', 30)])
+            assert False
+        except Exception, e:
+            assert 'fields' in str(e)
+
+    def test_primary_keys(self):
+        names = Tag.bulk_insert([dict(name='a'), dict(name='b')],
+                                return_primary_keys=True)
+        assert names == ['a', 'b']
+        assert Tag.get('b').label == 'no label'
+
+    def test_versioned(self):
+        Document.bulk_insert([dict(title='d1')])
+        session.commit()
+
+        d1 = Document.get_by(title='d1')
+        assert d1.version == 1
+        assert isinstance(d1.timestamp, datetime)
+        d1.title = 'd1b'
+        session.commit()
+        assert d1.version == 2
+        assert len(d1.versions) == 2
+
+    def test_invalid_field(self):
+        try:
+            Person.bulk_insert([dict(nam='p1')])
+            assert False
+        except Exception, e:
+            assert "'nam'" in str(e)
+
+
+class TestBulkUpdateDelete(object):
+    def setup(self):
+        global Person, Employee, Manager, calls
+
+        calls = []
+
+        class Person(Entity):
+            name = Field(String(30))
+            _email = Field(String(30), colname='email', synonym='email')
+
+        class Employee(Person):
+            salary = Field(Integer)
+
+            @before_bulk_update
+            def log_before(cls, query, values):
+                calls.append(('before', cls, query.count()))
+
+            @after_bulk_update
+            @after_bulk_delete
+            def log_after(cls, query, values=None):
+                calls.append(('after', cls))
+
+        class Manager(Employee):
+            bonus = Field(Integer)
+
+        setup_all(True)
+
+        Person(name='p1')
+        Employee(name='e1', salary=10)
+        Employee(name='e2', salary=20)
+        Manager(name='m1', salary=30)
+        session.commit()
+
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_update(self):
+        p1 = Person.get_by(name='p1')
+        e1 = Employee.get_by(name='e1')
+        m1 = Manager.get_by(name='m1')
+
+        count = Employee.update_where(Employee.salary < 25,
+                                      {'salary': Employee.salary + 1,
+                                       'email': 'x@y.org'})
+        assert count == 2
+        # instances in the session are evaluated
+        assert e1.salary == 11 and e1.email == 'x@y.org'
+        assert m1.salary == 30
+        assert calls == [('before', Employee, 2), ('after', Employee)]
+
+        # the discriminator is added to the criteria
+        assert Employee.update_where(None, {'name': 'employee'}) == 3
+        assert p1.name == 'p1'
+        session.expunge_all()
+        assert [p.name for p in Person.query.order_by(Person.id)] == \
+               ['p1', 'employee', 'employee', 'employee']
+
+    def test_update_expire(self):
+        m1 = Manager.get_by(name='m1')
+        assert Manager.update_where({'name': 'm1'}, {'bonus': 5},
+                                    synchronize_session='expire',
+                                    events=False) == 1
+        assert m1.bonus == 5
+        assert calls == []
+
+    def test_delete(self):
+        e2 = Employee.get_by(name='e2')
+        assert Manager.delete_where(None) == 1
+        assert Employee.delete_where({'salary': 20}) == 1
+        assert e2 not in session
+        assert calls == [('after', Manager), ('after', Employee)]
+        session.commit()
+        assert [p.name for p in Person.query.order_by(Person.id)] == \
+               ['p1', 'e1']
+
+    def test_multi_table_inheritance(self):
+        class Vehicle(Entity):
+            name = Field(String(30))
+            using_options(inheritance='multi')
+
+        class Car(Vehicle):
+            seats = Field(Integer)
+            using_options(inheritance='multi')
+
+            @before_bulk_update
+            @before_bulk_delete
+            def log_before(cls, query, values=None):
+                calls.append(('before', cls))
+
+        setup_all(True)
+
+        for entity in (Vehicle, Car):
+            try:
+                entity.update_where(None, {'name': 'x'})
+                assert False
+            except Exception, e:
+                assert 'multi-table' in str(e)
+            try:
+                entity.delete_where(None)
+                assert False
+            except Exception, e:
+                assert 'multi-table' in str(e)
+        assert calls == []
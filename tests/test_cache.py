@@ -0,0 +1,260 @@
+"""
+test the cache option
+"""
+
+from elixir import *
+from elixir.cache import LRUCache
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestLRUCache(object):
+    def test_eviction(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+        cache.set('c', 3)
+        # b was the least recently used entry
+        assert 'b' not in cache
+        assert cache.get('b') is None
+        assert cache.get('a') == 1 and cache.get('c') == 3
+        assert len(cache) == 2
+        assert (cache.hits, cache.misses) == (3, 1)
+
+        cache.invalidate('a')
+        assert 'a' not in cache
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_ttl(self):
+        cache = LRUCache(ttl=0)
+        cache.set('a', 1)
+        assert cache.get('a') is None
+        assert len(cache) == 0
+
+
+class TestEntityCache(object):
+    def setup(self):
+        global Country, Person, Employee, City
+
+        class Country(Entity):
+            code = Field(String(2), primary_key=True)
+            name = Field(String(60))
+            using_options(cache=dict(max_size=10))
+
+        class City(Entity):
+            name = Field(String(60))
+            country = ManyToOne('Country')
+
+        class Person(Entity):
+            name = Field(String(60))
+            using_options(cache=True)
+
+        class Employee(Person):
+            salary = Field(Integer)
+
+        setup_all(True)
+
+        Country(code='be', name='Belgium')
+        Country(code='fr', name='France')
+        City(name='Brussels', country=Country.get_by(code='be'))
+        session.commit()
+        session.expunge_all()
+
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_get(self):
+        cache = Country._descriptor.cache
+        be = Country.get('be')
+        assert be.name == 'Belgium'
+        assert (cache.hits, cache.misses) == (0, 1)
+
+        # instances already in the session don't go through the cache
+        assert Country.get('be') is be
+        assert (cache.hits, cache.misses) == (0, 1)
+
+        session.expunge_all()
+        metadata.bind.execute(Country.table.update(),
+                              name='changed behind our back')
+        be = Country.get('be')
+        assert be.name == 'Belgium'
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert be in session
+
+        # the instance can be used normally
+        be.name = 'Belgique'
+        session.commit()
+        session.expunge_all()
+        assert Country.get('be').name == 'Belgique'
+        assert Country.get('xx') is None
+
+    def test_other_session(self):
+        fr = Country.get('fr')
+        session.remove()
+
+        # each session gets its own instance
+        fr2 = Country.get('fr')
+        assert fr2 is not fr and fr2.name == 'France'
+        assert Country._descriptor.cache.hits == 1
+        assert fr not in session
+
+    def test_invalidation(self):
+        cache = Country._descriptor.cache
+        be = Country.get('be')
+        assert len(cache) == 1
+        be.name = 'Belgique'
+        session.commit()
+        assert len(cache) == 0
+
+        Country.get('fr').delete()
+        session.commit()
+        session.expunge_all()
+        assert Country.get('fr') is None
+        assert Country.get('be').name == 'Belgique'
+
+    def test_rollback(self):
+        be = Country.get('be')
+        be.name = 'Belgique'
+        session.flush()
+        # the row is cached with its uncommitted value
+        session.expunge(be)
+        assert Country.get('be').name == 'Belgique'
+        assert len(Country._descriptor.cache) == 1
+
+        session.rollback()
+        assert len(Country._descriptor.cache) == 0
+        session.expunge_all()
+        assert Country.get('be').name == 'Belgium'
+
+    def test_manytoone(self):
+        cache = Country._descriptor.cache
+        Country.get('be')
+        session.expunge_all()
+
+        city = City.get_by(name='Brussels')
+        assert city.country.name == 'Belgium'
+        assert cache.hits == 1
+
+    def test_inheritance(self):
+        cache = Person._descriptor.cache
+        Employee(name='e1', salary=10)
+        session.commit()
+        session.expunge_all()
+
+        e1 = Person.get(1)
+        assert isinstance(e1, Employee)
+        session.expunge_all()
+        e1 = Person.get(1)
+        assert isinstance(e1, Employee) and e1.salary == 10
+        assert cache.hits == 1
+
+        # updates of the children invalidate the cache of the parent
+        e1.salary = 20
+        session.commit()
+        assert len(cache) == 0
+        session.expunge_all()
+        assert Person.get(1).salary == 20
+
+
+class TestGetByCache(object):
+    def setup(self):
+        global User, Admin, Group
+
+        class Group(Entity):
+            name = Field(String(30))
+
+        class User(Entity):
+            name = Field(String(30))
+            group = ManyToOne('Group')
+            using_options(get_by_cache=dict(max_size=10))
+
+        class Admin(User):
+            level = Field(Integer)
+
+        setup_all(True)
+
+        User(name='bob', group=Group(name='staff'))
+        session.commit()
+        session.expunge_all()
+
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_get_by(self):
+        cache = User._descriptor.get_by_cache
+        bob = User.get_by(name='bob')
+        assert User.get_by(name='bob') is bob
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        session.expunge_all()
+        bob = User.get_by(name='bob')
+        assert bob.name == 'bob'
+        assert cache.hits == 2
+
+        # hits are served from the cache, without any query
+        session.expunge_all()
+        metadata.bind.execute(User.table.update(), name='robert')
+        bob = User.get_by(name='bob')
+        assert bob.name == 'bob'
+        assert bob in session
+
+        # cached results which don't match anymore are looked up again
+        bob.name = 'robert'
+        session.flush()
+        assert User.get_by(name='bob') is None
+        assert User.get_by(name='robert') is bob
+
+    def test_rollback(self):
+        bob = User.get_by(name='bob')
+        bob.name = 'robert'
+        session.flush()
+        assert User.get_by(name='robert') is bob
+        session.rollback()
+
+        assert User.get_by(name='robert') is None
+        assert User.get_by(name='bob').name == 'bob'
+
+    def test_invalidation(self):
+        # misses are not cached
+        assert User.get_by(name='alice') is None
+        assert User.get_by(name='alice') is None
+        assert len(User._descriptor.get_by_cache) == 0
+
+        # pending instances are taken into account
+        alice = User(name='alice')
+        assert User.get_by(name='alice') is alice
+        session.commit()
+
+        alice.name = 'alicia'
+        session.commit()
+        assert User.get_by(name='alice') is None
+
+        alice.delete()
+        session.commit()
+        assert User.get_by(name='alicia') is None
+
+    def test_inheritance(self):
+        assert User.get_by(name='root') is None
+        assert Admin.get_by(name='root') is None
+
+        # children invalidate their parent
+        root = Admin(name='root', level=1)
+        session.commit()
+        assert User.get_by(name='root') is root
+        assert Admin.get_by(name='root') is root
+
+    def test_instance_criteria(self):
+        staff = Group.get_by(name='staff')
+        bob = User.get_by(group=staff)
+        session.expunge_all()
+
+        staff = Group.get_by(name='staff')
+        assert User.get_by(group=staff).name == 'bob'
+        assert User._descriptor.get_by_cache.hits == 1
+
+        # pending instances are flushed before being used as criteria
+        assert User.get_by(group=Group(name='new')) is None
@@ -26,3 +26,71 @@ class TestOldMethods(object):
 
         assert A.get(1).name == "a1"
 
+    def test_get_many(self):
+        class A(Entity):
+            name = Field(String(32))
+
+        class B(Entity):
+            key1 = Field(Integer, primary_key=True)
+            key2 = Field(String(10), primary_key=True)
+
+        setup_all(True)
+
+        for i in range(1, 11):
+            A(name="a%d" % i)
+            B(key1=i, key2="k%d" % i)
+        session.commit()
+        session.expunge_all()
+
+        a3 = A.get(3)
+        result = A.get_many([5, 3, 42, None, 1, 5], chunk_size=2)
+        assert [a and a.name for a in result] == \
+               ['a5', 'a3', None, None, 'a1', 'a5']
+        # taken from the identity map
+        assert result[1] is a3
+        assert result[0] is result[5]
+
+        result = B.get_many([(2, 'k2'), (2, 'k3'), [10, 'k10']])
+        assert [b and b.key1 for b in result] == [2, None, 10]
+
+        # string identifiers are converted for integer columns only
+        result = A.get_many(['3', u'5', 'x'])
+        assert [a and a.name for a in result] == ['a3', 'a5', None]
+        result = B.get_many([('2', 'k2'), (3, 3)])
+        assert [b and b.key1 for b in result] == [2, None]
+
+        assert A.get_many([]) == []
+        assert len(A.get_many(range(2000))) == 2000
+
+    def test_values(self):
+        class A(Entity):
+            name = Field(String(32))
+            _code = Field(String(10), colname='code_col', synonym='code')
+            b = ManyToOne('B')
+
+        class B(A):
+            rank = Field(Integer)
+
+        setup_all(True)
+
+        A(name='a1', code='x')
+        B(name='b1', code='y', rank=1)
+        B(name='b2', code='z', rank=2)
+        session.commit()
+        session.expunge_all()
+
+        rows = A.values('name', 'code').order_by(A.name).all()
+        assert rows == [('a1', 'x'), ('b1', 'y'), ('b2', 'z')]
+        assert rows[0].code == 'x'
+        # no instance was loaded
+        assert len(session.identity_map) == 0
+
+        rows = B.values('id', '_code').filter(B.rank > 1).all()
+        assert [(row.id, row._code) for row in rows] == [(3, 'z')]
+        assert B.values().order_by(B.id).first().rank == 1
+
+        try:
+            A.values('b')
+            assert False
+        except Exception, e:
+            assert "'b'" in str(e)
@@ -89,4 +89,38 @@ class TestCollections(object):
         # added back by setup_entities (maybe we should?)
         metadata.clear()
 
+    def test_lookups(self):
+        class Person(Entity):
+            name = Field(String(30))
+            using_options(tablename='person')
 
+        class Employee(Person):
+            salary = Field(Integer)
+
+        class Account(Entity):
+            name = Field(String(30))
+            using_options(tablename='account', identity='acc',
+                          inheritance='multi')
+            using_table_options(schema='main')
+
+        entities = elixir.entities
+        assert entities.resolve('%s.Person' % __name__) is Person
+        assert entities.get_by_tablename('person') is Person
+        assert entities.get_by_tablename('account') is Account
+        assert entities.get_by_tablename('main.account') is Account
+        assert entities.get_by_tablename('other') is None
+        assert entities.get_by_identity('employee') is Employee
+        assert entities.get_by_identity('acc') is Account
+        assert entities.get_by_identity('account') is None
+
+        class Account(Entity):
+            using_options(tablename='account')
+
+        try:
+            entities.get_by_tablename('account')
+            assert False
+        except Exception, e:
+            assert 'Several entities' in str(e)
+
+        entities.clear()
+        assert entities.get_by_tablename('person') is None
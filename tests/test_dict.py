@@ -3,6 +3,8 @@
 """
 
 from elixir import *
+from elixir.serializer import MAX_SERIALIZERS
+from tests import count_queries
 
 def setup():
     metadata.bind = 'sqlite://'
@@ -154,6 +156,130 @@ class TestDeepSet(object):
                          'tbl3': {'t3id': 1,
                                   'name': 'test3'}}}
 
+    def test_to_serializer_cache(self):
+        desc = Table1._descriptor
+        desc._serializers.clear()
+        t1 = Table1(t1id=54, name='test1')
+        t1.tbl2s.append(Table2(t2id=51, name='test2'))
+        deep = {'tbl2s': {}, 'tbl3': {}}
+        expected = {'t1id': 54, 'name': 'test1',
+                    'tbl2s': [{'t2id': 51, 'name': 'test2'}],
+                    'tbl3': None}
+        assert t1.to_dict(deep) == expected
+        assert t1.to_dict({'tbl3': {}, 'tbl2s': {}}) == expected
+        assert t1.to_dict(exclude=['name']) == {'t1id': 54}
+        assert t1.to_dict(exclude=['name', 'name']) == {'t1id': 54}
+        # the serializer is compiled once per shape
+        assert len(desc._serializers) == 2
+        assert desc.get_serializer(deep) is desc.get_serializer(deep)
+        assert desc.get_serializer(exclude=['t1id', 'name']) is \
+               desc.get_serializer(exclude=['name', 't1id'])
+
+        # the number of cached serializers is bounded
+        for i in range(MAX_SERIALIZERS + 10):
+            t1.to_dict(exclude=['name', 'other%d' % i])
+        assert len(desc._serializers) == MAX_SERIALIZERS
+
+class TestDeepToDicts(object):
+    def setup(self):
+        create_all()
+        for i in range(1, 4):
+            t1 = Table1(t1id=i, name='t1_%d' % i,
+                        tbl3=Table3(t3id=i, name='t3_%d' % i))
+            for j in range(3):
+                Table2(t2id=i * 10 + j, name='t2_%d_%d' % (i, j), tbl1=t1)
+        Table2(t2id=99, name='orphan')
+        session.commit()
+        session.expunge_all()
+
+    def teardown(self):
+        session.close()
+        drop_all()
+
+    def test_same_as_to_dict(self):
+        deep = {'tbl2s': {'tbl1': {'tbl3': {}}}, 'tbl3': {}}
+        query = Table1.query.order_by(Table1.t1id)
+        expected = [t1.to_dict(deep) for t1 in query]
+        session.expunge_all()
+
+        result, queries = count_queries(Table1.to_dicts, query, deep)
+        assert result == expected
+        # one query for the entities and one per relationship (tbl2s and
+        # tbl3, while the tbl1 instances are found in the session and their
+        # tbl3 relationship is already loaded)
+        assert queries == 3
+
+    def test_m2o_none(self):
+        t2s = Table2.query.order_by(Table2.t2id).all()
+        deep = {'tbl1': {}}
+        result, queries = count_queries(Table2.to_dicts, t2s, deep)
+        assert result == [t2.to_dict(deep) for t2 in t2s]
+        assert result[-1]['tbl1'] is None
+        assert queries == 1
+
+    def test_exclude(self):
+        result = Table2.to_dicts(Table2.query.filter_by(t2id=10),
+                                 exclude=['name'])
+        assert result == [{'t2id': 10, 'tbl1_t1id': 1}]
+
+
+class TestFromDictPrefetch(object):
+    def setup(self):
+        create_all()
+        t1 = Table1(t1id=1, name='t1', tbl3=Table3(t3id=1, name='t3'))
+        for i in range(5):
+            Table2(t2id=i, name='t2_%d' % i, tbl1=t1)
+        session.commit()
+        session.expunge_all()
+
+    def teardown(self):
+        session.close()
+        drop_all()
+
+    def test_update_or_create(self):
+        data = {'t1id': 1, 'name': 'changed',
+                'tbl2s': [{'t2id': i, 'name': 'new_%d' % i}
+                          for i in range(5)],
+                'tbl3': {'t3id': 1, 'tbl1': {'t1id': 1}}}
+        t1, queries = count_queries(Table1.update_or_create, data,
+                                    prefetch=True)
+        # one query per entity, plus the loads of the tbl2s and tbl3 values
+        # being replaced (instead of one query per record)
+        assert queries == 5
+        session.commit()
+        session.expunge_all()
+
+        t1 = Table1.get(1)
+        assert t1.name == 'changed'
+        assert sorted([t2.name for t2 in t1.tbl2s]) == \
+               ['new_%d' % i for i in range(5)]
+        assert t1.tbl3.t3id == 1
+
+    def test_surrogate(self):
+        t1 = Table1.get(1)
+        t1.from_dict({'tbl2s': [{'t2id': 0}, {'name': 'created'}]},
+                     prefetch=True)
+        assert [t2.name for t2 in t1.tbl2s] == ['t2_0', 'created']
+        try:
+            t1.from_dict({'tbl2s': [{'t2id': 99}]}, prefetch=True)
+            assert False
+        except Exception, e:
+            assert 'surrogate' in str(e)
+
+        t2 = Table2.update_or_create({'t2id': 99, 'name': 'new'},
+                                     surrogate=False, prefetch=True)
+        assert t2.name == 'new'
+
+    def test_string_keys(self):
+        t1 = Table1.get(1)
+        t2 = Table2.get(1)
+        # as without prefetch, the existing record is updated
+        t1.from_dict({'tbl2s': [{'t2id': '1', 'name': 'from_json'}]},
+                     prefetch=True)
+        assert t1.tbl2s == [t2]
+        assert t2.name == 'from_json'
+
+
 class TestSetOnAliasedColumn(object):
     def setup(self):
         metadata.bind = 'sqlite://'
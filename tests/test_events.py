@@ -1,5 +1,6 @@
 from elixir import *
 from elixir.events import *
+from elixir.entity import getcallbacks
 
 from sqlalchemy import Table, Column
 
@@ -126,6 +127,39 @@ class TestEvents(object):
 
         assert a.update_count == 1
 
+    def test_inherited_callbacks(self):
+        class AddEventMethods(object):
+            @before_insert
+            def mixin_insert(self):
+                pass
+
+        class A(Entity, AddEventMethods):
+            name = Field(String(50))
+
+            @before_insert
+            def parent_insert(self):
+                pass
+
+            @before_insert
+            def overridden_insert(self):
+                pass
+
+        class B(A):
+            def overridden_insert(self):
+                pass
+
+        def late_insert(self):
+            pass
+        A.late_insert = before_insert(late_insert)
+
+        def names(entity):
+            return [name for name, method
+                    in getcallbacks(entity, '_elixir_events')]
+
+        assert names(A) == ['late_insert', 'mixin_insert',
+                            'overridden_insert', 'parent_insert']
+        assert names(B) == ['late_insert', 'mixin_insert', 'parent_insert']
+
     def test_entity_wh_bad_descriptors(self):
         class BrokenDescriptor(object):
             def __get__(*args):
@@ -0,0 +1,118 @@
+"""
+test the dependency graph of entities
+"""
+
+import warnings
+
+from sqlalchemy import ForeignKey, Table, Column
+
+from elixir import *
+from elixir.graph import EntityGraph
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestEntityGraph(object):
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_order(self):
+        class Review(Entity):
+            movie = ManyToOne('Movie')
+            author_name = Field(String(30), ForeignKey('person.name'))
+
+        class Movie(Entity):
+            director = ManyToOne('Director')
+            reviews = OneToMany('Review')
+
+        class Person(Entity):
+            name = Field(String(30), unique=True)
+            using_options(tablename='person', inheritance='multi')
+
+        class Director(Person):
+            using_options(inheritance='multi')
+
+        class Tag(Entity):
+            name = Field(String(30))
+
+        graph = EntityGraph(entities)
+        order = graph.order()
+        assert order.index(Person) < order.index(Director) < \
+               order.index(Movie) < order.index(Review)
+        assert graph.batches() == [[Person, Tag], [Director], [Movie],
+                                   [Review]]
+        assert graph.dependents(Person) == [Review, Director]
+        assert graph.related(Movie) == [Review, Person, Director]
+        assert graph.components() == [[Review, Movie, Person, Director],
+                                      [Tag]]
+        assert graph.cycles() == []
+
+        setup_all(True)
+
+    def test_cycles(self):
+        class A(Entity):
+            b = ManyToOne('B')
+            parent = ManyToOne('A')
+
+        class B(Entity):
+            a = ManyToOne('A')
+
+        graph = EntityGraph(entities)
+        assert [[(d.entity, d.label) for d in c] for c in graph.cycles()] == \
+               [[(A, 'b'), (B, 'a')]]
+        # cycles don't prevent the setup
+        assert len(graph.order()) == 2
+
+        warnings.filterwarnings('error', 'Circular foreign key')
+        try:
+            try:
+                setup_all()
+                assert False
+            except UserWarning, e:
+                assert 'A.b, B.a' in str(e)
+        finally:
+            del warnings.filters[0]
+
+        # the tables can't be dropped by the teardown either
+        cleanup_all()
+
+    def test_use_alter(self):
+        class A(Entity):
+            b = ManyToOne('B', use_alter=True)
+
+        class B(Entity):
+            a = ManyToOne('A')
+
+        assert EntityGraph(entities).cycles() == []
+        setup_all(True)
+
+    def test_table_batches(self):
+        class A(Entity):
+            name = Field(String(30))
+
+        class B(Entity):
+            a = ManyToOne('A')
+            cs = ManyToMany('C')
+
+        class C(Entity):
+            name = Field(String(30))
+
+        class D(Entity):
+            name = Field(String(30))
+            using_options(tablename='d')
+
+        extra = Table('extra', metadata,
+                      Column('d_id', Integer, ForeignKey('d.id')))
+
+        setup_all(True)
+
+        graph = EntityGraph(entities)
+        batches = graph.table_batches(metadata)
+        names = [set([t.name for t in batch]) for batch in batches]
+        assert names == [set([A.table.name, B.table.name, C.table.name,
+                              B.cs.property.secondary.name]),
+                         set(['d', 'extra'])]
+
+        # tables are dropped in reverse order by the teardown
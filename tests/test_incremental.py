@@ -0,0 +1,123 @@
+"""
+test setting up entities declared after the others were setup
+"""
+
+from sqlalchemy import Table, Column
+
+from elixir import *
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestIncrementalSetup(object):
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_relationships_to_setup_entities(self):
+        class A(Entity):
+            name = Field(String(60))
+
+        setup_all(True)
+        a_mapper = A.mapper
+        A(name='a1')
+        session.commit()
+
+        # a table which is not part of any entity
+        Table('not_an_entity', metadata, Column('id', Integer))
+
+        class B(Entity):
+            name = Field(String(60))
+            a = ManyToOne('A', backref='bs')
+            tags = ManyToMany('A', tablename='b_tags')
+
+        setup_all(True)
+
+        assert A.mapper is a_mapper
+        assert B.table.exists()
+        assert metadata.tables['b_tags'].exists()
+        assert not metadata.tables['not_an_entity'].exists()
+
+        a1 = A.query.one()
+        B(name='b1', a=a1, tags=[a1])
+        session.commit()
+        session.expunge_all()
+
+        a1 = A.query.one()
+        assert a1.bs[0].name == 'b1'
+        assert B.query.one().tags == [a1]
+
+    def test_multi_inheritance_child(self):
+        class Person(Entity):
+            name = Field(String(60))
+            using_options(inheritance='multi')
+
+        class Employee(Person):
+            salary = Field(Integer)
+            using_options(inheritance='multi')
+
+        setup_all(True)
+
+        class Manager(Employee):
+            bonus = Field(Integer)
+            using_options(inheritance='multi')
+
+        setup_all(True)
+
+        Manager(name='m1', salary=10, bonus=5)
+        Employee(name='e1', salary=8)
+        session.commit()
+        session.expunge_all()
+
+        people = Person.query.order_by(Person.name).all()
+        assert [p.__class__ for p in people] == [Employee, Manager]
+        assert people[1].bonus == 5
+
+    def test_single_inheritance_child(self):
+        class Person(Entity):
+            name = Field(String(60))
+
+        class Employee(Person):
+            salary = Field(Integer)
+
+        setup_all(True)
+
+        class Intern(Employee):
+            pass
+
+        setup_all(True)
+
+        assert Intern.mapper.inherits is Employee.mapper
+        Intern(name='i1', salary=1)
+        session.commit()
+        session.expunge_all()
+
+        assert Person.query.one().__class__ is Intern
+
+        # the table of the parent cannot be altered anymore
+        class Manager(Employee):
+            bonus = Field(Integer)
+
+        try:
+            setup_all(True)
+            assert False
+        except Exception, e:
+            assert 'Manager' in str(e)
+
+    def test_child_of_parent_without_children(self):
+        class Person(Entity):
+            name = Field(String(60))
+            using_options(inheritance='multi')
+
+        setup_all(True)
+
+        class Employee(Person):
+            salary = Field(Integer)
+            using_options(inheritance='multi')
+
+        try:
+            setup_all(True)
+            assert False
+        except Exception, e:
+            assert 'polymorphic' in str(e)
@@ -0,0 +1,185 @@
+"""
+test keyset iteration and pagination
+"""
+
+import gc
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy.dialects import postgresql
+
+from elixir.keyset import encode_cursor, decode_cursor, order_clauses
+
+from elixir import *
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestIterAll(object):
+    def setup(self):
+        global Movie
+
+        class Movie(Entity):
+            title = Field(String(30))
+            year = Field(Integer)
+            using_options(order_by=['-year', 'title'])
+
+        setup_all(True)
+
+        Movie.bulk_insert([dict(title='m%02d' % i, year=2000 + i % 4)
+                           for i in range(50)])
+        session.commit()
+
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_order(self):
+        expected = [(m.year, m.title) for m in Movie.query.all()]
+        session.expunge_all()
+
+        movies = [(m.year, m.title) for m in Movie.iter_all(batch_size=7)]
+        assert movies == expected
+        assert len(session.identity_map) == 0
+
+        ids = [m.id for m in Movie.iter_all(batch_size=10, order_by='-id')]
+        assert ids == range(50, 0, -1)
+
+    def test_query(self):
+        query = Movie.query.filter_by(year=2001)
+        titles = [m.title for m in Movie.iter_all(batch_size=5, query=query,
+                                                  stream_results=True)]
+        assert titles == ['m%02d' % i for i in range(1, 50, 4)]
+
+    def test_changes_flushed(self):
+        for movie in Movie.iter_all(batch_size=10):
+            movie.year = 1999
+        session.commit()
+        assert Movie.query.filter_by(year=1999).count() == 50
+
+        # including those of the last batch, when it is not full
+        for movie in Movie.iter_all(batch_size=7):
+            movie.year = 2000
+        session.commit()
+        assert Movie.query.filter_by(year=2000).count() == 50
+
+    def test_flat_memory(self):
+        Movie.bulk_insert([dict(title='x%05d' % i, year=i % 100)
+                           for i in range(20000)])
+        session.commit()
+
+        gc.collect()
+        counts = [len(gc.get_objects())]
+        for num, movie in enumerate(Movie.iter_all(batch_size=500)):
+            if num % 2000 == 1999:
+                # at most two batches are in the session at any point
+                assert len(session.identity_map) <= 1000
+                gc.collect()
+                counts.append(len(gc.get_objects()))
+        # the number of live objects only depends on the size of the
+        # batches (each instance taking more than 10 objects)
+        assert max(counts) - counts[0] < 20000
+        assert max(counts[1:]) - min(counts[1:]) < 1000
+
+
+class TestPaginate(object):
+    def setup(self):
+        global Movie
+
+        class Movie(Entity):
+            title = Field(Unicode(30))
+            release = Field(Date)
+            using_options(order_by=['-release', 'title'])
+
+        setup_all(True)
+
+        for i in range(25):
+            Movie(title=u'm%02d' % i, release=date(2000 + i % 3, 1, 1))
+        session.commit()
+
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_pages(self):
+        expected = [m.id for m in Movie.query.all()]
+        result = []
+        movies, cursor = Movie.paginate(limit=10)
+        result.extend([m.id for m in movies])
+        while cursor is not None:
+            movies, cursor = Movie.paginate(after=cursor, limit=10)
+            result.extend([m.id for m in movies])
+            assert len(movies) == 10 or cursor is None
+        assert result == expected
+
+    def test_order_by(self):
+        movies, cursor = Movie.paginate(limit=5, order_by='-id')
+        movies, cursor = Movie.paginate(after=cursor, limit=5,
+                                        order_by='-id')
+        assert [m.id for m in movies] == range(20, 15, -1)
+
+        query = Movie.query.filter(Movie.title < u'm05')
+        movies, cursor = Movie.paginate(limit=3, order_by='title',
+                                        query=query)
+        movies, cursor = Movie.paginate(after=cursor, limit=3,
+                                        order_by='title', query=query)
+        assert [m.title for m in movies] == [u'm03', u'm04']
+        assert cursor is None
+
+    def test_nulls(self):
+        for i in range(5):
+            Movie(title=u'n%02d' % i)
+        Movie(title=None, release=date(2001, 1, 1))
+        session.commit()
+
+        def all_pages(order_by):
+            result = []
+            movies, cursor = Movie.paginate(limit=4, order_by=order_by)
+            result.extend(movies)
+            while cursor is not None:
+                movies, cursor = Movie.paginate(after=cursor, limit=4,
+                                                order_by=order_by)
+                result.extend(movies)
+            return result
+
+        for order_by in (None, 'title', ['release', '-title']):
+            ids = [m.id for m in all_pages(order_by)]
+            assert sorted(ids) == range(1, 32)
+
+        # NULL values come last in ascending order, first in descending order
+        movies = all_pages('release')
+        assert [m.release for m in movies[-5:]] == [None] * 5
+        movies = all_pages('-release')
+        assert [m.release for m in movies[:5]] == [None] * 5
+
+    def test_nulls_order(self):
+        order = [(Movie.table.c.release, True), (Movie.table.c.id, False)]
+        sqlite = metadata.bind.dialect
+        assert len(order_clauses(order, sqlite)) == 3
+        # NULL values already sort last on PostgreSQL
+        assert len(order_clauses(order, postgresql.dialect())) == 2
+
+    def test_invalid_limit(self):
+        try:
+            Movie.paginate(limit=0)
+            assert False
+        except ValueError, e:
+            assert 'at least 1' in str(e)
+
+    def test_cursors(self):
+        values = (u'\xe9t\xe9,:', 'a', 3, 2.5, True, date(2010, 5, 1), None,
+                  Decimal('1.50'))
+        cursor = encode_cursor(values)
+        assert decode_cursor(cursor, 8) == values
+        try:
+            encode_cursor([object()])
+            assert False
+        except Exception, e:
+            assert 'object' in str(e)
+
+        for invalid in ('garbage', cursor):
+            try:
+                Movie.paginate(after=invalid)
+                assert False
+            except Exception, e:
+                assert 'Invalid cursor' in str(e)
@@ -0,0 +1,151 @@
+"""
+test lazy setup of entities
+"""
+
+import threading
+
+from sqlalchemy.orm import Mapper
+from elixir import *
+from elixir.properties import Property
+
+
+class TestLazySetup(object):
+    def setup(self):
+        metadata.bind = 'sqlite://'
+
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_setup_on_query(self):
+        class A(Entity):
+            name = Field(String(60))
+            bs = OneToMany('B')
+
+        class B(Entity):
+            name = Field(String(60))
+            a = ManyToOne('A')
+
+        class C(Entity):
+            name = Field(String(60))
+
+        setup_all(lazy=True)
+
+        assert not hasattr(A, '_setup_done')
+        assert not hasattr(C, '_setup_done')
+
+        query = B.query
+
+        assert hasattr(A, '_setup_done')
+        assert hasattr(B, '_setup_done')
+        assert not hasattr(C, '_setup_done')
+
+        create_all()
+        A(name='a1', bs=[B(name='b1')])
+        session.commit()
+        session.expunge_all()
+
+        assert B.query.one().a.name == 'a1'
+
+    def test_setup_on_instantiation_and_table(self):
+        class A(Entity):
+            name = Field(String(60))
+
+        class Parent(Entity):
+            name = Field(String(60))
+
+        class Child(Parent):
+            age = Field(Integer)
+
+        setup_all(lazy=True)
+
+        assert 'age' in Child.table.columns
+        assert hasattr(Parent, '_setup_done')
+        assert not hasattr(A, '_setup_done')
+
+        a = A(name='a1')
+        assert hasattr(A, '_setup_done')
+        create_all()
+        session.commit()
+        session.expunge_all()
+
+        assert A.query.one().name == 'a1'
+
+    def test_publish_after_setup(self):
+        published = []
+        class CheckPublished(Property):
+            def finalize(self):
+                published.append(isinstance(B.__dict__['mapper'], Mapper))
+
+        class A(Entity):
+            name = Field(String(60))
+            bs = OneToMany('B')
+            check = CheckPublished()
+
+        class B(Entity):
+            name = Field(String(60))
+            a = ManyToOne('A')
+
+        setup_all(lazy=True)
+
+        # the mapper is usable from within the setup, but not published
+        assert A.mapper is not None
+        assert published == [False]
+        assert isinstance(B.__dict__['mapper'], Mapper)
+
+    def test_failed_setup(self):
+        class Broken(Property):
+            def finalize(self):
+                raise Exception('Broken property')
+
+        class A(Entity):
+            name = Field(String(60))
+            broken = Broken()
+
+        setup_all(lazy=True)
+
+        for i in range(2):
+            try:
+                A.mapper
+                assert False
+            except Exception, e:
+                assert 'Broken' in str(e)
+
+    def test_cannot_create_tables(self):
+        class A(Entity):
+            name = Field(String(60))
+
+        try:
+            setup_all(True, lazy=True)
+            assert False
+        except Exception, e:
+            assert 'setup lazily' in str(e)
+
+    def test_concurrent_setup(self):
+        class A(Entity):
+            name = Field(String(60))
+            bs = OneToMany('B')
+
+        class B(Entity):
+            name = Field(String(60))
+            a = ManyToOne('A')
+
+        setup_all(lazy=True)
+
+        mappers = []
+        errors = []
+        def first_use(entity):
+            try:
+                mappers.append(entity.mapper)
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=first_use, args=(entity,))
+                   for entity in (A, B) * 5]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not errors
+        assert len(mappers) == 10
+        assert set(mappers) == set([A.mapper, B.mapper])
@@ -0,0 +1,167 @@
+"""
+test batch loading of relationships
+"""
+
+from elixir import *
+from elixir import loading
+from tests import count_queries
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestBatchLazy(object):
+    def setup(self):
+        global Director, Movie, Actor
+
+        class Director(Entity):
+            name = Field(String(30))
+            movies = OneToMany('Movie', lazy='batch', order_by='title')
+
+        class Movie(Entity):
+            title = Field(String(30))
+            director = ManyToOne('Director', lazy='batch')
+            actors = ManyToMany('Actor', lazy='batch')
+
+        class Actor(Entity):
+            name = Field(String(30))
+            movies = ManyToMany('Movie')
+
+        setup_all(True)
+
+        actors = [Actor(name='a%d' % i) for i in range(3)]
+        for i in range(4):
+            director = Director(name='d%d' % i)
+            for j in range(3):
+                Movie(title='m%d%d' % (i, 2 - j), director=director,
+                      actors=actors[j:])
+        Director(name='nomovie')
+        session.commit()
+        session.expunge_all()
+
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_onetomany(self):
+        directors = Director.query.order_by(Director.name).all()
+
+        def titles():
+            return [[m.title for m in d.movies] for d in directors]
+        result, queries = count_queries(titles)
+        assert queries == 1
+        assert result[0] == ['m00', 'm01', 'm02']
+        assert result[-1] == []
+
+        # already loaded
+        result, queries = count_queries(titles)
+        assert queries == 0
+
+    def test_manytoone_manytomany(self):
+        movies = Movie.query.all()
+
+        def names():
+            return [(m.director.name, len(m.actors)) for m in movies]
+        result, queries = count_queries(names)
+        # the directors are loaded at once, as well as the actors
+        assert queries == 2
+        assert sorted(result)[:3] == [('d0', 1), ('d0', 2), ('d0', 3)]
+
+    def test_modified_instances(self):
+        d0, d1 = Director.query.order_by(Director.name).limit(2).all()
+        d1.movies.append(Movie(title='new'))
+        assert len(d0.movies) == 3
+        assert [m.title for m in d1.movies][-1] == 'new'
+        session.commit()
+        session.expunge_all()
+        assert len(Director.get_by(name='d1').movies) == 4
+
+
+class TestPrefetch(object):
+    def setup(self):
+        global Director, Movie, Actor
+
+        class Director(Entity):
+            name = Field(String(30))
+            movies = OneToMany('Movie', order_by='title')
+
+        class Movie(Entity):
+            title = Field(String(30))
+            director = ManyToOne('Director')
+            actors = ManyToMany('Actor')
+
+        class Actor(Entity):
+            name = Field(String(30))
+            movies = ManyToMany('Movie')
+
+        setup_all(True)
+
+        actors = [Actor(name='a%d' % i) for i in range(3)]
+        for i in range(4):
+            director = Director(name='d%d' % i)
+            for j in range(3):
+                Movie(title='m%d%d' % (i, j), director=director,
+                      actors=actors[j:])
+        session.commit()
+        session.expunge_all()
+
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_paths(self):
+        # instances coming from different queries
+        directors = Director.query.filter(Director.name < 'd2').all() + \
+                    [Director.get_by(name='d3')]
+        result, queries = count_queries(prefetch, directors,
+                                        'movies.actors', 'movies.director')
+        # one query per relationship (the directors of the movies are in the
+        # session already)
+        assert queries == 2
+
+        def names():
+            return [(m.title, m.director.name, [a.name for a in m.actors])
+                    for d in directors for m in d.movies]
+        result, queries = count_queries(names)
+        assert queries == 0
+        assert result[0] == ('m00', 'd0', ['a0', 'a1', 'a2'])
+        assert result[-1][:2] == ('m32', 'd3')
+
+    def test_expired_instances(self):
+        directors = Director.query.all()
+        movies = Movie.query.all()
+        session.commit()
+
+        # the keys are read from the identity of the expired directors
+        result, queries = count_queries(prefetch, directors, 'movies')
+        assert queries == 1
+
+        # the expired movies are refreshed at once to read their foreign key
+        session.commit()
+        result, queries = count_queries(prefetch, movies, 'director')
+        assert queries == 2
+        result, queries = count_queries(lambda: [m.director.name
+                                                 for m in movies])
+        assert queries == 0
+
+    def test_shared_instances(self):
+        movies = Movie.query.all()
+        sizes = []
+        old_load = loading.load_relationship
+        def load_relationship(instances, key):
+            sizes.append(len(instances))
+            return old_load(instances, key)
+        loading.load_relationship = load_relationship
+        try:
+            prefetch(movies, 'actors.movies.actors')
+        finally:
+            loading.load_relationship = old_load
+        # each actor and movie is only part of a level once, even though
+        # they are reached through several movies or actors
+        assert sizes == [12, 3, 12]
+
+    def test_empty_and_none(self):
+        movies = [Movie.get_by(title='m00'), None]
+        prefetch(movies, 'director.movies.actors')
+        result, queries = count_queries(lambda: len(movies[0].director.movies))
+        assert (result, queries) == (3, 0)
+        prefetch([], 'movies')
@@ -317,6 +317,35 @@ class TestManyToMany(object):
         assert b1 in a1.rel2
         assert b2 in a1.rel1
 
+    def test_multi_inverse_by_tablename(self):
+        class A(Entity):
+            name = Field(String(100))
+
+            rel1 = ManyToMany('B', tablename='a_b_1')
+            rel2 = ManyToMany('B', tablename='a_b_2')
+
+        class B(Entity):
+            name = Field(String(20))
+
+            as1 = ManyToMany('A', tablename='a_b_1')
+            as2 = ManyToMany('A', tablename='a_b_2')
+
+        setup_all(True)
+
+        assert A._descriptor.find_relationship('rel1').inverse is \
+               B._descriptor.find_relationship('as1')
+        assert A._descriptor.find_relationship('rel2').inverse is \
+               B._descriptor.find_relationship('as2')
+
+        a1 = A(name='a1', rel1=[B(name='b1')], rel2=[B(name='b2')])
+
+        session.commit()
+        session.expunge_all()
+
+        b1 = B.get_by(name='b1')
+        assert b1.as1[0].name == 'a1'
+        assert not b1.as2
+
     def test_selfref(self):
         class Person(Entity):
             using_options(shortnames=True)
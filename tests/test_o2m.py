@@ -248,3 +248,73 @@ class TestOneToMany(object):
         santa = Person.get_by(name="Santa Claus")
 
         assert Animal.get_by(name="Rudolph") in santa.pets
+
+    def test_ambiguous_inverse(self):
+        class A(Entity):
+            name = Field(String(60))
+            bs = OneToMany('B')
+
+        class B(Entity):
+            name = Field(String(60))
+            a1 = ManyToOne('A')
+            a2 = ManyToOne('A')
+
+        try:
+            setup_all()
+            assert False
+        except Exception, e:
+            assert 'Several relations match' in str(e)
+
+    def test_counter_cache(self):
+        class Director(Entity):
+            name = Field(String(60))
+            movies = OneToMany('Movie', counter_cache=True)
+
+        class Movie(Entity):
+            title = Field(String(60))
+            director = ManyToOne('Director')
+
+        setup_all(True)
+
+        d1 = Director(name='d1')
+        d2 = Director(name='d2')
+        m1 = Movie(title='m1', director=d1)
+        Movie(title='m2', director=d1)
+        session.commit()
+        assert (d1.movies_count, d2.movies_count) == (2, 0)
+
+        # reparent
+        m1.director = d2
+        session.commit()
+        assert (d1.movies_count, d2.movies_count) == (1, 1)
+
+        m1.delete()
+        Movie(title='m3')
+        session.commit()
+        assert (d1.movies_count, d2.movies_count) == (1, 0)
+
+        # bulk operations don't maintain the counter
+        Movie.bulk_insert([dict(title='m4', director_id=d2.id)])
+        Movie.delete_where({'title': 'm2'})
+        assert (d1.movies_count, d2.movies_count) == (1, 0)
+        Director.recount()
+        assert (d1.movies_count, d2.movies_count) == (0, 1)
+
+    def test_counter_cache_selfref(self):
+        class Person(Entity):
+            name = Field(String(60))
+            parent = ManyToOne('Person')
+            children = OneToMany('Person', counter_cache='num_children')
+
+        setup_all(True)
+
+        grampa = Person(name='grampa')
+        father = Person(name='father', parent=grampa)
+        Person(name='son', parent=father)
+        Person(name='daughter', parent=father)
+        session.commit()
+        assert [p.num_children for p in (grampa, father)] == [1, 2]
+
+        metadata.bind.execute(Person.table.update(), num_children=5)
+        Person.recount('children')
+        assert [p.num_children for p in (grampa, father)] == [1, 2]
@@ -0,0 +1,67 @@
+"""
+test the setup profiler
+"""
+
+from elixir import *
+from elixir.ext.versioned import acts_as_versioned
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestSetupProfile(object):
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_profile(self):
+        class A(Entity):
+            name = Field(String(60))
+            bs = OneToMany('B')
+            acts_as_versioned()
+
+        class B(Entity):
+            name = Field(String(60))
+            a = ManyToOne('A')
+
+        profile = setup_all(True, profile=True)
+
+        phases = dict((name, calls) for name, calls, duration
+                      in profile.sorted('phases'))
+        assert phases['setup_mapper'] == 1
+        assert len(phases) == 13
+
+        entity_names = [name for name, calls, duration
+                        in profile.sorted('entities', 'name', False)]
+        assert entity_names == ['%s.A' % __name__, '%s.B' % __name__]
+
+        builders = dict((name, calls) for name, calls, duration
+                        in profile.sorted('builders'))
+        assert builders['Field.create_non_pk_cols'] == 2
+        assert builders['ManyToOne.create_properties'] == 1
+        assert 'VersionedEntityBuilder.after_table' in builders
+
+        times = [duration for name, calls, duration
+                 in profile.sorted('builders')]
+        assert times == sorted(times, reverse=True)
+        assert profile.total >= max(times)
+
+        data = json.loads(profile.to_json())
+        assert len(data['phases']) == 13
+        assert A._descriptor.profile is None
+
+        # profiling is off by default
+        assert setup_all() is None
+
+    def test_invalid_category(self):
+        profile = setup_all(profile=True)
+        try:
+            profile.sorted('tables')
+            assert False
+        except ValueError:
+            pass
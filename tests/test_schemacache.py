@@ -0,0 +1,84 @@
+"""
+test the on-disk schema cache
+"""
+
+import os
+import tempfile
+
+from elixir import *
+from elixir.schemacache import SchemaCache
+
+
+def define_entities():
+    global A, B
+
+    class A(Entity):
+        name = Field(String(60))
+        bs = OneToMany('B')
+        tags = ManyToMany('B', tablename='a_tags')
+
+    class B(Entity):
+        name = Field(String(60))
+        a = ManyToOne('A')
+
+
+class TestSchemaCache(object):
+    def setup(self):
+        metadata.bind = 'sqlite://'
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.filename)
+
+    def teardown(self):
+        cleanup_all(True)
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def test_cache_written_and_reused(self):
+        define_entities()
+        setup_all(True, schema_cache=self.filename)
+        assert os.path.exists(self.filename)
+        cleanup_all(True)
+
+        define_entities()
+        cache = SchemaCache(self.filename)
+        assert cache.apply(entities)
+        assert A._descriptor.find_relationship('bs')._target is B
+        assert A._descriptor.find_relationship('bs')._inverse is \
+               B._descriptor.find_relationship('a')
+        assert A._descriptor.find_relationship('tags')._inverse is None
+
+        setup_all(True)
+
+        a = A(name='a1', bs=[B(name='b1')], tags=[B(name='b2')])
+        session.commit()
+        session.expunge_all()
+
+        b = B.get_by(name='b1')
+        assert b.a.name == 'a1'
+        assert A.query.one().tags[0].name == 'b2'
+
+    def test_stale_cache_ignored(self):
+        define_entities()
+        setup_all(True, schema_cache=self.filename)
+        cleanup_all(True)
+
+        class A(Entity):
+            name = Field(String(60))
+            using_options(tablename='other_a')
+
+        cache = SchemaCache(self.filename)
+        assert not cache.apply(entities)
+
+    def test_corrupted_cache_ignored(self):
+        f = open(self.filename, 'wb')
+        f.write('garbage')
+        f.close()
+
+        define_entities()
+        setup_all(True, schema_cache=self.filename)
+
+        a = A(name='a1', bs=[B(name='b1')])
+        session.commit()
+        assert SchemaCache(self.filename).load(
+            SchemaCache(self.filename).compute_key(entities)) is not None
@@ -0,0 +1,104 @@
+"""
+test snapshot and restore of the setup state
+"""
+
+from elixir import *
+
+
+def setup():
+    global Person, Employee, Group, snapshot
+
+    metadata.bind = 'sqlite://'
+
+    class Person(Entity):
+        name = Field(String(60))
+        group = ManyToOne('Group')
+        using_options(inheritance='multi')
+
+    class Employee(Person):
+        salary = Field(Integer)
+        using_options(inheritance='multi')
+
+    class Group(Entity):
+        name = Field(String(60))
+        members = OneToMany('Person')
+
+    setup_all(True)
+    snapshot = snapshot_all()
+
+def teardown():
+    cleanup_all(True)
+
+
+def delete_rows():
+    for table in reversed(metadata.sorted_tables):
+        table.delete().execute()
+
+
+class TestSnapshot(object):
+    def teardown(self):
+        snapshot.restore(drop_tables=True)
+        delete_rows()
+
+    def check_restored(self):
+        # the snapshot doesn't restore the data of the tables
+        delete_rows()
+
+        assert list(entities) == [Person, Employee, Group]
+        assert sorted(metadata.tables.keys()) == \
+               sorted([Person.table.name, Employee.table.name,
+                       Group.table.name])
+        assert Person._descriptor.children == [Employee]
+        assert sorted(Person.mapper.polymorphic_map.keys()) == \
+               ['employee', 'person']
+        assert not hasattr(Group, 'tags')
+        assert 'tags' not in [p.key for p in Group.mapper.iterate_properties]
+
+        g = Group(name='g1', members=[Employee(name='e1', salary=1)])
+        session.commit()
+        session.expunge_all()
+        assert Person.query.one().group.name == 'g1'
+
+    def test_restore(self):
+        class Manager(Employee):
+            bonus = Field(Integer)
+            using_options(inheritance='multi')
+
+        class Tag(Entity):
+            name = Field(String(60))
+            group = ManyToOne('Group', backref='tags')
+
+        setup_all(True)
+
+        g = Group(name='g1', tags=[Tag(name='t1')])
+        Manager(name='m1', bonus=2, group=g)
+        session.commit()
+
+        snapshot.restore(drop_tables=True)
+
+        assert Manager.mapper is None
+        assert Tag.table is None
+        self.check_restored()
+
+    def test_restore_again(self):
+        # entities with the same names can be declared again
+        class Tag(Entity):
+            name = Field(String(60))
+            group = ManyToOne('Group', backref='tags')
+
+        setup_all(True)
+        Group(name='g1', tags=[Tag(name='t1')])
+        session.commit()
+        snapshot.restore(drop_tables=True)
+
+        self.check_restored()
+
+    def test_snapshot_pending(self):
+        class Tag(Entity):
+            name = Field(String(60))
+
+        try:
+            snapshot_all()
+            assert False
+        except Exception, e:
+            assert 'Tag' in str(e)
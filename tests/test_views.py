@@ -0,0 +1,67 @@
+"""
+test the view classes of entities
+"""
+
+from elixir import *
+
+
+def setup():
+    metadata.bind = 'sqlite://'
+
+
+class TestViews(object):
+    def setup(self):
+        global Person, Employee
+
+        class Person(Entity):
+            name = Field(String(30))
+            _email = Field(String(30), colname='mail', synonym='email')
+            bio = Field(String(100), deferred=True)
+            using_options(order_by='name')
+
+        class Employee(Person):
+            salary = Field(Integer)
+
+        setup_all(True)
+
+        Person(name='p1', email='p1@x.org', bio='bio')
+        Employee(name='e1', salary=10)
+        Employee(name='e2', salary=20)
+        session.commit()
+        session.expunge_all()
+
+    def teardown(self):
+        cleanup_all(True)
+
+    def test_views(self):
+        views = list(Person.views())
+        assert [(v.name, v.email, v._email, v.bio) for v in views] == \
+               [('e1', None, None, None), ('e2', None, None, None),
+                ('p1', 'p1@x.org', 'p1@x.org', 'bio')]
+        assert isinstance(views[0], Person.View)
+        # no instance was loaded
+        assert len(session.identity_map) == 0
+
+        query = Employee.query.filter(Employee.salary > 10)
+        assert [v.salary for v in Employee.views(query)] == [20]
+
+    def test_pending_changes(self):
+        Person.get_by(name='p1').name = 'a1'
+        assert list(Person.views())[0].name == 'a1'
+
+    def test_read_only(self):
+        view = Person.View(name='p')
+        assert view.name == 'p' and view.id is None
+        assert view == Person.View(name='p')
+        assert hash(view) == hash(Person.View(name='p'))
+        try:
+            view.name = 'other'
+            assert False
+        except AttributeError:
+            pass
+        try:
+            view.other = 1
+            assert False
+        except AttributeError:
+            pass
+        assert not hasattr(view, '__dict__')